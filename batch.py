@@ -0,0 +1,118 @@
+from catalogue import ALPHABET, ROTOR_CATALOGUE, reflector_table, rotor_tables
+from plugboard import Plugboard
+import numpy as np
+
+
+class BatchEnigma:
+    """
+    Vectorised Enigma machine which encodes one message under many settings at once. Each settings dictionary is
+    compiled into rows of NumPy arrays, and the whole batch is then stepped and encoded with array operations:
+    1. Stepping - the rotor positions for every character of the message are computed for the whole batch, including
+    the double step, as index arithmetic
+    2. Encoding - the signal for every character and every setting is passed through each rotor, the reflector and
+    back again in one array lookup per part
+    Batches may mix 3 and 4 rotor machines; 3 rotor machines are padded with a fixed identity rotor.
+    """
+    def __init__(self, configs:list, rotor_box:dict = ROTOR_CATALOGUE):
+        self.configs = configs
+        self.size = len(configs)
+        self.rotor_count = max(len(config['rotors'].split(' ')) for config in configs)
+
+        identity = np.arange(26)
+        self.forward = np.tile(identity, (self.size, self.rotor_count, 1))
+        self.inverse = np.tile(identity, (self.size, self.rotor_count, 1))
+        self.notches = np.full((self.size, self.rotor_count), -1)
+        self.positions = np.zeros((self.size, self.rotor_count), dtype=int)
+        self.reflector = np.empty((self.size, 26), dtype=int)
+        self.plugboard = np.empty((self.size, 26), dtype=int)
+
+        for row, config in enumerate(configs):
+            rotor_names = config['rotors'].split(' ')
+            ring_settings = config['ring_settings'].split(' ')
+            initial_positions = config['initial_positions'].split(' ')
+            # Rotors are held right to left, as in CompiledEnigma
+            for slot, i in enumerate(range(len(rotor_names) - 1, -1, -1)):
+                # Wirings at position A, from the shared cache of compiled rotors
+                forward, inverse = rotor_tables(rotor_box[rotor_names[i]]['contacts'], int(ring_settings[i]))
+                self.forward[row, slot], self.inverse[row, slot] = forward[0], inverse[0]
+                notch = rotor_box[rotor_names[i]]['notch']
+                if notch:
+                    self.notches[row, slot] = ALPHABET.index(notch)
+                self.positions[row, slot] = ALPHABET.index(initial_positions[i])
+
+            # A rewired reflector (see CodeBreaker.codebreak5_rewiring) replaces the standard contacts
+            contacts = config.get('reflector_contacts') or rotor_box[config['reflector']]['contacts']
+            self.reflector[row] = reflector_table(contacts)
+
+            self.plugboard[row] = Plugboard(config).table
+
+    def step_positions(self, length:int) -> np.ndarray:
+        """
+        Computes the rotor positions in force for each of the next length characters, as in Rotor.key_press: the
+        rightmost rotor always rotates, the middle rotor rotates if either it or the rightmost rotor is on its notch,
+        and the third rotor rotates when the middle rotor is on its notch.
+
+        :param length: Number of key presses
+        :return: Array of shape (length, batch size, rotor count)
+        """
+        positions = self.positions.copy()
+        sequence = np.empty((length, self.size, self.rotor_count), dtype=int)
+        notches = self.notches
+        for t in range(length):
+            middle_on_notch = notches[:, 1] == positions[:, 1]
+            step_middle = middle_on_notch | (notches[:, 0] == positions[:, 0])
+            positions[:, 2] = (positions[:, 2] + middle_on_notch) % 26
+            positions[:, 1] = (positions[:, 1] + step_middle) % 26
+            positions[:, 0] = (positions[:, 0] + 1) % 26
+            sequence[t] = positions
+        return sequence
+
+    def encode(self, message:str) -> np.ndarray:
+        """
+        Encodes the message under every setting in the batch. Each machine starts from its initial positions, so the
+        batch can be encoded again with a different message.
+
+        :param message: The message to be decoded/encoded (upper case letters A-Z only)
+        :return: Array of shape (batch size, len(message)) of letter indices (0-25)
+        """
+        letters = self.message_indices(message)
+        positions = self.step_positions(len(letters))
+        rows = np.arange(self.size)
+
+        # signal has one row per character and one column per setting
+        signal = self.plugboard[:, letters].T
+        for slot in range(self.rotor_count):
+            offset = positions[:, :, slot]
+            signal = (self.forward[:, slot][rows, (signal + offset) % 26] - offset) % 26
+        signal = self.reflector[rows, signal]
+        for slot in range(self.rotor_count - 1, -1, -1):
+            offset = positions[:, :, slot]
+            signal = (self.inverse[:, slot][rows, (signal + offset) % 26] - offset) % 26
+        signal = self.plugboard[rows, signal]
+        return signal.T.astype(np.uint8)
+
+    @staticmethod
+    def message_indices(message:str) -> np.ndarray:
+        """ Converts a message of upper case letters into an array of letter indices (0-25) """
+        letters = np.frombuffer(message.encode('ascii'), dtype=np.uint8).astype(int) - ord('A')
+        if np.any((letters < 0) | (letters > 25)):
+            raise ValueError("Batch encoding only accepts upper case letters A-Z")
+        return letters
+
+    @staticmethod
+    def texts(encoded:np.ndarray) -> list:
+        """ Converts the rows of an encoded array back into strings """
+        return [row.tobytes().decode('ascii') for row in (encoded + ord('A')).astype(np.uint8)]
+
+    @staticmethod
+    def contains(encoded:np.ndarray, crib:str) -> np.ndarray:
+        """
+        Checks every row of an encoded array for the crib
+
+        :return: Boolean array with one entry per row, True where the crib appears
+        """
+        crib = BatchEnigma.message_indices(crib)
+        if len(crib) > encoded.shape[1]:
+            return np.zeros(encoded.shape[0], dtype=bool)
+        windows = np.lib.stride_tricks.sliding_window_view(encoded, len(crib), axis=1)
+        return (windows == crib).all(axis=2).any(axis=1)
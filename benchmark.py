@@ -0,0 +1,346 @@
+from enigma import Enigma
+from engine import CompiledEnigma
+from plugboard import Plugboard
+from codebreak import CodeBreaker
+from codebreaker_tasks import TASK_SETTINGS
+from catalogue import ALPHABET
+from results import open_sink
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# Machines benchmarked, by rotor count
+MACHINES = {3: {'rotors': 'I II III',
+                'reflector': 'B',
+                'ring_settings': '1 5 12',
+                'initial_positions': 'Q E V',
+                'plugboard_pairs': 'AB CD EF GH IJ KL MN OP QR ST'},
+            4: {'rotors': 'Beta I II III',
+                'reflector': 'B',
+                'ring_settings': '3 1 5 12',
+                'initial_positions': 'R Q E V',
+                'plugboard_pairs': 'AB CD EF GH IJ KL MN OP QR ST'}}
+# Message lengths, and the number of messages encoded in each run, as (full, quick)
+MESSAGES = {'short': ((10, 2000), (10, 200)),
+            'long': ((10000, 1), (1000, 1))}
+# Length of the message encoded as bytes, as (full, quick)
+HUGE_MESSAGE = (1 << 22, 1 << 19)
+# Machines built in each run of the construction benchmarks, as (full, quick)
+CONSTRUCTIONS = (200, 20)
+# Candidates searched in each run of the codebreaker benchmarks (None for every candidate), as (full, quick), with the
+# candidate generator and run_search options each task uses. The spaces are scaled down so that every benchmark can be
+# run in a few seconds.
+TASKS = {'codebreak1_reflector': ('reflector_candidates', (None, None), {}),
+         'codebreak2_positions': ('position_candidates', (2000, 200), {'positions_only': True}),
+         'codebreak3_multi': ('multi_candidates', (1000, 100), {}),
+         'codebreak4_plugleads': ('pluglead_candidates', (None, 200), {'plugboard_only': True}),
+         'codebreak5_rewiring': ('rewiring_candidates', (3000, 300), {'reflector_only': True})}
+# Codebreaker tasks timed at each number of workers, to measure how the searches scale across processes, with the
+# candidates searched in each run as (full, quick). The largest worker count is the number of CPUs (at least 2).
+SCALING_TASKS = {'codebreak3_multi': (None, 1000),
+                 'codebreak2_positions': (None, 2000)}
+WORKER_COUNTS = (1, max(2, os.cpu_count() or 1))
+
+# Benchmark functions by name, see benchmark
+BENCHMARKS = {}
+
+
+def benchmark(name:str):
+    """
+    Registers a benchmark. The decorated function takes quick (True for the scaled-down sizes used by tests) and
+    returns (run, unit): run is called once per timed run and returns the number of units of work it did.
+    """
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def random_message(length:int, seed:int = 0) -> str:
+    """ Returns a repeatable message of random letters A-Z """
+    generator = random.Random(seed)
+    return ''.join(generator.choice(ALPHABET) for _ in range(length))
+
+
+def register_machine_benchmarks():
+    """ Registers the construction and encoding benchmarks for each machine in MACHINES """
+    for rotor_count, settings in MACHINES.items():
+        register_construction(f'construct_enigma_{rotor_count}_rotors', settings, enigma_machine)
+        register_construction(f'construct_compiled_{rotor_count}_rotors', settings, CompiledEnigma)
+        for length_name in MESSAGES:
+            register_encoding(f'encode_{length_name}_{rotor_count}_rotors', settings, length_name, enigma_machine)
+            register_encoding(f'encode_compiled_{length_name}_{rotor_count}_rotors', settings, length_name,
+                              CompiledEnigma)
+        register_bytes_encoding(f'encode_bytes_huge_{rotor_count}_rotors', settings)
+
+
+def enigma_machine(settings:dict) -> Enigma:
+    """ Builds an Enigma from its settings, as main.py does """
+    machine = Enigma(settings)
+    machine.create_machinery()
+    return machine
+
+
+def register_construction(name:str, settings:dict, build):
+    """ Registers a benchmark of the machines built per second by build(settings) """
+    @benchmark(name)
+    def construction(quick:bool):
+        count = CONSTRUCTIONS[quick]
+
+        def run():
+            for _ in range(count):
+                build(settings)
+            return count
+        return run, 'machines'
+
+
+def register_encoding(name:str, settings:dict, length_name:str, build):
+    """ Registers a benchmark of the characters per second encoded by a machine from build(settings) """
+    @benchmark(name)
+    def encoding(quick:bool):
+        length, count = MESSAGES[length_name][quick]
+        message = random_message(length)
+        machine = build(settings)
+
+        def run():
+            for _ in range(count):
+                machine.encode(message)
+            return length * count
+        return run, 'characters'
+
+
+def register_bytes_encoding(name:str, settings:dict):
+    """ Registers a benchmark of the bytes per second encoded by CompiledEnigma.encode_into, for a very long message """
+    @benchmark(name)
+    def encoding(quick:bool):
+        length = HUGE_MESSAGE[quick]
+        message = random_message(length).encode()
+        out = bytearray(length)
+        machine = CompiledEnigma(settings)
+
+        def run():
+            machine.encode_into(message, out)
+            return length
+        return run, 'characters'
+
+
+register_machine_benchmarks()
+
+
+@benchmark('plugboard_encode')
+def plugboard_encode(quick:bool):
+    """ Characters per second through a Plugboard with 10 leads """
+    length, count = MESSAGES['long'][quick]
+    message = random_message(length)
+    board = Plugboard(MACHINES[3])
+
+    def run():
+        for character in message:
+            board.encode(character)
+        return length
+    return run, 'characters'
+
+
+@benchmark('batch_encode_4_rotors')
+def batch_encode(quick:bool):
+    """ Characters per second encoded by the NumPy BatchEnigma, over a batch of start positions """
+    from batch import BatchEnigma
+
+    configs = [dict(MACHINES[4], initial_positions=' '.join(('R',) + positions))
+               for positions in itertools.islice(itertools.product(ALPHABET, repeat=3), 256 if quick else 4096)]
+    message = random_message(MESSAGES['short'][quick][0] * 5)
+    machine = BatchEnigma(configs)
+
+    def run():
+        machine.encode(message)
+        return len(message) * len(configs)
+    return run, 'characters'
+
+
+def register_task_benchmarks():
+    """ Registers a candidates per second benchmark for each codebreaker task, for each backend """
+    for task, (generator, limits, options) in TASKS.items():
+        for backend in ('compiled', 'batch'):
+            register_task(f'{task}_{backend}', task, generator, limits, options, backend)
+    for task, limits in SCALING_TASKS.items():
+        generator, _, options = TASKS[task]
+        for workers in WORKER_COUNTS:
+            register_task(f'{task}_workers_{workers}', task, generator, limits, options, 'compiled', workers)
+
+
+def register_task(name:str, task:str, generator:str, limits:tuple, options:dict, backend:str, workers:int = 1):
+    """
+    Registers a benchmark of the candidates per second searched by a codebreaker task, on a scaled-down space, with
+    the search shared between workers processes
+    """
+    @benchmark(name)
+    def search(quick:bool):
+        if backend == 'batch':
+            # Fails here, before timing, if NumPy is not installed
+            import batch
+        limit = limits[quick]
+
+        def run():
+            # Results go to a temporary directory, so the codebreak.txt of a real run is left alone
+            with tempfile.TemporaryDirectory() as directory:
+                sink = open_sink('text', os.path.join(directory, 'codebreak.txt'))
+                e = CodeBreaker(TASK_SETTINGS[task], backend=backend, workers=workers, sink=sink)
+                e.name = task
+                e.attempt = 1
+                e.run_search(itertools.islice(getattr(e, generator)(), limit), **options)
+                sink.close()
+            return e.candidates_searched
+        return run, 'candidates'
+
+
+register_task_benchmarks()
+
+
+def time_benchmark(name:str, quick:bool = False, repeat:int = 5) -> dict:
+    """
+    Times a benchmark: one untimed run to warm up caches, then repeat timed runs
+
+    :param name: The benchmark name (see BENCHMARKS)
+    :param quick: Use the scaled-down sizes
+    :param repeat: Number of timed runs
+    :return: The unit of work, the work done per run, the seconds each run took, and the best and median rates
+    """
+    run, unit = BENCHMARKS[name](quick)
+    items = run()
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = run()
+        seconds.append(time.perf_counter() - start)
+    return {'unit': unit,
+            'items': items,
+            'seconds': seconds,
+            'best_rate': items / min(seconds),
+            'median_rate': items / statistics.median(seconds)}
+
+
+def run_benchmarks(names:list = None, quick:bool = False, repeat:int = 5, report=None) -> dict:
+    """
+    Runs the named benchmarks (all of them by default), skipping any whose dependencies are missing
+
+    :param names: Benchmark names, or substrings of them
+    :param quick: Use the scaled-down sizes
+    :param repeat: Number of timed runs of each benchmark
+    :param report: Function called with a line for each benchmark as it finishes, i.e. print
+    :return: The results with the Python version, platform and time of the run, ready to be saved as JSON
+    """
+    selected = [name for name in BENCHMARKS if names is None or any(part in name for part in names)]
+    results = {}
+    for name in selected:
+        try:
+            results[name] = time_benchmark(name, quick, repeat)
+        except ImportError as error:
+            results[name] = {'skipped': str(error)}
+        if report is not None:
+            report(benchmark_line(name, results[name]))
+    return {'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'processor': platform.machine(),
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'quick': quick,
+            'repeat': repeat,
+            'benchmarks': results}
+
+
+def benchmark_line(name:str, result:dict) -> str:
+    """ Returns a one line report of a benchmark result """
+    if 'skipped' in result:
+        return f"{name}: skipped ({result['skipped']})"
+    return f"{name}: {result['median_rate']:,.0f} {result['unit']}/s (best {result['best_rate']:,.0f})"
+
+
+def compare(old:dict, new:dict) -> list:
+    """
+    Compares the median rates of two runs of the benchmarks, i.e. before and after a change
+
+    :param old: Results of the earlier run (see run_benchmarks)
+    :param new: Results of the later run
+    :return: A line for each benchmark in both, with the ratio of the new rate to the old (above 1 is faster)
+    """
+    lines = []
+    for name, result in new['benchmarks'].items():
+        previous = old['benchmarks'].get(name)
+        if previous is None or 'skipped' in result or 'skipped' in previous:
+            continue
+        ratio = result['median_rate'] / previous['median_rate']
+        lines.append(f"{name}: {previous['median_rate']:,.0f} -> {result['median_rate']:,.0f} "
+                     f"{result['unit']}/s ({ratio:.2f}x)")
+    return lines
+
+
+def scaling(results:dict) -> list:
+    """
+    Reports how each codebreaker search scales with workers (see SCALING_TASKS)
+
+    :param results: Results of a run (see run_benchmarks)
+    :return: A line for each task timed at more than one worker count, with the speedup over a single worker and the
+    parallel efficiency (speedup per worker, 1.00 being linear)
+    """
+    lines = []
+    for task in SCALING_TASKS:
+        single = results['benchmarks'].get(f'{task}_workers_1')
+        if single is None or 'skipped' in single:
+            continue
+        for workers in WORKER_COUNTS[1:]:
+            result = results['benchmarks'].get(f'{task}_workers_{workers}')
+            if result is None or 'skipped' in result:
+                continue
+            speedup = result['median_rate'] / single['median_rate']
+            lines.append(f"{task}: {workers} workers {speedup:.2f}x one worker "
+                         f"({speedup / workers:.2f} efficiency, {os.cpu_count()} CPUs)")
+    return lines
+
+
+def get_args():
+    """
+    Obtain arguments as specified by the user input and parse them
+    return args: parsed arguments
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the Enigma machine and the codebreaker searches')
+    parser.add_argument('--output', type=str, default='benchmark.json',
+                        help='JSON file to save the results to')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='JSON results of an earlier run to compare against')
+    parser.add_argument('--filter', type=str, nargs='*', default=None,
+                        help='Only run benchmarks whose names contain one of these, i.e. "encode codebreak2"')
+    parser.add_argument('--quick', default=None, action='store_true',
+                        help='Use scaled-down sizes, for a fast check rather than a measurement')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of timed runs of each benchmark; the best and median are reported')
+    parser.add_argument('--list', default=None, action='store_true',
+                        help='List the benchmarks and exit')
+    args = parser.parse_args()
+    assert args.repeat >= 1, '--repeat must be at least 1'
+    return args
+
+
+if __name__ == "__main__":
+
+    args = get_args()
+    if args.list:
+        print('\n'.join(BENCHMARKS))
+        sys.exit()
+
+    results = run_benchmarks(args.filter, bool(args.quick), args.repeat, report=print)
+    print('\n'.join(scaling(results)))
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print('\n'.join(compare(json.load(f), results)))
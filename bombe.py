@@ -0,0 +1,240 @@
+from engine import CompiledEnigma, NEXT_POSITION
+from catalogue import ALPHABET, ROTOR_CATALOGUE
+from cribs import crib_alignments
+
+# Plug value of a letter whose plug has not been worked out yet
+UNKNOWN_PLUG = -1
+
+
+class Menu:
+    """
+    The letter connections made by placing a crib against the code at an offset, as used by the Turing bombe. Each
+    crib letter is joined to the code letter beneath it by the scrambler (rotors and reflector) at that key press, so
+    for a plugboard P and the scrambler S at that key press, P(code letter) = S(P(crib letter)) and vice versa.
+    Letters joined directly or through other letters form a component; a component with more links than letters
+    contains closed loops, which make most wrong rotor positions contradict themselves.
+    """
+    def __init__(self, code:str, crib:str, offset:int):
+        """
+        :param code: The encoded message
+        :param crib: A known word in the decoded message
+        :param offset: The offset into the code at which the crib is placed
+        """
+        self.crib = crib
+        self.offset = offset
+        # For each letter index, the (other letter index, index into the crib) of each link to it
+        self.links = [[] for _ in range(26)]
+        for i, (crib_char, code_char) in enumerate(zip(crib, code[offset:offset + len(crib)])):
+            first, second = ALPHABET.index(crib_char), ALPHABET.index(code_char)
+            self.links[first].append((second, i))
+            self.links[second].append((first, i))
+
+        # Components, largest first, each as (letter to test hypotheses on, letters in the component)
+        self.components = []
+        seen = set()
+        for letter in sorted(range(26), key=lambda letter: -len(self.links[letter])):
+            if letter in seen or not self.links[letter]:
+                continue
+            component = [letter]
+            seen.add(letter)
+            for member in component:
+                for other, _ in self.links[member]:
+                    if other not in seen:
+                        seen.add(other)
+                        component.append(other)
+            # The first letter reached is the most connected in the component, which gives the most implications
+            self.components.append((letter, component))
+        self.components.sort(key=lambda component: -sum(len(self.links[letter]) for letter in component[1]))
+
+    def loops(self) -> int:
+        """ Returns the number of closed loops in the menu """
+        links = sum(len(letter_links) for letter_links in self.links) // 2
+        letters = sum(len(component) for _, component in self.components)
+        return links - letters + len(self.components)
+
+
+class Bombe:
+    """
+    Tests start positions of one machine (rotors, ring settings and reflector) against crib menus, as the Turing bombe
+    did. For each start position, a plugboard hypothesis for the test letter of the menu is followed through every link
+    of the menu (and, as with Welchman's diagonal board, through the pairing of plugged letters), until it contradicts
+    itself or has been followed everywhere. A start position with a hypothesis which never contradicts itself is a
+    stop, and comes with the plugs the hypothesis implies.
+    The scrambler for each key press is worked out from the tables of the rightmost rotor and a cached table for the
+    rest of the rotors and the reflector, which only changes when the middle rotor turns.
+    """
+    def __init__(self, settings:dict, rotor_box:dict = ROTOR_CATALOGUE, max_leads:int = 10):
+        """
+        :param settings: The machine settings; only rotors, ring_settings, reflector (and reflector_contacts) are used
+        :param rotor_box: Rotor and reflector wirings (see Enigma.rotor_box)
+        :param max_leads: The most plugboard leads a stop may use
+        """
+        positions = ' '.join('A' for _ in settings['rotors'].split(' '))
+        self.machine = CompiledEnigma(dict(settings, initial_positions=positions, plugboard_pairs=''), rotor_box)
+        self.max_leads = max_leads
+        # Tables for the middle and leftmost rotors and the reflector, by rotor positions (rightmost rotor excluded)
+        self.inner_tables = {}
+
+    def inner_table(self, positions:tuple) -> tuple:
+        """ Returns the path from the middle rotor, via the reflector, back to the middle rotor at the positions """
+        table = self.inner_tables.get(positions)
+        if table is None:
+            machine = self.machine
+            machine.positions[1:] = positions
+            forward_1, forward_2 = machine.forward[1][positions[0]], machine.forward[2][positions[1]]
+            inverse_1, inverse_2 = machine.inverse[1][positions[0]], machine.inverse[2][positions[1]]
+            reflector = machine.effective_reflector()
+            table = self.inner_tables[positions] = tuple(inverse_1[inverse_2[reflector[forward_2[forward_1[signal]]]]]
+                                                         for signal in range(26))
+        return table
+
+    def scramblers(self, initial_positions:str, length:int) -> list:
+        """
+        Returns, for each of the next length key presses from the start positions, the (forward, inner, inverse)
+        tables which together give the scrambler: S(x) = inverse[inner[forward[x]]]
+        """
+        positions = [ALPHABET.index(letter) for letter in reversed(initial_positions.split(' '))]
+        notch_0, notch_1 = self.machine.notches[:2]
+        forward_0, inverse_0 = self.machine.forward[0], self.machine.inverse[0]
+        fixed = tuple(positions[3:])
+        position_0, position_1, position_2 = positions[:3]
+        steps = []
+        for _ in range(length):
+            # Rotate the rotors (see CompiledEnigma.key_press)
+            if notch_0 == position_0 or notch_1 == position_1:
+                if notch_1 == position_1:
+                    position_2 = NEXT_POSITION[position_2]
+                position_1 = NEXT_POSITION[position_1]
+            position_0 = NEXT_POSITION[position_0]
+            steps.append((forward_0[position_0], self.inner_table((position_1, position_2) + fixed),
+                          inverse_0[position_0]))
+        return steps
+
+    def follow(self, plugs:list, letter:int, plugged:int, menu:Menu, steps:list) -> bool:
+        """
+        Follows the hypothesis that letter is plugged to plugged through the menu, filling in plugs
+
+        :param plugs: The plug of each letter index, or UNKNOWN_PLUG; updated in place
+        :param steps: The scramblers for each letter of the crib (see scramblers)
+        :return: False if the hypothesis contradicts itself or the plugs already known
+        """
+        links = menu.links
+        # Letters whose links have been followed
+        followed = [False] * 26
+        pending = [(letter, plugged)]
+        while pending:
+            first, second = pending.pop()
+            plug = plugs[first]
+            if plug == UNKNOWN_PLUG:
+                if plugs[second] != UNKNOWN_PLUG:
+                    # second is already plugged to another letter
+                    return False
+                plugs[first] = second
+                plugs[second] = first
+            elif plug != second:
+                return False
+            # Each link from first gives the plug of the letter at its other end, and likewise for second
+            for letter, partner in ((first, second), (second, first)):
+                if not followed[letter]:
+                    followed[letter] = True
+                    for other, i in links[letter]:
+                        forward, inner, inverse = steps[i]
+                        pending.append((other, inverse[inner[forward[partner]]]))
+        return sum(plug > letter for letter, plug in enumerate(plugs)) <= self.max_leads
+
+    def hypotheses(self, plugs:list, test_letter:int, menu:Menu, steps:list) -> list:
+        """ Returns the plugs implied by each hypothesis for test_letter which does not contradict itself """
+        if plugs[test_letter] != UNKNOWN_PLUG:
+            trial = list(plugs)
+            return [trial] if self.follow(trial, test_letter, plugs[test_letter], menu, steps) else []
+        consistent = []
+        for plugged in range(26):
+            trial = list(plugs)
+            if self.follow(trial, test_letter, plugged, menu, steps):
+                consistent.append(trial)
+        return consistent
+
+    def stops(self, initial_positions:str, menu:Menu, known_plugs:list) -> list:
+        """
+        Tests the start positions against the menu
+
+        :param initial_positions: Space-separated start positions, as in settings['initial_positions']
+        :param menu: The crib menu
+        :param known_plugs: The plug of each letter index known beforehand, or UNKNOWN_PLUG
+        :return: The plugs implied by each stop (empty if the start positions are ruled out)
+        """
+        steps = self.scramblers(initial_positions, menu.offset + len(menu.crib))[menu.offset:]
+        (test_letter, _), *others = menu.components
+        stops = []
+        for plugs in self.hypotheses(known_plugs, test_letter, menu, steps):
+            # The other components must each allow a hypothesis too; if only one, its plugs are known as well
+            for other_letter, _ in others:
+                consistent = self.hypotheses(plugs, other_letter, menu, steps)
+                if not consistent:
+                    break
+                if len(consistent) == 1:
+                    plugs = consistent[0]
+            else:
+                stops.append(plugs)
+        return stops
+
+
+def known_plugs(plugboard_pairs:str) -> list:
+    """
+    Returns the plug of each letter index known from settings['plugboard_pairs']. 'UNKNOWN' leaves every plug unknown,
+    and leads with '?' plugs are ignored. If every lead is known, every other letter is known to be unplugged.
+    """
+    plugs = [UNKNOWN_PLUG] * 26
+    if plugboard_pairs == 'UNKNOWN':
+        return plugs
+    pairs = [pair for pair in plugboard_pairs.split(' ') if pair]
+    for pair in pairs:
+        if '?' not in pair:
+            first, second = ALPHABET.index(pair[0]), ALPHABET.index(pair[1])
+            plugs[first], plugs[second] = second, first
+    if not any('?' in pair for pair in pairs):
+        plugs = [letter if plug == UNKNOWN_PLUG else plug for letter, plug in enumerate(plugs)]
+    return plugs
+
+
+def plug_pairs(plugs:list) -> str:
+    """ Returns the leads among the plugs as a plugboard_pairs string, i.e. 'AB CD' """
+    return ' '.join(ALPHABET[letter] + ALPHABET[plug] for letter, plug in enumerate(plugs) if plug > letter)
+
+
+def find_stops(code:str, crib, configs:list, crib_offsets:list = None) -> tuple:
+    """
+    Runs the bombe over each candidate settings dictionary, with a menu for each crib at each offset it could take.
+    Kept at module level so that it can be sent to worker processes.
+
+    :param code: The encoded message
+    :param crib: A known word (or list of words) in the decoded message
+    :param configs: List of candidate settings dictionaries, with 'UNKNOWN' plugboard_pairs if the plugboard is unknown
+    :param crib_offsets: The known or possible offsets of the crib in the code (defaults to every possible offset)
+    :return: (stops, tests) - a list of (index into configs, settings with the plugs found by the stop, decoded
+    message) for each stop, and the number of start positions tested against a menu
+    """
+    cribs = crib if isinstance(crib, list) else [crib]
+    menus = [Menu(code, crib, offset) for crib, offsets in crib_alignments(code, cribs, crib_offsets)
+             for offset in offsets]
+    bombes = {}
+    stops = []
+    tests = 0
+    for row, settings in enumerate(configs):
+        key = (settings['rotors'], settings['ring_settings'], settings['reflector'], settings.get('reflector_contacts'))
+        bombe = bombes.get(key)
+        if bombe is None:
+            bombe = bombes[key] = Bombe(settings)
+        plugs = known_plugs(settings['plugboard_pairs'])
+        found = set()
+        for menu in menus:
+            tests += 1
+            for stop in bombe.stops(settings['initial_positions'], menu, plugs):
+                # The same plugs may be found from more than one menu
+                pairs = plug_pairs(stop)
+                if pairs in found:
+                    continue
+                found.add(pairs)
+                stop_settings = dict(settings, plugboard_pairs=pairs)
+                stops.append((row, stop_settings, CompiledEnigma(stop_settings).encode(code)))
+    return stops, tests
@@ -0,0 +1,79 @@
+from types import MappingProxyType
+import functools
+import string
+
+ALPHABET = string.ascii_uppercase
+
+# The fixed wirings of every machine part. Read only, so that it can be shared by every machine; Enigma.rotor_box is
+# a per-machine copy of it.
+ROTOR_CATALOGUE = MappingProxyType({
+    "Housing": MappingProxyType({'contacts': 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'notch': None}),
+    "Beta": MappingProxyType({'contacts': 'LEYJVCNIXWPBQMDRTAKZGFUHOS', 'notch': None}),
+    "Gamma": MappingProxyType({'contacts': 'FSOKANUERHMBTIYCWLQPZXVGJD', 'notch': None}),
+    "I": MappingProxyType({'contacts': 'EKMFLGDQVZNTOWYHXUSPAIBRCJ', 'notch': 'Q'}),
+    "II": MappingProxyType({'contacts': 'AJDKSIRUXBLHWTMCQGZNPYFVOE', 'notch': 'E'}),
+    "III": MappingProxyType({'contacts': 'BDFHJLCPRTXVZNYEIWGAKMUSQO', 'notch': 'V'}),
+    "IV": MappingProxyType({'contacts': 'ESOVPZJAYQUIRHXLNFTGKDCMWB', 'notch': 'J'}),
+    "V": MappingProxyType({'contacts': 'VZBRGITYUPSDNHLXAWMJQOFECK', 'notch': 'Z'}),
+    "A": MappingProxyType({'contacts': 'EJMZALYXVBWFCRQUONTSPIKHGD', 'notch': None}),
+    "B": MappingProxyType({'contacts': 'YRUHQSLDPXNGOKMIEBFZCWVJAT', 'notch': None}),
+    "C": MappingProxyType({'contacts': 'FVPJIAOYEDRZXWGCTKUQSBNMHL', 'notch': None}),
+})
+
+# Rotors which only fit the leftmost slot of a 4 rotor machine (the M4), where no other rotor fits
+THIN_ROTORS = frozenset({'Beta', 'Gamma'})
+# Parts of the catalogue which are reflectors rather than rotors
+REFLECTORS = ('A', 'B', 'C')
+
+
+@functools.lru_cache(maxsize=256)
+def rotor_tables(contacts:str, ring_setting:int = 1) -> tuple:
+    """
+    Builds the forward and inverse tables for a rotor. Each table is indexed first by rotor position and then by the
+    signal index entering the rotor, and gives the signal index leaving the rotor, so the rotation of the rotor is
+    already accounted for. Results are cached by wiring and ring setting (there are 7 rotors x 26 ring settings in
+    the catalogue) and shared by every machine, so are returned as tuples.
+
+    :param contacts: The rotor wiring as a 26 letter string (see ROTOR_CATALOGUE)
+    :param ring_setting: An integer from 1-26 determining the pin-to-contact mapping for the rotor
+    :return: (forward, inverse) - two tuples of 26 tuples of 26 integers
+    """
+    shift = ring_setting - 1
+    # Ring setting shifts the whole wiring round by the same number of places as the ring
+    wiring = [0] * 26
+    for pin, contact in enumerate(contacts):
+        wiring[(pin + shift) % 26] = (ALPHABET.index(contact) + shift) % 26
+    wiring_inverse = [0] * 26
+    for pin, contact in enumerate(wiring):
+        wiring_inverse[contact] = pin
+
+    forward = tuple(tuple((wiring[(i + position) % 26] - position) % 26 for i in range(26)) for position in range(26))
+    inverse = tuple(tuple((wiring_inverse[(i + position) % 26] - position) % 26 for i in range(26))
+                    for position in range(26))
+    return forward, inverse
+
+
+@functools.lru_cache(maxsize=1024)
+def reflector_table(contacts:str) -> tuple:
+    """
+    Converts reflector contacts into a tuple of 26 signal indices. Cached by wiring, so each rewired reflector (see
+    CodeBreaker.codebreak5_rewiring) has its own entry.
+    """
+    return tuple(ALPHABET.index(contact) for contact in contacts)
+
+
+def cache_stats() -> dict:
+    """ Returns the hits, misses, size and hit rate of the rotor and reflector table caches """
+    stats = {}
+    for name, cache in (('rotor_tables', rotor_tables), ('reflector_table', reflector_table)):
+        info = cache.cache_info()
+        lookups = info.hits + info.misses
+        stats[name] = {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'maxsize': info.maxsize,
+                       'hit_rate': info.hits / lookups if lookups else 0.0}
+    return stats
+
+
+def clear_caches():
+    """ Empties the rotor and reflector table caches """
+    rotor_tables.cache_clear()
+    reflector_table.cache_clear()
@@ -0,0 +1,93 @@
+import json
+import os
+import time
+
+
+class Checkpoint:
+    """
+    Progress of a run of codebreaker searches, saved to a small JSON file so that an interrupted run can carry on from
+    where it was. For each search (by task name) it holds the cursor - the number of candidates searched, in candidate
+    order - along with the attempt number, counters, any top scoring results kept so far and whether the search is
+    complete. Results written before the checkpoint are already in the results file, which also has its size at the
+    checkpoint recorded, so that anything written after it can be cut off on resuming rather than written twice.
+    """
+    def __init__(self, path:str = 'codebreak_checkpoint.json', interval:float = 30.0, report=None):
+        """
+        :param path: The checkpoint file
+        :param interval: Seconds between checkpoints during a search
+        :param report: Function called with a progress line (candidates/s and ETA) at each checkpoint, i.e. print
+        """
+        self.path = path
+        self.interval = interval
+        self.report = report
+        self.state = {'tasks': {}, 'results_size': 0}
+        self.last_save = time.perf_counter()
+
+    def load(self) -> 'Checkpoint':
+        """ Reads the checkpoint file, if there is one """
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.state = json.load(f)
+        return self
+
+    def clear(self):
+        """ Forgets all progress and removes the checkpoint file """
+        self.state = {'tasks': {}, 'results_size': 0}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def task(self, name:str) -> dict:
+        """ Returns the saved progress of the named search, or None if it has not been started """
+        return self.state['tasks'].get(name)
+
+    def due(self) -> bool:
+        """ True if the last checkpoint was at least interval seconds ago """
+        return time.perf_counter() - self.last_save >= self.interval
+
+    def truncate_results(self, results_path:str):
+        """ Cuts the results file back to its size at the checkpoint, removing results written since """
+        if os.path.exists(results_path) and os.path.getsize(results_path) > self.state['results_size']:
+            with open(results_path, 'r+b') as f:
+                f.truncate(self.state['results_size'])
+
+    def save(self, name:str, progress:dict, results_path:str, results_size:int = None):
+        """
+        Records the progress of the named search and writes the checkpoint file. The results must have been flushed
+        to the results file first.
+
+        :param name: The search (task) name
+        :param progress: The search progress: cursor, attempt, characters_decoded, seconds, planned (the number of
+        candidates, if known), ranked and complete
+        :param results_path: The results file
+        :param results_size: The size of the results file the progress goes with, if results have been written since
+        (defaults to its size now)
+        """
+        rate = progress['cursor'] / progress['seconds'] if progress['seconds'] else 0.0
+        progress = dict(progress, rate=rate, eta_seconds=None)
+        if progress['planned'] is not None and rate:
+            progress['eta_seconds'] = max(progress['planned'] - progress['cursor'], 0) / rate
+        self.state['tasks'][name] = progress
+        if results_size is None:
+            results_size = os.path.getsize(results_path) if os.path.exists(results_path) else 0
+        self.state['results_size'] = results_size
+
+        # Write to a temporary file first, so that an interruption never leaves a partly written checkpoint
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.state, f)
+        os.replace(self.path + '.tmp', self.path)
+        self.last_save = time.perf_counter()
+        if self.report is not None:
+            self.report(self.progress_line(name))
+
+    def progress_line(self, name:str) -> str:
+        """ Returns a one line report of the named search's progress """
+        progress = self.state['tasks'][name]
+        planned = f"/{progress['planned']}" if progress['planned'] is not None else ""
+        if progress['complete']:
+            eta = "complete"
+        elif progress['eta_seconds'] is not None:
+            eta = f"ETA {progress['eta_seconds']:.0f}s"
+        else:
+            eta = "ETA unknown"
+        return (f"checkpoint {name}: {progress['cursor']}{planned} candidates, "
+                f"{progress['rate']:.0f} candidates/s, {eta}")
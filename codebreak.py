@@ -1,21 +1,237 @@
-from enigma import Enigma
+from engine import CompiledEnigma
+from catalogue import ALPHABET, ROTOR_CATALOGUE
+from plugboard import Plugboard
+from parallel import chunked, run_parallel
+from cribs import crib_alignments, crib_matcher
+from results import SearchResult, open_sink
+from scoring import get_scorer
+from hillclimb import climb_plugboards
+from bombe import find_stops
+from searchspace import SearchSpace
+import functools
+import heapq
 import itertools
+import time
+
+# Most cribs the batch backend looks for with an array scan per crib, rather than with a cribs.CribMatcher
+BATCH_CRIBS = 2
+
+
+def find_hits(code:str, crib, backend:str, configs:list, early_abort:bool = False, crib_offsets:list = None,
+              plugboard_only:bool = False, reflector_only:bool = False, positions_only:bool = False, scorer:str = None,
+              top_k:int = 10) -> tuple:
+    """
+    Decrypts the code under each candidate settings dictionary and returns the candidates whose decryption contains
+    the crib (or any of the cribs, if crib is a list), or with a scorer, the top_k best scoring candidates. Kept at
+    module level so that it can be sent to worker processes.
+
+    :param code: The encoded message
+    :param crib: A known word (or list of words) in the decoded message
+    :param backend: 'compiled' or 'batch' (see CodeBreaker)
+    :param configs: List of candidate settings dictionaries
+    :param early_abort: Compiled backend only - look for the crib with CompiledEnigma.find_crib, which stops decoding
+    each crib alignment at its first mismatch, and only decode the whole code for candidates containing the crib. Not
+    used with plugboard_only or reflector_only (see CodeBreaker.run_search).
+    :param crib_offsets: With early_abort, the offsets into the code at which the crib may start (defaults to every
+    offset, less those ruled out by cribs.possible_offsets for machines which never encode a letter to itself)
+    :param plugboard_only: Compiled backend only - for candidates which differ only in their plugboard. The rotors
+    and reflector are run once per start position into scrambler tables (see CompiledEnigma.scrambler_tables) and
+    each candidate is then decoded by table lookups through its own plugboard.
+    :param reflector_only: Compiled backend only - for candidates which differ only in their reflector wiring. The
+    signal path to and from the reflector is worked out once per start position (see CompiledEnigma.reflector_passes)
+    and each candidate then only re-decodes the characters whose signal reaches a rewired reflector contact.
+    :param positions_only: Compiled backend only - for candidates which differ only in their start positions (and
+    plugboard). Each candidate is decoded with the scrambler permutations read from the cycle of rotor positions,
+    which is worked out once per process and shared by every candidate (see CompiledEnigma.encode_cached).
+    :param scorer: Scoring method (see scoring.Scorer) to rank the candidates by, in place of looking for the crib
+    :param top_k: With a scorer, the number of best scoring candidates to return
+    :return: (hits, decoded) - a list of (index into configs, decoded message, score) for each candidate containing
+    the crib (with a score of None), or for the top_k best scoring candidates, best first; and the number of
+    characters decoded
+    """
+    cribs = [] if crib is None else crib if isinstance(crib, list) else [crib]
+    if backend == 'batch':
+        # NumPy is only needed for the batch backend
+        from batch import BatchEnigma
+
+        encoded = BatchEnigma(configs).encode(code)
+        if scorer:
+            scores = get_scorer(scorer).score_batch(encoded)
+            # Stable sort, so candidates with equal scores stay in candidate order
+            rows = (-scores).argsort(kind='stable')[:top_k]
+            hits = [(int(row), text, float(scores[row])) for row, text in zip(rows, BatchEnigma.texts(encoded[rows]))]
+            return hits, encoded.size
+        if len(cribs) > BATCH_CRIBS:
+            # Past a few cribs, one pass of the compiled cribs over each decryption beats an array scan per crib
+            matcher = crib_matcher(tuple(cribs))
+            rows = [row for row, text in enumerate(BatchEnigma.texts(encoded)) if matcher.contains(text)]
+        else:
+            matches = BatchEnigma.contains(encoded, cribs[0])
+            for crib in cribs[1:]:
+                matches |= BatchEnigma.contains(encoded, crib)
+            rows = matches.nonzero()[0]
+        hits = [(int(row), text, None) for row, text in zip(rows, BatchEnigma.texts(encoded[rows]))]
+        return hits, encoded.size
+
+    # Cribs are compiled once per process (see cribs.CribMatcher), so the check costs about the same for any number
+    matcher = crib_matcher(tuple(cribs)) if cribs and not scorer else None
+    hits = []
+    # With a scorer, a heap of the top_k best (score, -row, decoded message), whose first entry is the worst kept
+    ranked = []
+    decoded = 0
+
+    def accept(row, encoded_phrase):
+        if scorer:
+            entry = (get_scorer(scorer).score(encoded_phrase), -row, encoded_phrase)
+            if len(ranked) < top_k:
+                heapq.heappush(ranked, entry)
+            elif entry > ranked[0]:
+                heapq.heapreplace(ranked, entry)
+        elif matcher is not None and matcher.contains(encoded_phrase):
+            hits.append((row, encoded_phrase, None))
+
+    if early_abort:
+        alignments = crib_alignments(code, cribs, crib_offsets)
+        unpruned_alignments = crib_alignments(code, cribs, crib_offsets, prune=False)
+    machines = {}
+    scramblers = {}
+    passes = {}
+    for row, settings in enumerate(configs):
+        if reflector_only:
+            # Rotors, plugboard and start positions are shared, so only the reflector table is swapped per candidate
+            passes_key = (settings['rotors'], settings['ring_settings'], settings['plugboard_pairs'],
+                          settings['initial_positions'])
+            if passes_key not in passes:
+                passes[passes_key] = CompiledEnigma(settings, ROTOR_CATALOGUE, Plugboard(settings)).reflector_passes(code)
+            encoded_phrase = passes[passes_key].decode(settings.get('reflector_contacts') or
+                                                       ROTOR_CATALOGUE[settings['reflector']]['contacts'])
+            decoded += len(code)
+            accept(row, encoded_phrase)
+            continue
+        # Candidates which share rotors, ring settings and reflector share one compiled machine, which is turned to each
+        # candidate's start positions rather than rebuilt. Only the plugboard is recompiled if that differs.
+        key = (settings['rotors'], settings['ring_settings'], settings['reflector'], settings.get('reflector_contacts'))
+        machine = machines.get(key)
+        if machine is None:
+            machine = machines[key] = CompiledEnigma(settings, ROTOR_CATALOGUE, Plugboard(settings))
+        elif machine.settings['plugboard_pairs'] != settings['plugboard_pairs']:
+            machine.settings = settings
+            machine.compile_plugboard(Plugboard(settings))
+        machine.set_positions(settings['initial_positions'])
+        if plugboard_only:
+            scrambler_key = key + (settings['initial_positions'],)
+            if scrambler_key not in scramblers:
+                scramblers[scrambler_key] = machine.scrambler_tables(len(code))
+            encoded_phrase = machine.encode_with_scrambler(scramblers[scrambler_key], code)
+            decoded += len(code)
+            accept(row, encoded_phrase)
+            continue
+        if early_abort:
+            # Alignments with a crib letter over the same code letter can only be ruled out if no letter can encode
+            # to itself, which a rewired reflector might not guarantee
+            if machine.never_self_encrypts():
+                found, _, count = machine.find_crib(code, alignments)
+            else:
+                found, _, count = machine.find_crib(code, unpruned_alignments)
+            decoded += count
+            if found is None:
+                continue
+        encoded_phrase = machine.encode_cached(code, repeated=True) if positions_only else machine.encode(code)
+        decoded += len(code)
+        accept(row, encoded_phrase)
+    if scorer:
+        hits = [(-row, encoded_phrase, score) for score, row, encoded_phrase in sorted(ranked, reverse=True)]
+    return hits, decoded
+
+
+def reflector_rewirings(contacts:str):
+    """
+    Yields every distinct way of rewiring two pairs of reflector wires (8 letters). Each of the 13 wires joins a pair of
+    letters; choosing 4 wires, splitting them into two duos (3 ways), and cross-connecting the letters of each duo
+    (2 ways each) gives every rewiring exactly once, in a fixed order.
+
+    :param contacts: The reflector wiring as a 26 letter string
+    :return: Generator of rewired contacts strings
+    """
+    # using min and max ensures the lettering is always in the same order, giving 13 unique pairs of reflector mappings
+    wires = sorted(set(min(pin, contact) + max(pin, contact) for pin, contact in zip(ALPHABET, contacts)))
+
+    for four_wires in itertools.combinations(wires, 4):
+        first = four_wires[0]
+        # Pair the first wire with each of the other three to split the four wires into two duos
+        for partner in four_wires[1:]:
+            duos = [(first, partner), tuple(wire for wire in four_wires[1:] if wire != partner)]
+            # Each duo (a b, c d) can be cross-connected as (a c, b d) or (a d, b c)
+            crossings = [[(a + c, b + d), (a + d, b + c)] for (a, b), (c, d) in duos]
+            for new_wires in itertools.product(*crossings):
+                new_contacts = list(contacts)
+                for pin, contact in itertools.chain(*new_wires):
+                    new_contacts[ALPHABET.index(pin)] = contact
+                    new_contacts[ALPHABET.index(contact)] = pin
+                yield ''.join(new_contacts)
 
 
 class CodeBreaker:
     """
-    Contains separate functions to run each of the codebreaker tasks, as well as a writer function to output results
-    to a text file
+    Contains separate functions to run each of the codebreaker tasks, which write their results to a results sink (see
+    results.py)
     """
-    def __init__(self, settings:dict):
+    def __init__(self, settings:dict, backend:str = 'compiled', batch_size:int = 4096, workers:int = 1,
+                 chunk_size:int = 256, early_abort:bool = False, crib_offsets:list = None, sink=None,
+                 scorer:str = None, top_k:int = 10, checkpoint=None):
+        """
+        :param settings: The known settings, code and crib for the task
+        :param backend: 'compiled' to run each candidate setting through its own Enigma, or 'batch' to decrypt
+        batch_size candidates at a time with the NumPy BatchEnigma
+        :param batch_size: Number of candidate settings decrypted together by the batch backend
+        :param workers: Number of processes to share the search between (1 runs the search in this process)
+        :param chunk_size: Number of candidate settings handed to a worker at a time by the compiled backend
+        :param early_abort: Compiled backend only - stop decoding each candidate as soon as it cannot contain the crib.
+        Not supported by codebreak4_plugleads or codebreak5_rewiring, which decode through tables shared across
+        candidates.
+        :param crib_offsets: With early_abort, the known or possible offsets of the crib in the code. By default every
+        offset is tried except those ruled out because Enigma never encodes a letter to itself.
+        :param sink: The ResultSink results are written to (defaults to the text report in codebreak.txt)
+        :param scorer: Scoring method (see scoring.Scorer) - rather than writing every candidate containing the crib,
+        rank all candidates by how much their decryption looks like English and write the top_k best. The crib may
+        then be left out of the settings.
+        :param top_k: With a scorer, the number of best scoring candidates written for each search
+        :param checkpoint: A Checkpoint (see checkpoint.py) to save the progress of searches to every so often, and to
+        resume them from
+        """
+        if early_abort and backend != 'compiled':
+            raise ValueError("early_abort is only supported by the compiled backend")
+        if early_abort and scorer:
+            raise ValueError("early_abort needs a crib, so cannot be used with a scorer")
+        if not (settings.get('crib') or scorer):
+            raise ValueError("A crib or a scorer is needed to recognise the decoded message")
         self.settings = settings
+        self.backend = backend
+        self.batch_size = batch_size
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.early_abort = early_abort
+        self.crib_offsets = crib_offsets
+        self.sink = sink if sink is not None else open_sink('text')
+        self.scorer = scorer
+        self.top_k = top_k
+        self.checkpoint = checkpoint
+        # Search counters, to measure how much decoding each search needed
+        self.candidates_searched = 0
+        self.characters_decoded = 0
+        self.search_seconds = 0.0
+        # Size of the search space, where it is planned up front (see searchspace.SearchSpace)
+        self.planned_candidates = None
         self.code = settings['code']
-        self.crib = settings['crib']
+        self.crib = settings.get('crib')
         self.rotors = settings['rotors']
         self.reflector = settings['reflector']
         self.ring_settings = settings['ring_settings']
         self.initial_positions = settings['initial_positions']
         self.original_plugboard_pairs = settings['plugboard_pairs']
+        self.original_settings = settings
+        # The best (score, settings, decoded message) of the last scored search, best first
+        self.ranked = []
 
     def codebreak1_reflector(self):
         """
@@ -23,13 +239,15 @@ class CodeBreaker:
         """
         self.name = 'codebreak1_reflector'
         self.attempt = 1
+        self.run_search(self.reflector_candidates())
+
+    def reflector_candidates(self):
+        """ Yields the settings for each reflector """
         reflectors = ['A','B','C']
+        self.planned_candidates = len(reflectors)
 
         for reflector in reflectors:
-            self.settings['reflector'] = reflector
-            self.enigma = Enigma(self.settings)
-            self.enigma.create_machinery()
-            self.encode_write_output()
+            yield dict(self.settings, reflector=reflector)
 
     def codebreak2_positions(self):
         """
@@ -37,17 +255,16 @@ class CodeBreaker:
         """
         self.name = 'codebreak2_positions'
         self.attempt = 1
+        self.run_search(self.position_candidates(), positions_only=True)
+
+    def position_candidates(self):
+        """ Yields the settings for every possible trio of rotor positions """
         positions = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+        self.planned_candidates = 26 * 25 * 24
         # Iterate over every possible trio of positions
         for trio in itertools.permutations(list(positions), 3):
-            # Convert trio to a list
-            trio_as_list = [i for i in trio]
-            # Convert list to space-separated string and assign to settings dictionary
-            self.settings['initial_positions'] = ' '.join(trio_as_list)
-            # Run enigma with given settings and write results
-            self.enigma = Enigma(self.settings)
-            self.enigma.create_machinery()
-            self.encode_write_output()
+            # Convert trio to a space-separated string and assign to a copy of the settings dictionary
+            yield dict(self.settings, initial_positions=' '.join(trio))
 
     def codebreak3_multi(self):
         """
@@ -56,6 +273,16 @@ class CodeBreaker:
         """
         self.name = 'codebreak3_multi'
         self.attempt = 1
+        self.run_search(self.multi_candidates())
+
+    def multi_candidates(self):
+        """ Yields the settings for every combination of rotors, reflector and ring settings """
+        space = self.multi_space()
+        self.planned_candidates = space.size
+        return space.candidates(self.settings)
+
+    def multi_space(self) -> SearchSpace:
+        """ The search space of codebreak3_multi: unknown rotors, reflector and ring settings """
         possible_rotors = ['Beta','Gamma','II','IV']
         possible_reflectors = ['A','B','C']
         # Odd numbers not allowed
@@ -63,20 +290,135 @@ class CodeBreaker:
         # Get list of all possible ring settings
         possible_ring_settings = [i for i in range(1, 26) if set(str(i)) <= allowed_digits]
 
-        # Iterate over each trio of possible rotor combinations
-        # For each rotor combination...
-        for rotor_combo in itertools.permutations(possible_rotors, 3):
-            # ...and for each reflector...
-            for reflector in possible_reflectors:
-                #...and for each trio of possible ring settings...
-                for ring_combo in itertools.permutations(possible_ring_settings, 3):
-                    self.settings['rotors'] = ' '.join(list(rotor_combo))
-                    self.settings['ring_settings'] = ' '.join(list((str(i) for i in ring_combo)))
-                    self.settings['reflector'] = reflector
-                    # ...run enigma and write output
-                    self.enigma = Enigma(self.settings)
-                    self.enigma.create_machinery()
-                    self.encode_write_output()
+        # Each rotor and each ring setting is used once
+        return SearchSpace([possible_rotors] * 3, possible_reflectors, [possible_ring_settings] * 3,
+                           positions=self.initial_positions.split(' '),
+                           plugboards=[self.original_plugboard_pairs], distinct_ring_settings=True)
+
+    def run_search(self, candidates, plugboard_only:bool = False, reflector_only:bool = False,
+                   positions_only:bool = False):
+        """
+        Runs the candidate settings dictionaries through Enigma in chunks, using the backend chosen when the
+        CodeBreaker was created, and writes the results containing the crib. With more than one worker the chunks are
+        shared across a process pool; results are always written in candidate order.
+
+        :param candidates: Iterable of candidate settings dictionaries
+        :param plugboard_only: True if the candidates differ only in their plugboard (see find_hits)
+        :param reflector_only: True if the candidates differ only in their reflector wiring (see find_hits)
+        :param positions_only: True if the candidates differ only in their start positions (see find_hits)
+        """
+        if self.early_abort and (plugboard_only or reflector_only):
+            # These decode each candidate through tables shared across candidates, in a lookup or two per character,
+            # which costs less than looking for the crib alignment by alignment
+            raise ValueError(f"early_abort is not supported by {self.name}, which decodes through shared tables")
+        start = time.perf_counter()
+        # Number of candidates searched so far, in candidate order
+        cursor = 0
+        # With a scorer, a heap of the top_k best (score, -candidate number, settings, decoded message) so far, whose
+        # first entry is the worst kept
+        ranked = []
+        progress = self.checkpoint.task(self.name) if self.checkpoint is not None else None
+        if progress is not None:
+            # Carry on from the checkpoint; its results are already in the results file
+            cursor = progress['cursor']
+            self.attempt = progress['attempt']
+            self.candidates_searched += cursor
+            self.characters_decoded += progress['characters_decoded']
+            self.search_seconds += progress['seconds']
+            self.planned_candidates = progress['planned']
+            ranked = [tuple(entry) for entry in progress['ranked']]
+            heapq.heapify(ranked)
+            if progress['complete']:
+                self.ranked = [(score, settings, encoded_phrase) for score, _, settings, encoded_phrase
+                               in sorted(ranked, key=lambda entry: entry[:2], reverse=True)]
+                return
+            candidates = itertools.islice(candidates, cursor, None)
+
+        chunk_size = self.batch_size if self.backend == 'batch' else self.chunk_size
+        chunks = chunked(candidates, chunk_size)
+        search = functools.partial(find_hits, self.code, self.crib, self.backend, early_abort=self.early_abort,
+                                   crib_offsets=self.crib_offsets, plugboard_only=plugboard_only,
+                                   reflector_only=reflector_only, positions_only=positions_only, scorer=self.scorer,
+                                   top_k=self.top_k)
+
+        if self.workers > 1:
+            # Keep each chunk alongside its hits so the hits can be matched back to their settings
+            results = run_parallel(search, chunks, self.workers, keep_input=True)
+        else:
+            results = ((configs, search(configs)) for configs in chunks)
+
+        # The attempt number, top scoring results and results file size after the last whole chunk, as an interruption
+        # part way through a chunk's hits is checkpointed from there, and the whole chunk searched again on resuming
+        boundary = (self.attempt, list(ranked), self.sink.size() if self.checkpoint is not None else None)
+        complete = False
+        try:
+            for configs, (hits, decoded) in results:
+                for row, encoded_phrase, score in hits:
+                    if self.scorer:
+                        entry = (score, -(cursor + row), configs[row], encoded_phrase)
+                        if len(ranked) < self.top_k:
+                            heapq.heappush(ranked, entry)
+                        elif entry[:2] > ranked[0][:2]:
+                            heapq.heapreplace(ranked, entry)
+                        continue
+                    self.settings = configs[row]
+                    self.encoded_phrase = encoded_phrase
+                    self.write_output()
+                cursor += len(configs)
+                self.candidates_searched += len(configs)
+                self.characters_decoded += decoded
+                if self.checkpoint is not None and hits:
+                    results_size = self.sink.size() if self.attempt != boundary[0] else boundary[2]
+                    boundary = (self.attempt, list(ranked), results_size)
+                if self.checkpoint is not None and self.checkpoint.due():
+                    self.save_checkpoint(cursor, ranked, start)
+            complete = True
+        finally:
+            if self.checkpoint is not None and not complete:
+                # The checkpoint is taken before the top scoring results are written, which happens again on resuming
+                attempt, boundary_ranked, results_size = boundary
+                self.save_checkpoint(cursor, boundary_ranked, start, attempt, results_size)
+            # Results found before an interruption are still written out, best scoring first
+            self.ranked = [(score, settings, encoded_phrase) for score, _, settings, encoded_phrase
+                           in sorted(ranked, key=lambda entry: entry[:2], reverse=True)]
+            for score, settings, encoded_phrase in self.ranked:
+                self.settings = settings
+                self.encoded_phrase = encoded_phrase
+                self.write_output(score)
+            self.sink.flush()
+        self.search_seconds += time.perf_counter() - start
+        if complete and self.checkpoint is not None:
+            self.save_checkpoint(cursor, ranked, complete=True)
+
+    def save_checkpoint(self, cursor:int, ranked:list, start:float = None, attempt:int = None,
+                        results_size:int = None, complete:bool = False):
+        """
+        Flushes the results and saves the progress of the current search to the checkpoint
+
+        :param cursor: Number of candidates searched so far, in candidate order
+        :param ranked: The top scoring results kept so far (see run_search)
+        :param start: perf_counter value when this run of the search started, if it is still running
+        :param attempt: The attempt number at the cursor (defaults to the current one)
+        :param results_size: The size of the results file at the cursor (defaults to its size once flushed)
+        :param complete: True once the search has finished
+        """
+        self.sink.flush()
+        seconds = self.search_seconds + (time.perf_counter() - start if start is not None else 0.0)
+        progress = {'cursor': cursor,
+                    'attempt': self.attempt if attempt is None else attempt,
+                    'characters_decoded': self.characters_decoded,
+                    'seconds': seconds,
+                    'planned': self.planned_candidates,
+                    'ranked': ranked,
+                    'complete': complete}
+        self.checkpoint.save(self.name, progress, self.sink.path, results_size)
+
+    def summary(self) -> str:
+        """ Returns a one line report of the search: the candidates tried, the throughput and the results written """
+        rate = self.candidates_searched / self.search_seconds if self.search_seconds else 0.0
+        planned = f"/{self.planned_candidates}" if self.planned_candidates is not None else ""
+        return (f"{self.name}: {self.candidates_searched}{planned} candidates in {self.search_seconds:.2f}s "
+                f"({rate:.0f} candidates/s), {self.attempt - 1} results")
 
     def codebreak4_plugleads(self):
         """
@@ -85,15 +427,30 @@ class CodeBreaker:
         """
         self.name = "codebreak4_plugleads"
         self.attempt = 1
+        self.run_search(self.pluglead_candidates(), plugboard_only=True)
+
+    def pluglead_candidates(self):
+        """
+        Yields the settings for each possible choice of plugs in place of the '?' plugs, of which there can be any
+        number. A lead with both plugs unknown ('??') is only tried once for each pair of letters.
+        """
         possible_plugs = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
 
         # Amend possible_plugs to remove any already-used plugs
-        for used_plug in self.settings['plugboard_pairs']:
+        for used_plug in self.original_plugboard_pairs:
             if used_plug in possible_plugs:
                 possible_plugs = possible_plugs.replace(used_plug, '')
 
-        # For each possible remaining plug pair...
-        for plug_pair in itertools.permutations(list(possible_plugs), 2):
+        unknown_plugs = self.original_plugboard_pairs.count('?')
+        unknown_leads = [i for i, pair in enumerate(self.original_plugboard_pairs.split(' ')) if pair == '??']
+        # Choices of the remaining plugs, halved for each fully unknown lead
+        self.planned_candidates = 1
+        for plug in range(unknown_plugs):
+            self.planned_candidates *= len(possible_plugs) - plug
+        self.planned_candidates //= 2 ** len(unknown_leads)
+
+        # For each possible choice of the remaining plugs...
+        for plug_pair in itertools.permutations(list(possible_plugs), unknown_plugs):
             pairs = self.original_plugboard_pairs
             i = 0
             # For each character in the original string of plug pairs (contains '?')
@@ -102,125 +459,132 @@ class CodeBreaker:
                     # Swap the '?' for one of the remaining possible plugs
                     pairs = pairs[:char] + plug_pair[i] + pairs[char + 1:]
                     i += 1
-            # Update settings to reflect the new plug pairs list and run through Enigma
-            self.settings['plugboard_pairs'] = pairs
-            self.enigma = Enigma(self.settings)
-            self.enigma.create_machinery()
-            self.encode_write_output()
+            # Leads are the same either way round, so skip the reversed copy of any fully unknown lead
+            leads = pairs.split(' ')
+            if any(leads[lead][0] > leads[lead][1] for lead in unknown_leads):
+                continue
+            # Update settings to reflect the new plug pairs list
+            yield dict(self.settings, plugboard_pairs=pairs)
+
+    def codebreak_plugboard_climb(self, candidates:list = None, restarts:int = 100, seconds:float = None,
+                                  seed:int = None):
+        """
+        Recovers an unknown plugboard by hill climbing (see hillclimb.PlugboardClimber), for each candidate setting
+        of the rotors, ring settings, reflector and start positions, and writes the top_k best plugboards found with
+        their scores. Known leads in plugboard_pairs are kept, and up to 10 leads are used in all.
+
+        :param candidates: The settings dictionaries to recover the plugboard for. Defaults to the best candidates of
+        the last scored search (see self.ranked), or else the settings the CodeBreaker was created with.
+        :param restarts: The most hill climbs to run for each candidate
+        :param seconds: Time budget for each candidate, if any
+        :param seed: Seed for the random restarts, so that a search can be repeated
+        """
+        self.name = 'codebreak_plugboard_climb'
+        self.attempt = 1
+        if candidates is None:
+            candidates = [settings for _, settings, _ in self.ranked] or [self.original_settings]
+        start = time.perf_counter()
+        search = functools.partial(climb_plugboards, self.code, self.scorer or 'quadgram', restarts, seconds, seed)
+        chunks = chunked(candidates, 1)
+        if self.workers > 1:
+            results = run_parallel(search, chunks, self.workers)
+        else:
+            results = (search(configs) for configs in chunks)
+
+        climbed = [result for chunk in results for result in chunk]
+        self.candidates_searched += len(climbed)
+        # Best first; sorted is stable, so equal scores stay in candidate order
+        self.ranked = sorted(climbed, key=lambda result: result[0], reverse=True)[:self.top_k]
+        for score, settings, encoded_phrase in self.ranked:
+            self.settings = settings
+            self.encoded_phrase = encoded_phrase
+            self.write_output(score)
+        self.sink.flush()
+        self.search_seconds += time.perf_counter() - start
+
+    def codebreak_bombe(self, candidates=None):
+        """
+        Runs the Turing bombe (see bombe.py) over the candidate settings: the crib is placed against the code at each
+        offset it could take, and each candidate is tested by following plugboard hypotheses around the loops of the
+        resulting menu, rather than by decoding the code. Only candidates which are logically consistent with the crib
+        (stops) are written, along with the plugs they imply, best scoring first. The plugboard may be given in full,
+        in part (with '?' plugs), or as 'UNKNOWN', in which case it is worked out along with the other settings.
+
+        :param candidates: Iterable of candidate settings dictionaries. Defaults to every start position (see
+        start_position_candidates) if the initial positions are 'UNKNOWN', or else the settings given.
+        """
+        self.name = 'codebreak_bombe'
+        self.attempt = 1
+        if candidates is None:
+            candidates = (self.start_position_candidates() if self.initial_positions == 'UNKNOWN'
+                          else [self.original_settings])
+        start = time.perf_counter()
+        search = functools.partial(find_stops, self.code, self.crib, crib_offsets=self.crib_offsets)
+        chunks = chunked(candidates, self.chunk_size)
+        if self.workers > 1:
+            results = run_parallel(search, chunks, self.workers, keep_input=True)
+        else:
+            results = ((configs, search(configs)) for configs in chunks)
+
+        scorer = get_scorer(self.scorer or 'quadgram')
+        found = []
+        for configs, (stops, _) in results:
+            self.candidates_searched += len(configs)
+            for _, settings, encoded_phrase in stops:
+                found.append((scorer.score(encoded_phrase), settings, encoded_phrase))
+        # Best first; sorted is stable, so equal scores stay in candidate order
+        self.ranked = sorted(found, key=lambda stop: stop[0], reverse=True)
+        for score, settings, encoded_phrase in self.ranked:
+            self.settings = settings
+            self.encoded_phrase = encoded_phrase
+            self.write_output(score)
+        self.sink.flush()
+        self.search_seconds += time.perf_counter() - start
+
+    def start_position_candidates(self):
+        """ Yields the settings for every start position of the rotors, letters repeated or not """
+        # The rotors are as given, so are not checked against the thin rotor rule
+        space = SearchSpace([[rotor] for rotor in self.rotors.split(' ')], [self.reflector],
+                            [[ring_setting] for ring_setting in self.ring_settings.split(' ')],
+                            plugboards=[self.original_plugboard_pairs], distinct_rotors=False, thin_rotor_rule=False)
+        self.planned_candidates = space.size
+        return space.candidates(self.settings)
 
     def codebreak5_rewiring(self):
         """
         Searches through every possible reflector re-wiring combination to find the settings which produce an decoded
         message containing one of the cribs. There are 8 possible character changes/rewirings, which means two sets of
         swaps.
-        This function finds the first possible set of rewirings (2 plugleads / 4 plugs), then iterates to find a
-        second possible set, and runs them into Enigma.
-        Once all of the possible second sets have been exhausted, the function will change the first set and iterate
-        again over all second sets, ensuring that the two sets are never the same to save time.
+        Each distinct rewired reflector is tried exactly once (see reflector_rewirings), and as only the reflector
+        changes between candidates, the rotors are run once and each candidate just swaps in its reflector table.
         """
         self.name = "codebreak5_rewiring"
         self.attempt = 1
+        self.run_search(self.rewiring_candidates(), reflector_only=True)
+
+    def rewiring_candidates(self):
+        """ Yields the settings for each rewiring of each reflector, with the rewired contacts in 'reflector_contacts' """
         reflectors = ['A','B','C']
-        # Establish a dummy enigma instance to iteratively be able to get access to the different reflector contacts lists
-        self.enigma = Enigma(self.settings)
+        # 715 choices of 4 wires, 3 ways to split them into duos, and 4 ways to cross-connect the duos
+        self.planned_candidates = len(reflectors) * 715 * 3 * 4
 
-        # For each reflector...
         for reflector in reflectors:
-            pins = [i for i in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ']
-
-            # ...get the contacts for that reflector (list of characters A-Z unordered)
-            contacts = [i for i in self.enigma.rotor_box[reflector]['contacts']]
-
-            # using max and min ensures the lettering is always in the same order, so can then create a set and get
-            # 13 unique pairs of reflector mappings
-            unique_pairs = list(set([max(i,j)+min(i,j) for (i, j) in zip(pins,contacts)]))
-            unique_pairs = [[char for char in pair] for pair in unique_pairs]
-
-            # For every possible duo of reflector mappings...
-            for mappings_duo in itertools.combinations(unique_pairs, 2):
-                #...create an iterator which will give all possible combinations of re-wiring for the duo of mappings
-                possible_rewirings= [list(zip(each_permutation, list(mappings_duo[0]))) for each_permutation in \
-                                  itertools.permutations(list(mappings_duo[1]), 2)]
-
-                # For each rewired pair...
-                for rewired_pair in possible_rewirings:
-                    # ...do the same for a second pair. create_uniquepairssub() removes the already-used duo to avoid
-                    # using the same rewired_pair twice.
-                    for mappings_duo2 in itertools.combinations(self.create_uniquepairssub(unique_pairs,mappings_duo), 2):
-                        possible_rewirings2 = [list(zip(each_permutation, list(mappings_duo2[0]))) for each_permutation in
-                                           itertools.permutations(list(mappings_duo2[1]), 2)]
-
-                        # For each second set of re-wired pairs...
-                        for rewired_pair2 in possible_rewirings2:
-                            # Use the first rewired pair to create a dictionary of mappings
-                            replacement_dict = {key: value for key, value in rewired_pair}
-                            new_pins = pins.copy()
-                            new_contacts = contacts.copy()
-
-                            # Find the index of the key in pins, and replace that index in the reflector contacts with
-                            # the value in the replacement dictionary
-                            for key, value in replacement_dict.items():
-                                rep_id = new_pins.index(key)
-                                new_contacts[rep_id] = value
-
-                                rep_id = new_pins.index(value)
-                                new_contacts[rep_id] = key
-
-                            # Do the same for the second set of rewired pairs
-                            replacement_dict2 = {key: value for key, value in rewired_pair2}
-                            for key, value in replacement_dict2.items():
-                                rep_id = new_pins.index(key)
-                                new_contacts[rep_id] = value
-
-                                rep_id = new_pins.index(value)
-                                new_contacts[rep_id] = key
-
-                            # Update settings dictionary to contain the update reflector contacts and run through enigma
-                            self.settings['reflector'] = reflector
-                            self.enigma = Enigma(self.settings)
-                            self.enigma.rotor_box[reflector]['contacts'] = ''.join(new_contacts)
-                            self.enigma.create_machinery()
-                            self.encode_write_output()
-
-    def create_uniquepairssub(self,unique_pairs, two_pair):
-        """ Used in codebreak5, removes the already-used duo to avoid using the same rewired_pair twice"""
-        unique_pairs_sub = unique_pairs.copy()
-        for i in two_pair:
-            unique_pairs_sub.pop(unique_pairs_sub.index(i))
-        return unique_pairs_sub
-
-    def encode_write_output(self):
-        # Run code through enigma using derived settings
-        self.encoded_phrase = self.enigma.encode(self.code)
-
-        # If there are multiple inputs in the crib, iterate over them before checking through the encoded message
-        if isinstance(self.crib, list):
-            for crib in self.crib:
-                if crib in self.encoded_phrase:
-                    with open('codebreak.txt','a') as f:
-                        self.write(f)
-                    self.attempt += 1
-        else:
-            if self.crib in self.encoded_phrase:
-                with open('codebreak.txt', 'a') as f:
-                    self.write(f)
-                self.attempt+=1
-
-    def write(self, f):
-        """ Specify formatting of each output to codebreak.txt """
-        if self.attempt ==1:
-            f.write(f"#################################\n")
-            f.write(f"Codebreak task: {self.name}\n")
-            f.write(f"#################################\n\n")
-
-        f.write(f"Attempt : {self.attempt}\n")
-        f.write(f"SETTINGS: \n")
-        f.write(f"Rotors : {str(self.settings['rotors'])}\n")
-        f.write(f"Initial Positions : {str(self.settings['initial_positions'])}\n")
-        f.write(f"Ring Settings : {str(self.settings['ring_settings'])}\n")
-        f.write(f"Reflector : {str(self.settings['reflector'])}\n")
-        f.write(f"Plugboard Pairs : {str(self.settings['plugboard_pairs'])}\n\n")
-        f.write(f"Input code : {self.code}\n")
-        f.write(f"Crib: {self.crib}\n")
-        f.write(f"Output code : {self.encoded_phrase}\n\n\n\n")
+            for contacts in reflector_rewirings(ROTOR_CATALOGUE[reflector]['contacts']):
+                yield dict(self.settings, reflector=reflector, reflector_contacts=contacts)
 
+    def write_output(self, score:float = None):
+        """
+        Writes the current settings to the results sink once for each crib found in the encoded phrase, or once with
+        its score for a scored search
+
+        :param score: The score of the encoded phrase, if the search is scored
+        """
+        # If there are multiple inputs in the crib, all of them are looked for in one pass through the encoded message
+        cribs = [] if self.crib is None else self.crib if isinstance(self.crib, list) else [self.crib]
+        found = crib_matcher(tuple(cribs)).found(self.encoded_phrase) if cribs else []
+        if score is not None:
+            found = found[:1] or [None]
+        for crib in found:
+            self.sink.write(SearchResult(self.name, self.attempt, self.settings, self.code, self.crib, crib,
+                                         self.encoded_phrase, score))
+            self.attempt += 1
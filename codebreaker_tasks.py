@@ -1,67 +1,81 @@
 from codebreak import CodeBreaker
+from results import open_sink
+from checkpoint import Checkpoint
 import os
 
-def tasks():
-    """
-    Contains the initial settings for each codebreaker task, and loads these settings into the Codebreaker class, then
-    calls each respective task function. Outputs are saved to ./codebreak.txt
-    """
-
-    # Remove any existing codebreak text outputs
-    if os.path.exists('./codebreak.txt'):
-        os.remove('./codebreak.txt')
-
+# The initial settings of each codebreaker task, by the CodeBreaker function which runs it, in the order they are run
+TASK_SETTINGS = {
     # CODEBREAKER 1
-    settings = {'code':'DMEXBMKYCVPNQBEDHXVPZGKMTFFBJRPJTLHLCHOTKOYXGGHZ',
-                'crib': 'SECRETS',
-                'rotors': 'Beta Gamma V',
-                'reflector': 'UNKNOWN',
-                'ring_settings': '04 02 14',
-                'initial_positions':'M J M',
-                'plugboard_pairs': 'KI XN FL'}
-    e = CodeBreaker(settings)
-    e.codebreak1_reflector()
-
+    'codebreak1_reflector': {'code':'DMEXBMKYCVPNQBEDHXVPZGKMTFFBJRPJTLHLCHOTKOYXGGHZ',
+                             'crib': 'SECRETS',
+                             'rotors': 'Beta Gamma V',
+                             'reflector': 'UNKNOWN',
+                             'ring_settings': '04 02 14',
+                             'initial_positions':'M J M',
+                             'plugboard_pairs': 'KI XN FL'},
     # CODEBREAKER 2
-    settings = {'code':'CMFSUPKNCBMUYEQVVDYKLRQZTPUFHSWWAKTUGXMPAMYAFITXIJKMH',
-                'crib': 'UNIVERSITY',
-                'rotors': 'Beta I III',
-                'reflector': 'B',
-                'ring_settings': '23 02 10',
-                'initial_positions':'UNKNOWN',
-                'plugboard_pairs': 'VH PT ZG BJ EY FS'}
-    e = CodeBreaker(settings)
-    e.codebreak2_positions()
-
+    'codebreak2_positions': {'code':'CMFSUPKNCBMUYEQVVDYKLRQZTPUFHSWWAKTUGXMPAMYAFITXIJKMH',
+                             'crib': 'UNIVERSITY',
+                             'rotors': 'Beta I III',
+                             'reflector': 'B',
+                             'ring_settings': '23 02 10',
+                             'initial_positions':'UNKNOWN',
+                             'plugboard_pairs': 'VH PT ZG BJ EY FS'},
     # CODEBREAKER 3
-    settings = {'code':'ABSKJAKKMRITTNYURBJFWQGRSGNNYJSDRYLAPQWIAGKJYEPCTAGDCTHLCDRZRFZHKNRSDLNPFPEBVESHPY',
-                'crib': 'THOUSANDS',
-                'rotors': 'UNKNOWN',
-                'reflector': 'UNKNOWN',
-                'ring_settings': 'UNKNOWN',
-                'initial_positions':'E M Y',
-                'plugboard_pairs': 'FH TS BE UQ KD AL'}
-    e = CodeBreaker(settings)
-    e.codebreak3_multi()
-
+    'codebreak3_multi': {'code':'ABSKJAKKMRITTNYURBJFWQGRSGNNYJSDRYLAPQWIAGKJYEPCTAGDCTHLCDRZRFZHKNRSDLNPFPEBVESHPY',
+                         'crib': 'THOUSANDS',
+                         'rotors': 'UNKNOWN',
+                         'reflector': 'UNKNOWN',
+                         'ring_settings': 'UNKNOWN',
+                         'initial_positions':'E M Y',
+                         'plugboard_pairs': 'FH TS BE UQ KD AL'},
     # CODEBREAKER 4
-    settings = {'code': 'SDNTVTPHRBNWTLMZTQKZGADDQYPFNHBPNHCQGBGMZPZLUAVGDQVYRBFYYEIXQWVTHXGNW',
-                'crib':'TUTOR',
-                'rotors':'V III IV',
-                'reflector':'A',
-                'ring_settings':'24 12 10',
-                'initial_positions':'S W U',
-                'plugboard_pairs': 'WP RJ A? VF I? HN CG BS'}
-    e = CodeBreaker(settings)
-    e.codebreak4_plugleads()
-
+    'codebreak4_plugleads': {'code': 'SDNTVTPHRBNWTLMZTQKZGADDQYPFNHBPNHCQGBGMZPZLUAVGDQVYRBFYYEIXQWVTHXGNW',
+                             'crib':'TUTOR',
+                             'rotors':'V III IV',
+                             'reflector':'A',
+                             'ring_settings':'24 12 10',
+                             'initial_positions':'S W U',
+                             'plugboard_pairs': 'WP RJ A? VF I? HN CG BS'},
     # CODEBREAKER 5
-    settings = {'code': 'HWREISXLGTTBYVXRCWWJAKZDTVZWKBDJPVQYNEQIOTIFX',
-                'crib':['FACEBOOK','INSTAGRAM','TWITTER','SNAPCHAT','YOUTUBE','REDDIT','LINKEDIN'],
-                'rotors':'V II IV',
-                'reflector':'A',
-                'ring_settings':'6 18 7',
-                'initial_positions':'A J L',
-                'plugboard_pairs': 'UG IE PO NX WT'}
-    e = CodeBreaker(settings)
-    e.codebreak5_rewiring()
\ No newline at end of file
+    'codebreak5_rewiring': {'code': 'HWREISXLGTTBYVXRCWWJAKZDTVZWKBDJPVQYNEQIOTIFX',
+                            'crib':['FACEBOOK','INSTAGRAM','TWITTER','SNAPCHAT','YOUTUBE','REDDIT','LINKEDIN'],
+                            'rotors':'V II IV',
+                            'reflector':'A',
+                            'ring_settings':'6 18 7',
+                            'initial_positions':'A J L',
+                            'plugboard_pairs': 'UG IE PO NX WT'},
+}
+
+
+def tasks(workers:int = 1, backend:str = 'compiled', results_format:str = 'text', resume:bool = False,
+          checkpoint_interval:float = 30.0):
+    """
+    Loads the initial settings for each codebreaker task (TASK_SETTINGS) into the Codebreaker class, then calls each
+    respective task function. Outputs are saved to ./codebreak.txt (or ./codebreak.jsonl, ./codebreak.csv)
+
+    :param workers: Number of processes to share each search between
+    :param backend: 'compiled' or 'batch' (see CodeBreaker)
+    :param results_format: 'text', 'jsonl' or 'csv' (see results.py)
+    :param resume: Carry on from ./codebreak_checkpoint.json, keeping the results written before it, rather than
+    starting again
+    :param checkpoint_interval: Seconds between checkpoints during each search
+    """
+    sink = open_sink(results_format)
+    checkpoint = Checkpoint(interval=checkpoint_interval, report=print)
+
+    if resume:
+        # Cut off any results written after the last checkpoint, as those candidates will be searched again
+        checkpoint.load()
+        checkpoint.truncate_results(sink.path)
+    else:
+        # Remove any existing codebreak outputs
+        if os.path.exists(sink.path):
+            os.remove(sink.path)
+        checkpoint.clear()
+
+    for name, settings in TASK_SETTINGS.items():
+        e = CodeBreaker(settings, backend=backend, workers=workers, sink=sink,
+                        checkpoint=checkpoint)
+        getattr(e, name)()
+        print(e.summary())
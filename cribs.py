@@ -0,0 +1,165 @@
+import functools
+import re
+
+
+def possible_offsets(code:str, crib:str) -> list:
+    """
+    Returns every offset at which the crib could line up with the code. As an Enigma machine never encodes a letter to
+    itself, any alignment which places a crib letter directly under the same code letter is impossible.
+
+    :param code: The encoded message
+    :param crib: A known word in the decoded message
+    :return: Sorted list of possible offsets into the code
+    """
+    return [offset for offset in range(len(code) - len(crib) + 1)
+            if all(code_char != crib_char for code_char, crib_char in zip(code[offset:], crib))]
+
+
+def crib_alignments(code:str, cribs:list, offsets:list = None, prune:bool = True) -> list:
+    """
+    Lists the offsets to try each crib at when searching a decoding of the code for the cribs (see
+    CompiledEnigma.find_crib). Worked out once per search, as it does not depend on the machine settings.
+
+    :param code: The encoded message
+    :param cribs: A list of known words, any of which may be in the decoded message
+    :param offsets: Known or possible offsets of the cribs in the code. Defaults to every offset.
+    :param prune: Remove the offsets ruled out by possible_offsets
+    :return: List of (crib, offsets) pairs
+    """
+    alignments = []
+    for crib in cribs:
+        crib_offsets = range(len(code) - len(crib) + 1) if offsets is None else sorted(offsets)
+        if prune:
+            allowed = set(possible_offsets(code, crib))
+            crib_offsets = [offset for offset in crib_offsets if offset in allowed]
+        alignments.append((crib, [offset for offset in crib_offsets if 0 <= offset <= len(code) - len(crib)]))
+    return alignments
+
+
+class CribMatcher:
+    """
+    Finds any number of cribs in a decoded message in one pass, however many cribs there are (Aho-Corasick). The cribs
+    are compiled once into an automaton: a trie of the cribs in which every state also has a transition for every
+    character, falling back to the longest crib prefix which is still matched, so each character of the message is
+    looked at once. The same cribs are also compiled into a regular expression shaped like the trie, for the common
+    question of whether a message contains any crib at all, which the re module then answers at C speed.
+    """
+    def __init__(self, cribs:list):
+        """
+        :param cribs: Known words, any of which may be in the decoded message
+        """
+        if isinstance(cribs, str):
+            cribs = [cribs]
+        if not all(cribs):
+            raise ValueError("Cribs cannot be empty")
+        self.cribs = list(cribs)
+        # The trie: children of each state by character, and the cribs ending at each state (indices into the distinct
+        # cribs)
+        self.distinct = list(dict.fromkeys(self.cribs))
+        children = [{}]
+        ends = [[]]
+        for index, crib in enumerate(self.distinct):
+            state = 0
+            for character in crib:
+                if character not in children[state]:
+                    children[state][character] = len(children)
+                    children.append({})
+                    ends.append([])
+                state = children[state][character]
+            ends[state].append(index)
+
+        # Breadth first, each state's fallback is found from its parent's, and the cribs ending at the fallback end here
+        # too. Characters missing from a state's transitions go back to the start state.
+        self.transitions = [dict(children[0])]
+        self.transitions.extend({} for _ in children[1:])
+        fallback = [0] * len(children)
+        queue = list(children[0].values())
+        for state in queue:
+            ends[state] = ends[state] + ends[fallback[state]]
+            for character, child in children[state].items():
+                queue.append(child)
+                fallback[child] = self.transitions[fallback[state]].get(character, 0)
+            self.transitions[state] = dict(self.transitions[fallback[state]], **children[state])
+        self.ends = [tuple(sorted(end)) for end in ends]
+        self.pattern = re.compile(self.trie_pattern(children, ends, 0))
+
+    def trie_pattern(self, children:list, ends:list, state:int) -> str:
+        """ Returns a regular expression matching any crib which continues the trie from the state """
+        if ends[state]:
+            # A crib has already been matched, so nothing after it matters
+            return ''
+        branches = [re.escape(character) + self.trie_pattern(children, ends, child)
+                    for character, child in sorted(children[state].items())]
+        return branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+
+    def contains(self, text:str) -> bool:
+        """ True if the text contains any of the cribs """
+        return self.pattern.search(text) is not None
+
+    def matches(self, text:str, start:int = 0) -> list:
+        """
+        Finds every occurrence of every crib in the text
+
+        :param text: The decoded message
+        :param start: Offset of the text within the whole message, added to the offsets returned
+        :return: List of (crib, offset) pairs, ordered by where each occurrence ends, then by crib order
+        """
+        return CribScanner(self, start).feed(text)
+
+    def found(self, text:str) -> list:
+        """ Returns the cribs found in the text, in the order (and as many times) they were given """
+        if not self.contains(text):
+            return []
+        matched = set(crib for crib, _ in self.matches(text))
+        return [crib for crib in self.cribs if crib in matched]
+
+    def scanner(self, start:int = 0) -> 'CribScanner':
+        """ Returns a CribScanner, to look for the cribs in a message as it is decoded (see CribScanner) """
+        return CribScanner(self, start)
+
+
+class CribScanner:
+    """
+    Runs a CribMatcher over a message a piece at a time, as it is decoded: the automaton state carries over from one
+    piece to the next, so cribs spanning two pieces are found, and each character is only looked at once.
+    """
+    def __init__(self, matcher:CribMatcher, start:int = 0):
+        """
+        :param matcher: The compiled cribs
+        :param start: Offset in the message of the first character to be fed in
+        """
+        self.matcher = matcher
+        self.state = 0
+        # Offset of the next character to be fed in
+        self.position = start
+
+    def feed(self, text:str) -> list:
+        """
+        Carries on scanning with the next piece of the message
+
+        :param text: The next decoded characters
+        :return: List of (crib, offset) pairs for the cribs ending in this piece, with offsets into the whole message
+        """
+        transitions = self.matcher.transitions
+        ends = self.matcher.ends
+        distinct = self.matcher.distinct
+        found = []
+        state = self.state
+        for i, character in enumerate(text, self.position + 1):
+            state = transitions[state].get(character, 0)
+            for index in ends[state]:
+                crib = distinct[index]
+                found.append((crib, i - len(crib)))
+        self.state = state
+        self.position += len(text)
+        return found
+
+
+@functools.lru_cache(maxsize=32)
+def crib_matcher(cribs:tuple) -> CribMatcher:
+    """
+    Returns the compiled CribMatcher for the cribs, compiling them only once per process
+
+    :param cribs: Tuple of known words
+    """
+    return CribMatcher(list(cribs))
@@ -1,5 +1,13 @@
 from enigma import Enigma
 
+
+def print_encoding(message:str, result:object):
+    """ Prints the input message, the encoded message and the final rotor positions of an EncodeResult """
+    print(f"Input Phrase: {message}")
+    print(f"Encoded Phrase: {result.text}")
+    print(f"Final Rotor Positions:{result.position_letters}")
+
+
 def rotor_demonstrations():
     # MULTIPLE ROTOR DEMONSTRATION
 
@@ -12,7 +20,7 @@ def rotor_demonstrations():
     e = Enigma(settings)
     e.create_machinery()
     print("******Demo 1******\n")
-    e.encode('A')
+    print_encoding('A', e.encode_result('A'))
     print('\n\n')
 
     # 2 A -> B
@@ -24,7 +32,7 @@ def rotor_demonstrations():
     e = Enigma(settings)
     e.create_machinery()
     print("******Demo 2******\n")
-    e.encode('A')
+    print_encoding('A', e.encode_result('A'))
     print('\n\n')
 
     # 3 A -> L
@@ -36,7 +44,7 @@ def rotor_demonstrations():
     e = Enigma(settings)
     e.create_machinery()
     print("******Demo 3******\n")
-    e.encode('A')
+    print_encoding('A', e.encode_result('A'))
     print('\n\n')
     # 4 H -> Y
     settings = {'rotors': "IV V Beta",
@@ -47,7 +55,7 @@ def rotor_demonstrations():
     e = Enigma(settings)
     e.create_machinery()
     print("******Demo 4******\n")
-    e.encode('H')
+    print_encoding('H', e.encode_result('H'))
     print('\n\n')
     # 5 Z -> V
     settings = {'rotors': "I II III IV",
@@ -58,7 +66,7 @@ def rotor_demonstrations():
     e = Enigma(settings)
     e.create_machinery()
     print("******Demo 5******\n")
-    e.encode('Z')
+    print_encoding('Z', e.encode_result('Z'))
     print('\n\n')
 
 
@@ -71,7 +79,7 @@ def machine_demonstrations():
     e = Enigma(settings)
     e.create_machinery()
     print("******Machine Example 1******\n")
-    e.encode('HELLOWORLD')
+    print_encoding('HELLOWORLD', e.encode_result('HELLOWORLD'))
     print('\n\n')
 
     settings = {'rotors': "IV V Beta I",
@@ -82,5 +90,6 @@ def machine_demonstrations():
     e = Enigma(settings)
     e.create_machinery()
     print("******Machine Example 2******\n")
-    e.encode('BUPXWJCDPFASXBDHLBBIBSRNWCSZXQOLBNXYAXVHOGCUUIBCVMPUZYUUKHI')
+    message = 'BUPXWJCDPFASXBDHLBBIBSRNWCSZXQOLBNXYAXVHOGCUUIBCVMPUZYUUKHI'
+    print_encoding(message, e.encode_result(message))
     print('\n\n')
\ No newline at end of file
@@ -0,0 +1,853 @@
+from catalogue import ALPHABET, ROTOR_CATALOGUE, reflector_table, rotor_tables
+from plugboard import Plugboard
+from scrambler_store import STORE_ENVIRONMENT, ScramblerStore, state_offset
+from collections import namedtuple
+import copy
+import functools
+import mmap
+import os
+import re
+import string
+
+# Input lookup of a machine with no plugleads: typed letters are converted to upper case at the Housing
+UNPLUGGED_INPUT = {character: ALPHABET.index(character.upper()) for character in string.ascii_letters}
+# Position reached by rotating a rotor once from each position
+NEXT_POSITION = list(range(1, 26)) + [0]
+# Handling of characters other than the letters A-Z (in either case) by encode_stream: 'error' raises a ValueError as
+# encode does, 'pass' copies them to the output unchanged and 'strip' leaves them out. Neither rotates the rotors.
+NON_ALPHA_MODES = ('error', 'pass', 'strip')
+NON_ALPHA = re.compile('[^A-Za-z]+')
+# Characters read from a file at a time by encode_stream
+STREAM_CHUNK_SIZE = 1 << 16
+# Byte values of the letters A-Z and a-z, and every other byte value, for encoding bytes (see encode_into)
+LETTER_BYTES = string.ascii_letters.encode()
+BYTE_IDENTITY = bytes(range(256))
+NON_LETTER_BYTES = bytes(byte for byte in range(256) if byte not in LETTER_BYTES)
+LETTER_RUN = re.compile(b'[A-Za-z]+')
+NON_LETTER = re.compile(b'[^A-Za-z]')
+# Fewest letters worth encoding by the cycle of rotor positions rather than one byte at a time (see encode_into), and
+# the number of cycles encoded at a time
+CYCLE_THRESHOLD = 1 << 18
+CYCLE_BLOCK = 256
+# Largest message table worth building, in bytes (see ScramblerCycles.message_table): about 250 characters for a
+# full cycle
+MESSAGE_TABLE_LIMIT = 1 << 22
+# Bytes of a memory-mapped file encoded at a time (see encode_mapped_file)
+MMAP_CHUNK_SIZE = 1 << 24
+# The store of precomputed scrambler tables in use, if any (see load_scrambler_store)
+SCRAMBLER_STORE = None
+
+
+class EncodeResult(namedtuple('EncodeResult', ['text', 'positions'])):
+    """
+    The outcome of encoding a message: the encoded text, and the final rotor positions as integers (0-25) with the
+    leftmost rotor first.
+    """
+    __slots__ = ()
+
+    @property
+    def position_letters(self) -> str:
+        """ Final rotor positions as letters, leftmost rotor first """
+        return ''.join(ALPHABET[position] for position in self.positions)
+
+
+class ReflectorPasses:
+    """
+    The signal path of a message to and from the reflector, with everything except the reflector fixed (see
+    CompiledEnigma.reflector_passes). Decoding the message with any reflector wiring is then two lookups per
+    character, and only characters whose signal reaches a rewired contact need decoding again.
+    """
+    def __init__(self, signals:list, returns:list, standard:str):
+        """
+        :param signals: For each character, the signal index arriving at the reflector
+        :param returns: For each character, a tuple mapping the signal index leaving the reflector to the output
+        character
+        :param standard: Contacts of the reflector the machine was built with
+        """
+        self.signals = signals
+        self.returns = returns
+        self.standard = standard
+        self.standard_table = reflector_table(standard)
+        self.standard_output = [back[self.standard_table[signal]] for signal, back in zip(signals, returns)]
+        # Characters of the message grouped by the signal index they arrive at the reflector with
+        self.arrivals = [[] for _ in range(26)]
+        for i, signal in enumerate(signals):
+            self.arrivals[signal].append(i)
+
+    def decode(self, contacts:str) -> str:
+        """ Decodes the message with the reflector wired as contacts """
+        table = reflector_table(contacts)
+        standard_table = self.standard_table
+        output = list(self.standard_output)
+        returns = self.returns
+        for signal in range(26):
+            if table[signal] != standard_table[signal]:
+                reflected = table[signal]
+                for i in self.arrivals[signal]:
+                    output[i] = returns[i][reflected]
+        return ''.join(output)
+
+
+class ScramblerCycles:
+    """
+    The scrambler permutation (rotors and reflector, without the plugboard) at every rotor position a machine steps
+    through, worked out once and shared by every message and plugboard under the same rotors, ring settings and
+    reflector. Whatever the start positions, after a key press or two (for the double step to come into line) the
+    rotor positions run round a fixed cycle - 16900 key presses for the catalogue rotors, or shorter if a rotor has no
+    notch - so each cycle is stored once, as a compact array of 26 bytes per key press, and any run of key presses is a
+    slice of it.
+    """
+    def __init__(self, rotors:tuple, reflector:str, fixed_positions:tuple = (), store:ScramblerStore = None):
+        """
+        :param rotors: (contacts, ring setting, notch letter or None) for the three rotors which can turn, rightmost
+        first
+        :param reflector: The reflector contacts
+        :param fixed_positions: Positions (0-25) of any rotors beyond the third, which never turn, rightmost first
+        :param store: A store of precomputed scrambler tables (see scrambler_store.py) to read the scramblers from,
+        if it holds these rotors and reflector
+        """
+        tables = [rotor_tables(contacts, ring_setting) for contacts, ring_setting, _ in rotors]
+        self.forward = [forward for forward, _ in tables]
+        self.inverse = [inverse for _, inverse in tables]
+        self.notches = [ALPHABET.index(notch) if notch else -1 for _, _, notch in rotors]
+        # A rotor beyond the third never turns, so is folded into the reflector (see CompiledEnigma.effective_reflector)
+        self.reflector = reflector_table(reflector)
+        for (contacts, ring_setting, _), position in zip(rotors[3:], fixed_positions):
+            forward, inverse = rotor_tables(contacts, ring_setting)
+            self.reflector = [inverse[position][self.reflector[forward[position][signal]]] for signal in range(26)]
+        self.rightmost = [(bytes(forward) + BYTE_IDENTITY[26:], bytes(inverse) + BYTE_IDENTITY[26:])
+                          for forward, inverse in zip(self.forward[0], self.inverse[0])]
+        # The stored scramblers of these rotors and reflector, which are worked out with every ring setting at 1, so
+        # are read at each rotor's position less its ring setting
+        self.table = None
+        if store is not None:
+            self.table = store.table(tuple(contacts for contacts, _, _ in rotors[:3]),
+                                     ''.join(ALPHABET[contact] for contact in self.reflector))
+            # Offset into the table contributed by each rotor's position (see scrambler_store.state_offset)
+            self.table_offsets = [[state_offset(tuple((position - ring_setting + 1) % 26 if j == i else 0
+                                                      for j in range(3))) for position in range(26)]
+                                  for i, (_, ring_setting, _) in enumerate(rotors[:3])]
+        # Each cycle as (rotor positions after each key press, scramblers as one bytes object of 26 bytes per key
+        # press), and the cycle and index of every rotor position in a cycle
+        self.cycles = []
+        self.index = {}
+        # The path from the middle rotor, via the reflector, back to the middle rotor, by middle and leftmost positions
+        self.inner = {}
+        # The most recent message table (see message_table), and its cycle and message signals
+        self.last_message_table = (None, None)
+
+    def step(self, state:tuple) -> tuple:
+        """ Returns the (rightmost, middle, leftmost) rotor positions after a key press (see CompiledEnigma.key_press) """
+        position_0, position_1, position_2 = state
+        notch_0, notch_1 = self.notches[:2]
+        if notch_0 == position_0 or notch_1 == position_1:
+            if notch_1 == position_1:
+                position_2 = NEXT_POSITION[position_2]
+            position_1 = NEXT_POSITION[position_1]
+        return NEXT_POSITION[position_0], position_1, position_2
+
+    def scrambler(self, state:tuple) -> bytes:
+        """ Returns the scrambler permutation at the (rightmost, middle, leftmost) rotor positions, as 26 bytes """
+        if self.table is not None:
+            offsets_0, offsets_1, offsets_2 = self.table_offsets
+            offset = offsets_0[state[0]] + offsets_1[state[1]] + offsets_2[state[2]]
+            return self.table[offset:offset + 26].tobytes()
+        inner = self.inner.get(state[1:])
+        if inner is None:
+            forward_1, forward_2 = self.forward[1][state[1]], self.forward[2][state[2]]
+            inverse_1, inverse_2 = self.inverse[1][state[1]], self.inverse[2][state[2]]
+            reflector = self.reflector
+            inner = self.inner[state[1:]] = bytes(inverse_1[inverse_2[reflector[forward_2[forward_1[signal]]]]]
+                                                  for signal in range(26)) + BYTE_IDENTITY[26:]
+        forward_0, inverse_0 = self.rightmost[state[0]]
+        return BYTE_IDENTITY[:26].translate(forward_0).translate(inner).translate(inverse_0)
+
+    def scramblers(self, states:list) -> bytes:
+        """ Returns the scrambler permutations at each of the rotor positions, as one bytes object """
+        if self.table is None:
+            return b''.join([self.scrambler(state) for state in states])
+        # Read straight from the stored table
+        table = self.table
+        offsets_0, offsets_1, offsets_2 = self.table_offsets
+        return b''.join([table[offset:offset + 26] for offset in
+                         [offsets_0[state_0] + offsets_1[state_1] + offsets_2[state_2]
+                          for state_0, state_1, state_2 in states]])
+
+    def locate(self, initial_positions:tuple) -> tuple:
+        """
+        Follows the key presses from the start positions into a cycle, working the cycle out if it is new
+
+        :param initial_positions: (rightmost, middle, leftmost) rotor positions before the first key press
+        :return: (lead, cycle, index) - the rotor positions after each key press before the cycle is reached
+        (usually none), and the cycle number and index into it reached after them
+        """
+        walk = []
+        seen = {}
+        state = self.step(initial_positions)
+        while state not in self.index:
+            if state in seen:
+                # A new cycle, starting at state; the key presses before it lead into it
+                start = seen[state]
+                states = walk[start:]
+                cycle = len(self.cycles)
+                self.cycles.append((states, self.scramblers(states)))
+                for i, point in enumerate(states):
+                    self.index[point] = (cycle, i)
+                return walk[:start], cycle, 0
+            seen[state] = len(walk)
+            walk.append(state)
+            state = self.step(state)
+        cycle, index = self.index[state]
+        return walk, cycle, index
+
+    def positions_after(self, initial_positions:tuple, length:int) -> tuple:
+        """ Returns the (rightmost, middle, leftmost) rotor positions after length key presses (at least one) """
+        lead, cycle, index = self.locate(initial_positions)
+        if length <= len(lead):
+            return lead[length - 1]
+        states = self.cycles[cycle][0]
+        return states[(index + length - len(lead) - 1) % len(states)]
+
+    def sequence(self, initial_positions:tuple, length:int) -> bytes:
+        """
+        Returns the scrambler permutations of the next length key presses from the start positions, as one bytes
+        object of 26 bytes per key press: the signal leaving the scrambler at key press i for the signal s entering it
+        is sequence[26 * i + s]
+
+        :param initial_positions: (rightmost, middle, leftmost) rotor positions before the first key press
+        :param length: Number of key presses
+        """
+        lead, cycle, index = self.locate(initial_positions)
+        scramblers = self.cycles[cycle][1]
+        rest = max(length - len(lead), 0) * 26
+        start = index * 26
+        if start + rest <= len(scramblers):
+            cycled = scramblers[start:start + rest]
+        else:
+            # Round the cycle more than once
+            cycled = (scramblers * ((start + rest) // len(scramblers) + 1))[start:start + rest]
+        return (b''.join(self.scrambler(state) for state in lead) + cycled)[:length * 26]
+
+    def message_table(self, cycle:int, signals:bytes) -> bytes:
+        """
+        Returns the scrambler output for every character of a message, from every point of a cycle at once: the
+        signal leaving the scrambler at character i of the message, typed with the first key press at index k of the
+        cycle, is table[i * period + k]. Decoding one message from any start position in the cycle is then a single
+        slice, table[k::period]. Each row is a column of the cycle's scramblers, turned by i, so the table is built
+        with a few slices per character. The most recent table is kept.
+
+        :param cycle: The cycle number (see locate)
+        :param signals: The signal entering the scrambler for each character of the message, as bytes
+        """
+        key = (cycle, signals)
+        if self.last_message_table[0] != key:
+            scramblers = self.cycles[cycle][1]
+            period = len(scramblers) // 26
+            rows = []
+            for i, signal in enumerate(signals):
+                column = scramblers[signal::26]
+                turn = i % period
+                rows.append(column[turn:] + column[:turn])
+            self.last_message_table = (key, b''.join(rows))
+        return self.last_message_table[1]
+
+
+@functools.lru_cache(maxsize=32)
+def scrambler_cycles(rotors:tuple, reflector:str, fixed_positions:tuple = ()) -> ScramblerCycles:
+    """
+    Returns the shared ScramblerCycles for the rotors, reflector and fixed rotor positions, so that every machine with
+    the same settings (in any search in this process) reuses the same cycles
+    """
+    return ScramblerCycles(rotors, reflector, fixed_positions, loaded_scrambler_store())
+
+
+def load_scrambler_store(path:str) -> ScramblerStore:
+    """
+    Memory-maps a store of precomputed scrambler tables (see scrambler_store.py) for every machine in this process to
+    read its scramblers from. The path is also set in the environment, so that worker processes load the same store.
+
+    :param path: The store file
+    """
+    global SCRAMBLER_STORE
+    SCRAMBLER_STORE = ScramblerStore(path)
+    os.environ[STORE_ENVIRONMENT] = path
+    # Cycles worked out before the store was loaded are dropped, so that they are read from it from now on
+    scrambler_cycles.cache_clear()
+    return SCRAMBLER_STORE
+
+
+def loaded_scrambler_store() -> ScramblerStore:
+    """ Returns the store of scrambler tables in use, loading the one named in the environment if there is one """
+    if SCRAMBLER_STORE is None and os.environ.get(STORE_ENVIRONMENT):
+        load_scrambler_store(os.environ[STORE_ENVIRONMENT])
+    return SCRAMBLER_STORE
+
+
+class CompiledEnigma:
+    """
+    Integer-table representation of an Enigma machine. Takes the same settings dictionary as the Enigma class and
+    compiles each part of the machine into plain lists so that a key press costs a handful of list lookups:
+    1. Plugboard - folded into a single input lookup (character -> index) and a single output lookup (index -> character)
+    2. Rotors - for every rotor position a 26-entry forward (pin->contact) and inverse (contact->pin) table
+    3. Reflector - a single 26-entry table
+    Rotor positions are held as integer offsets (0-25), listed from the rightmost rotor to the leftmost.
+    """
+    def __init__(self, settings:dict, rotor_box:dict = ROTOR_CATALOGUE, board:object = None):
+        """
+        :param settings: Settings dictionary as used by Enigma
+        :param rotor_box: Rotor and reflector wirings (see Enigma.rotor_box)
+        :param board: Plugboard for the machine (built from settings['plugboard_pairs'] if not given)
+        """
+        self.settings = settings
+        rotor_names = settings['rotors'].split(' ')
+        ring_settings = settings['ring_settings'].split(' ')
+        initial_positions = settings['initial_positions'].split(' ')
+
+        self.forward = []
+        self.inverse = []
+        self.notches = []
+        self.positions = []
+        # (contacts, ring setting, notch) of each rotor, right to left, to find the shared scrambler cycles by
+        self.rotor_parts = []
+        # Rotors are compiled right to left, to match the order the signal first passes through them
+        # The tables for each rotor and ring setting are compiled once and then shared (see catalogue.rotor_tables)
+        for i in range(len(rotor_names) - 1, -1, -1):
+            forward, inverse = rotor_tables(rotor_box[rotor_names[i]]['contacts'], int(ring_settings[i]))
+            self.forward.append(forward)
+            self.inverse.append(inverse)
+            notch = rotor_box[rotor_names[i]]['notch']
+            # Rotors without a notch (Beta, Gamma) never match a position, so use -1
+            self.notches.append(ALPHABET.index(notch) if notch else -1)
+            self.positions.append(ALPHABET.index(initial_positions[i]))
+            self.rotor_parts.append((rotor_box[rotor_names[i]]['contacts'], int(ring_settings[i]), notch))
+        self.rotor_parts = tuple(self.rotor_parts)
+
+        # A rewired reflector (see CodeBreaker.codebreak5_rewiring) replaces the standard contacts
+        contacts = settings.get('reflector_contacts') or rotor_box[settings['reflector']]['contacts']
+        self.reflector_contacts = contacts
+        self.reflector = reflector_table(contacts)
+        self.compile_plugboard(board if board is not None else Plugboard(settings))
+
+    def compile_plugboard(self, board:object = None):
+        """
+        Folds the plugboard into two lookups. The input lookup replicates Enigma.encode, where the typed character is
+        passed through the plugboard before being converted to upper case at the Housing. Only the plugged characters
+        need changing from the unplugged lookups.
+        """
+        self.input_index = dict(UNPLUGGED_INPUT)
+        self.output_char = list(ALPHABET)
+        if board:
+            for character, plugged in board.mapping.items():
+                if plugged.upper() in ALPHABET:
+                    self.input_index[character] = ALPHABET.index(plugged.upper())
+                else:
+                    self.input_index.pop(character, None)
+                if character in ALPHABET:
+                    self.output_char[ALPHABET.index(character)] = plugged
+        # The same lookups by byte value, for encoding bytes, and the byte translation tables by rotor positions (see
+        # byte_table)
+        self.input_byte = [self.input_index.get(chr(byte), -1) for byte in range(256)]
+        self.output_byte = ''.join(self.output_char).encode()
+        self.letter_signals = bytes(self.input_byte[byte] for byte in LETTER_BYTES)
+        self.output_table = self.output_byte + BYTE_IDENTITY[26:]
+        self.byte_tables = {}
+        # The last message encoded by encode_cached, and its input signals
+        self.message_signals = (None, None)
+
+    def set_positions(self, positions):
+        """
+        Turns the rotors straight to the given positions, without rebuilding any tables, so that one compiled
+        machine can be reused for every candidate start position in a search.
+
+        :param positions: Space-separated letters as in settings['initial_positions'] (i.e. 'A A Z'), or a sequence
+        of integers 0-25, leftmost rotor first
+        """
+        if isinstance(positions, str):
+            positions = [ALPHABET.index(letter) for letter in positions.split(' ')]
+        if len(positions) != len(self.positions):
+            raise ValueError(f"Expected {len(self.positions)} rotor positions, got {len(positions)}")
+        self.positions[:] = reversed(positions)
+
+    def clone(self) -> 'CompiledEnigma':
+        """
+        Returns a copy of the machine in its current state. The compiled tables are shared, so this is cheap, and
+        only the rotor positions are copied, so the copy can be advanced independently of the original.
+        """
+        machine = copy.copy(self)
+        machine.positions = list(self.positions)
+        return machine
+
+    def key_press(self):
+        """
+        Rotates the rotors as in Rotor.key_press. The rightmost rotor always rotates, the middle rotor rotates if
+        either the rightmost rotor or the middle rotor itself is on its notch (the "double step"), and the third
+        rotor rotates along with the middle rotor when the middle rotor is on its notch. A fourth rotor never rotates.
+        """
+        positions = self.positions
+        notches = self.notches
+        if notches[0] == positions[0] or notches[1] == positions[1]:
+            if notches[1] == positions[1]:
+                positions[2] = NEXT_POSITION[positions[2]]
+            positions[1] = NEXT_POSITION[positions[1]]
+        positions[0] = NEXT_POSITION[positions[0]]
+
+    def encode(self, message:str) -> str:
+        """
+        Runs each character through the compiled machine, rotating the rotors before each character as the original
+        machine does. The rotor positions are held in local variables for the duration of the message, and a fourth
+        rotor (which never rotates) is folded into the reflector.
+
+        :param message: The message to be decoded/encoded
+        :return: decoded/encoded message string
+        """
+        input_index = self.input_index
+        output_char = self.output_char
+        forward_0, forward_1, forward_2 = self.forward[:3]
+        inverse_0, inverse_1, inverse_2 = self.inverse[:3]
+        notch_0, notch_1 = self.notches[:2]
+        position_0, position_1, position_2 = self.positions[:3]
+        reflector = self.effective_reflector()
+
+        encoded_phrase = []
+        try:
+            for character in message:
+                # Rotate the rotors (see key_press)
+                if notch_0 == position_0 or notch_1 == position_1:
+                    if notch_1 == position_1:
+                        position_2 = NEXT_POSITION[position_2]
+                    position_1 = NEXT_POSITION[position_1]
+                position_0 = NEXT_POSITION[position_0]
+                try:
+                    signal = input_index[character]
+                except KeyError:
+                    raise ValueError(f"Cannot encode character {character!r}") from None
+                # Leftwards through the rotors, off the reflector, and back again rightwards
+                signal = forward_2[position_2][forward_1[position_1][forward_0[position_0][signal]]]
+                signal = reflector[signal]
+                signal = inverse_0[position_0][inverse_1[position_1][inverse_2[position_2][signal]]]
+                encoded_phrase.append(output_char[signal])
+        finally:
+            # Keep the machine state, even if a character could not be encoded
+            self.positions[:3] = position_0, position_1, position_2
+        return ''.join(encoded_phrase)
+
+    def encode_result(self, message:str) -> EncodeResult:
+        """
+        Encodes the message and returns it along with the final rotor positions (see EncodeResult)
+        """
+        text = self.encode(message)
+        return EncodeResult(text, self.rotor_positions)
+
+    def encode_stream(self, source, non_alpha:str = 'error', chunk_size:int = STREAM_CHUNK_SIZE):
+        """
+        Encodes a message too large to hold in memory, one chunk at a time. The rotors carry on from one chunk to the
+        next, so the chunks together encode exactly as the whole message would, and only one chunk is held at a time.
+
+        :param source: Iterable of strings, or a file-like object with a read method (read chunk_size characters at
+        a time, so a file with no line breaks is still read in chunks)
+        :param non_alpha: 'error', 'pass' or 'strip' - what to do with characters other than letters (see
+        NON_ALPHA_MODES)
+        :param chunk_size: Characters read from a file-like source at a time
+        :return: Generator of encoded chunks, one per chunk read
+        """
+        if non_alpha not in NON_ALPHA_MODES:
+            raise ValueError(f"Unknown non_alpha mode: {non_alpha}, choose from {', '.join(NON_ALPHA_MODES)}")
+        if hasattr(source, 'read'):
+            source = iter(functools.partial(source.read, chunk_size), source.read(0))
+        for chunk in source:
+            if non_alpha == 'strip':
+                yield self.encode(NON_ALPHA.sub('', chunk))
+            elif non_alpha == 'pass':
+                # Split into alternating runs of letters and other characters; only the letters are encoded
+                runs = NON_ALPHA.split(chunk)
+                others = NON_ALPHA.findall(chunk)
+                encoded = [self.encode(runs[0])]
+                for other, letters in zip(others, runs[1:]):
+                    encoded.append(other)
+                    encoded.append(self.encode(letters))
+                yield ''.join(encoded)
+            else:
+                yield self.encode(chunk)
+
+    def encode_into(self, data, out, non_alpha:str = 'error') -> int:
+        """
+        Encodes a bytes-like object of ASCII text (bytes, bytearray, memoryview, mmap or a NumPy uint8 array) into a
+        preallocated writable buffer, which may be data itself, without making a Python string of either. Letters are
+        encoded as by encode and the rotors carry on from their current positions. Long runs of letters are encoded by
+        the cycle of rotor positions the machine steps through (see position_cycle): all the letters typed at the same
+        point of the cycle are translated at once with a byte translation table, so the work per letter is done in C.
+
+        :param data: The message to be decoded/encoded
+        :param out: Writable buffer at least as long as the encoded message
+        :param non_alpha: 'error', 'pass' or 'strip' - what to do with bytes other than letters (see NON_ALPHA_MODES).
+        With 'error', nothing is encoded and the rotors do not move if there are any.
+        :return: Number of bytes written to out
+        """
+        if non_alpha not in NON_ALPHA_MODES:
+            raise ValueError(f"Unknown non_alpha mode: {non_alpha}, choose from {', '.join(NON_ALPHA_MODES)}")
+        # The byte views are released on leaving, even on an error, so that a memory map they view can be closed
+        with memoryview(data) as data_view, memoryview(out) as out_buffer, \
+                data_view.cast('B') as view, out_buffer.cast('B') as out_view:
+            if len(out_view) < len(view) and non_alpha != 'strip':
+                raise ValueError(f"Output buffer too small: {len(out_view)} bytes for {len(view)}")
+            if non_alpha == 'error':
+                match = NON_LETTER.search(view)
+                if match:
+                    raise ValueError(f"Cannot encode character {chr(view[match.start()])!r}")
+                self.encode_letters_into(view, out_view)
+                return len(view)
+
+            letters = bytes(view).translate(None, NON_LETTER_BYTES)
+            if non_alpha == 'strip':
+                if len(out_view) < len(letters):
+                    raise ValueError(f"Output buffer too small: {len(out_view)} bytes for {len(letters)}")
+                self.encode_letters_into(letters, out_view)
+                return len(letters)
+            encoded = bytearray(len(letters))
+            self.encode_letters_into(letters, encoded)
+            # Copy the other bytes as they are, then put each run of encoded letters back in its place
+            out_view[:len(view)] = view
+            offset = 0
+            for match in LETTER_RUN.finditer(view):
+                start, end = match.span()
+                out_view[start:end] = encoded[offset:offset + end - start]
+                offset += end - start
+            return len(view)
+
+    def encode_letters_into(self, letters, out):
+        """
+        Encodes a bytes-like object holding only letters into the start of a writable buffer (see encode_into)
+        """
+        length = len(letters)
+        if length < CYCLE_THRESHOLD:
+            # Too short to be worth building a translation table for every point of the cycle
+            input_byte = self.input_byte
+            output_byte = self.output_byte
+            forward_0, forward_1, forward_2 = self.forward[:3]
+            inverse_0, inverse_1, inverse_2 = self.inverse[:3]
+            notch_0, notch_1 = self.notches[:2]
+            position_0, position_1, position_2 = self.positions[:3]
+            reflector = self.effective_reflector()
+            for i, byte in enumerate(letters):
+                # Rotate the rotors (see key_press)
+                if notch_0 == position_0 or notch_1 == position_1:
+                    if notch_1 == position_1:
+                        position_2 = NEXT_POSITION[position_2]
+                    position_1 = NEXT_POSITION[position_1]
+                position_0 = NEXT_POSITION[position_0]
+                signal = forward_2[position_2][forward_1[position_1][forward_0[position_0][input_byte[byte]]]]
+                signal = reflector[signal]
+                out[i] = output_byte[inverse_0[position_0][inverse_1[position_1][inverse_2[position_2][signal]]]]
+            self.positions[:3] = position_0, position_1, position_2
+            return
+
+        states, start = self.position_cycle()
+        period = len(states) - start
+        tables = [self.byte_table(state) for state in states]
+        # Key presses before the machine enters its cycle
+        for i in range(start):
+            out[i] = tables[i][letters[i]]
+        # The rest a block of whole cycles at a time, so that letters at the same point of the cycle are a fixed
+        # stride apart
+        cycle_tables = tables[start:]
+        block_size = period * CYCLE_BLOCK
+        for block_start in range(start, length, block_size):
+            block = bytes(letters[block_start:block_start + block_size])
+            encoded = bytearray(len(block))
+            for point, table in enumerate(cycle_tables[:len(block)]):
+                encoded[point::period] = block[point::period].translate(table)
+            out[block_start:block_start + len(block)] = encoded
+        self.positions[:3] = states[start + (length - 1 - start) % period]
+
+    def position_cycle(self) -> tuple:
+        """
+        Returns the rotor positions after each key press from the current positions, once round the cycle they run
+        through (see ScramblerCycles). The machine itself is not rotated.
+
+        :return: (states, start) - the (rightmost, middle, leftmost) rotor positions after each key press up to the
+        first repeat, and the index into states at which the cycle starts
+        """
+        cycles = self.scrambler_cycles()
+        lead, cycle, index = cycles.locate(tuple(self.positions[:3]))
+        states = cycles.cycles[cycle][0]
+        return lead + states[index:] + states[:index], len(lead)
+
+    def byte_table(self, state:tuple) -> bytes:
+        """
+        Returns the byte translation table (see bytes.translate) which encodes each letter at the (rightmost, middle,
+        leftmost) rotor positions, through the plugboard and the scrambler at those positions (see ScramblerCycles).
+        Cached by positions, as the machine returns to the same positions every cycle.
+        """
+        key = state + tuple(self.positions[3:])
+        table = self.byte_tables.get(key)
+        if table is None:
+            scrambler = self.scrambler_cycles().scrambler(state) + BYTE_IDENTITY[26:]
+            signals = self.letter_signals.translate(scrambler)
+            table = self.byte_tables[key] = bytes.maketrans(LETTER_BYTES, signals.translate(self.output_table))
+        return table
+
+    def encode_bytes(self, data, non_alpha:str = 'error') -> bytes:
+        """
+        As encode_into, but returns the encoded message as a new bytes object
+
+        :param data: The message to be decoded/encoded, as a bytes-like object
+        :param non_alpha: 'error', 'pass' or 'strip' - what to do with bytes other than letters
+        :return: decoded/encoded message bytes
+        """
+        out = bytearray(len(memoryview(data).cast('B')))
+        written = self.encode_into(data, out, non_alpha)
+        del out[written:]
+        return bytes(out)
+
+    def encode_mapped_file(self, input_path:str, output_path:str, non_alpha:str = 'error',
+                           chunk_size:int = MMAP_CHUNK_SIZE) -> int:
+        """
+        Encodes a file into another by memory-mapping both, so the file is encoded straight from the page cache
+        rather than being read into Python strings. The file is encoded chunk_size bytes at a time, with the rotors
+        carrying on from one chunk to the next.
+
+        :param input_path: The file to be decoded/encoded
+        :param output_path: The file to write the encoded message to (replaced if it exists)
+        :param non_alpha: 'error', 'pass' or 'strip' - what to do with bytes other than letters. With 'error', the
+        output is left as it was and the rotors do not move if there are any.
+        :param chunk_size: Bytes encoded at a time
+        :return: Number of bytes written to the output file
+        """
+        size = os.path.getsize(input_path)
+        positions = list(self.positions)
+        written = 0
+        # Written beside the output first, so that a failure part way through (i.e. a byte other than a letter in a
+        # later chunk, with non_alpha 'error') leaves any existing output as it was
+        try:
+            with open(input_path, 'rb') as source, open(output_path + '.tmp', 'w+b') as destination:
+                if size:
+                    destination.truncate(size)
+                    with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as source_map, \
+                            mmap.mmap(destination.fileno(), size) as destination_map:
+                        with memoryview(source_map) as source_view, memoryview(destination_map) as destination_view:
+                            for start in range(0, size, chunk_size):
+                                # Released as soon as they are used, so that the maps can be closed on an error too
+                                with source_view[start:start + chunk_size] as chunk, \
+                                        destination_view[written:] as out:
+                                    written += self.encode_into(chunk, out, non_alpha)
+                    # Stripped bytes leave the output shorter than the input
+                    destination.truncate(written)
+            os.replace(output_path + '.tmp', output_path)
+        except BaseException:
+            # Nothing was written, so the rotors go back to where they started
+            self.positions[:] = positions
+            raise
+        finally:
+            if os.path.exists(output_path + '.tmp'):
+                os.remove(output_path + '.tmp')
+        return written
+
+    def scrambler_cycles(self) -> ScramblerCycles:
+        """ Returns the ScramblerCycles shared by every machine with these rotors, ring settings and reflector """
+        return scrambler_cycles(self.rotor_parts, self.reflector_contacts, tuple(self.positions[3:]))
+
+    def scrambler_sequence(self, length:int) -> memoryview:
+        """
+        Returns the scrambler permutations (everything except the plugboard) of the next length key presses, read from
+        the shared cycle of rotor positions (see ScramblerCycles), as a compact 2-D array of bytes: row i holds the
+        signal leaving the scrambler at key press i for each signal entering it. np.asarray turns it into a
+        (length, 26) uint8 array without copying. The machine itself is not rotated.
+
+        :param length: Number of key presses (at least one)
+        :return: memoryview of shape (length, 26)
+        """
+        if length < 1:
+            raise ValueError("A scrambler sequence needs at least one key press")
+        sequence = self.scrambler_cycles().sequence(tuple(self.positions[:3]), length)
+        return memoryview(sequence).cast('B', (length, 26))
+
+    def encode_cached(self, message:str, repeated:bool = False) -> str:
+        """
+        As encode, but with the scrambler permutation of each key press read from the shared cycle of rotor positions
+        (see ScramblerCycles) rather than worked out through each rotor, which is faster when many messages or
+        plugboards are tried under the same rotors, ring settings and reflector
+
+        :param message: The message to be decoded/encoded
+        :param repeated: The same message will be encoded from many start positions with the same plugboard, as in a
+        search of start positions. A short message is then encoded from every point of the cycle at once, and each
+        start position just reads its encoding off (see ScramblerCycles.message_table).
+        :return: decoded/encoded message string
+        """
+        if not message:
+            return ''
+        cycles = self.scrambler_cycles()
+        initial_positions = tuple(self.positions[:3])
+        # The signals of the last message are kept, for when the same message is encoded again
+        if self.message_signals[0] != message:
+            input_index = self.input_index
+            try:
+                self.message_signals = (message, bytes([input_index[character] for character in message]))
+            except KeyError as error:
+                raise ValueError(f"Cannot encode character {error.args[0]!r}") from None
+        signals = self.message_signals[1]
+        lead, cycle, index = cycles.locate(initial_positions)
+        states = cycles.cycles[cycle][0]
+        if repeated and not lead and len(message) * len(states) <= MESSAGE_TABLE_LIMIT:
+            table = cycles.message_table(cycle, signals)
+            encoded_phrase = table[index::len(states)].translate(self.output_table).decode()
+            self.positions[:3] = states[(index + len(message) - 1) % len(states)]
+            return encoded_phrase
+        sequence = cycles.sequence(initial_positions, len(message))
+        output_char = self.output_char
+        encoded_phrase = ''.join([output_char[sequence[offset + signal]]
+                                  for offset, signal in zip(range(0, 26 * len(message), 26), signals)])
+        self.positions[:3] = cycles.positions_after(initial_positions, len(message))
+        return encoded_phrase
+
+    def scrambler_tables(self, length:int) -> list:
+        """
+        Returns the permutation applied by the rotors and reflector (everything except the plugboard) at each of the
+        next length key presses, as tuples of 26 signal indices. Encoding the message under any plugboard is then one
+        lookup per character (see encode_with_scrambler). The machine itself is not rotated.
+
+        :param length: Number of key presses
+        :return: List of length permutations
+        """
+        machine = self.clone()
+        forward = self.forward[:3]
+        inverse = self.inverse[:3]
+        reflector = self.effective_reflector()
+        signals = range(26)
+
+        tables = []
+        for _ in range(length):
+            machine.key_press()
+            position_0, position_1, position_2 = machine.positions[:3]
+            forward_0, forward_1, forward_2 = forward[0][position_0], forward[1][position_1], forward[2][position_2]
+            inverse_0, inverse_1, inverse_2 = inverse[0][position_0], inverse[1][position_1], inverse[2][position_2]
+            tables.append(tuple(inverse_0[inverse_1[inverse_2[reflector[forward_2[forward_1[forward_0[signal]]]]]]]
+                                for signal in signals))
+        return tables
+
+    def encode_with_scrambler(self, scrambler:list, message:str) -> str:
+        """
+        Encodes the message through the machine's plugboard and a list of scrambler permutations (see
+        scrambler_tables), one per character, rather than through the rotors. The machine is not rotated.
+
+        :param scrambler: Scrambler permutations, at least as many as there are characters in the message
+        :param message: The message to be decoded/encoded
+        :return: decoded/encoded message string
+        """
+        input_index = self.input_index
+        output_char = self.output_char
+        try:
+            return ''.join([output_char[table[input_index[character]]] for table, character in zip(scrambler, message)])
+        except KeyError as error:
+            raise ValueError(f"Cannot encode character {error.args[0]!r}") from None
+
+    def reflector_passes(self, message:str) -> ReflectorPasses:
+        """
+        Runs each character of the message through the plugboard and every rotor as far as the reflector, and works
+        out the return path for every signal leaving the reflector, so that the message can be decoded with any
+        reflector wiring (see ReflectorPasses). The machine itself is not rotated.
+        """
+        machine = self.clone()
+        input_index = self.input_index
+        output_char = self.output_char
+        rotors = list(zip(self.forward, self.inverse, range(len(self.positions))))
+
+        signals = []
+        returns = []
+        for character in message:
+            machine.key_press()
+            positions = machine.positions
+            try:
+                signal = input_index[character]
+            except KeyError:
+                raise ValueError(f"Cannot encode character {character!r}") from None
+            for forward, _, i in rotors:
+                signal = forward[positions[i]][signal]
+            signals.append(signal)
+
+            back = list(range(26))
+            for _, inverse, i in reversed(rotors):
+                table = inverse[positions[i]]
+                back = [table[signal] for signal in back]
+            returns.append(tuple(output_char[signal] for signal in back))
+        return ReflectorPasses(signals, returns, ''.join(ALPHABET[contact] for contact in self.reflector))
+
+    def find_crib(self, code:str, alignments:list) -> tuple:
+        """
+        Looks for any of the cribs in the decoding of the code from the machine's current positions, decoding only as
+        much as is needed: each crib alignment is abandoned at its first mismatch, and each character of the code is
+        decoded at most once however many cribs and alignments need it. The machine itself is not rotated.
+
+        :param code: The encoded message
+        :param alignments: List of (crib, offsets) pairs giving the offsets into the code to try each crib at (see
+        cribs.crib_alignments)
+        :return: (crib, offset, decoded) - the first crib found and its offset (both None if no crib was found), and
+        the number of characters decoded in looking for them
+        """
+        input_index = self.input_index
+        output_char = self.output_char
+        forward_0, forward_1, forward_2 = self.forward[:3]
+        inverse_0, inverse_1, inverse_2 = self.inverse[:3]
+        notch_0, notch_1 = self.notches[:2]
+        position_0, position_1, position_2 = self.positions[:3]
+        reflector = self.effective_reflector()
+
+        # Rotor positions for each character of the code which any alignment reaches, stepped as in encode
+        length = max((offsets[-1] + len(crib) for crib, offsets in alignments if offsets), default=0)
+        steps = []
+        for _ in range(length):
+            if notch_0 == position_0 or notch_1 == position_1:
+                if notch_1 == position_1:
+                    position_2 = NEXT_POSITION[position_2]
+                position_1 = NEXT_POSITION[position_1]
+            position_0 = NEXT_POSITION[position_0]
+            steps.append((position_0, position_1, position_2))
+
+        # Characters of the code decoded so far
+        plain = [None] * length
+        decoded = 0
+        for crib, offsets in alignments:
+            for offset in offsets:
+                for i, crib_char in enumerate(crib, offset):
+                    character = plain[i]
+                    if character is None:
+                        position_0, position_1, position_2 = steps[i]
+                        try:
+                            signal = input_index[code[i]]
+                        except KeyError:
+                            raise ValueError(f"Cannot encode character {code[i]!r}") from None
+                        signal = forward_2[position_2][forward_1[position_1][forward_0[position_0][signal]]]
+                        signal = reflector[signal]
+                        signal = inverse_0[position_0][inverse_1[position_1][inverse_2[position_2][signal]]]
+                        character = plain[i] = output_char[signal]
+                        decoded += 1
+                    if character != crib_char:
+                        break
+                else:
+                    return crib, offset, decoded
+        return None, None, decoded
+
+    def never_self_encrypts(self) -> bool:
+        """ True if the reflector has no letter wired to itself, in which case no letter can ever encode to itself """
+        return all(contact != pin for pin, contact in enumerate(self.reflector))
+
+    def effective_reflector(self) -> list:
+        """
+        Returns the reflector table with any rotors beyond the third (which never rotate) folded in, so that the
+        signal leaving the third rotor can be mapped straight to the signal returning to it.
+        """
+        reflector = self.reflector
+        for i in range(len(self.positions) - 1, 2, -1):
+            forward = self.forward[i][self.positions[i]]
+            inverse = self.inverse[i][self.positions[i]]
+            reflector = [inverse[reflector[forward[signal]]] for signal in range(26)]
+        return reflector
+
+    @property
+    def rotor_positions(self) -> tuple:
+        """ Current rotor positions as integers (0-25), leftmost rotor first, as in EncodeResult """
+        return tuple(reversed(self.positions))
+
+    @property
+    def position_letters(self) -> str:
+        """ Current rotor positions as letters, leftmost rotor first """
+        return ''.join(ALPHABET[position] for position in self.rotor_positions)
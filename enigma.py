@@ -1,4 +1,6 @@
 from plugboard import Plugboard
+from engine import CompiledEnigma, EncodeResult, MMAP_CHUNK_SIZE, STREAM_CHUNK_SIZE
+from catalogue import ROTOR_CATALOGUE
 import string
 from abc import abstractmethod
 
@@ -14,19 +16,11 @@ class Enigma:
     def __init__(self, settings:dict):
         self.settings = settings
         self.root = None
-        self.rotor_box = {
-            "Housing": {'contacts': 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'notch': None},
-            "Beta": {'contacts': 'LEYJVCNIXWPBQMDRTAKZGFUHOS', 'notch': None},
-            "Gamma": {'contacts': 'FSOKANUERHMBTIYCWLQPZXVGJD', 'notch': None},
-            "I": {'contacts': 'EKMFLGDQVZNTOWYHXUSPAIBRCJ', 'notch': 'Q'},
-            "II": {'contacts': 'AJDKSIRUXBLHWTMCQGZNPYFVOE', 'notch': 'E'},
-            "III": {'contacts': 'BDFHJLCPRTXVZNYEIWGAKMUSQO', 'notch': 'V'},
-            "IV": {'contacts': 'ESOVPZJAYQUIRHXLNFTGKDCMWB', 'notch': 'J'},
-            "V": {'contacts': 'VZBRGITYUPSDNHLXAWMJQOFECK', 'notch': 'Z'},
-            "A": {'contacts': 'EJMZALYXVBWFCRQUONTSPIKHGD', 'notch': None},
-            "B": {'contacts': 'YRUHQSLDPXNGOKMIEBFZCWVJAT', 'notch': None},
-            "C": {'contacts': 'FVPJIAOYEDRZXWGCTKUQSBNMHL', 'notch': None},
-        }
+        # Each machine has its own copy of the catalogue, so that its parts can be changed without affecting others
+        self.rotor_box = {name: dict(part) for name, part in ROTOR_CATALOGUE.items()}
+        # A rewired reflector (see CodeBreaker.codebreak5_rewiring) replaces the contacts of the chosen reflector
+        if settings.get('reflector_contacts'):
+            self.rotor_box[settings['reflector']]['contacts'] = settings['reflector_contacts']
 
     def create_machinery(self):
         """
@@ -47,13 +41,16 @@ class Enigma:
         # Add reflector
         self.add(self.settings['reflector'])
 
+        # Compile the finished machine into integer tables for encoding
+        self.engine = CompiledEnigma(self.settings, self.rotor_box, self.board)
+
     @abstractmethod
     def add(self, name:str, ring_setting:int = 1, initial_position:str = 'A'):
         """
         Adds a named mechanical part to the machine from right to left, and then adjusts the default part setting
         to reflect the desired ring setting and initial position
 
-        :param name: Name of the part being added (see self.rotor_box in the __init__ method for details)
+        :param name: Name of the part being added (see catalogue.ROTOR_CATALOGUE for details)
         :param ring_setting: An integer from 1-26 determining the pin-to-contact mapping for the rotor
         :param initial_position: The starting position for the rotor
         """
@@ -75,78 +72,95 @@ class Enigma:
     def encode(self, message:str) -> str:
         """
         Takes the users input message and runs each character through the enigma machine from right to left, and back
-        again, to produce an encoded character. Encoded characters are combined into a single list and returned/printed
-        as one encoded/decoded message.
+        again, to produce an encoded character. Encoding is carried out by the compiled machine (see engine.py), after
+        which the rotors are turned to match. Nothing is printed, so this can be called as often as required.
 
         :param message: The message to be decoded/encoded
         :return: decoded/encoded message string
         """
-        i=0
-        encoded_phrase = []
-        # For each character in the message
-        while i < len(message):
-            character = message[i]
-            # Run the character through the plugboard
-            character = self.board.encode(character)
+        encoded_phrase = self.engine.encode(message)
+        self.sync_rotors()
+        return encoded_phrase
 
-            ptr = self.root
-            # Rotate all rotors as necessary
-            ptr.left.key_press()
+    def encode_result(self, message:str) -> EncodeResult:
+        """
+        As encode, but returns an EncodeResult holding both the encoded message and the final rotor positions
 
-            # Assign the Housing (first "ptr.contacts") index of the character to input_index inside the first rotor object
-            ptr.left.input_index = ptr.contacts.index(character.upper())
-            ptr = ptr.left
+        :param message: The message to be decoded/encoded
+        :return: EncodeResult(text, positions)
+        """
+        result = self.engine.encode_result(message)
+        self.sync_rotors()
+        return result
 
-            while True:
-                # If there is another rotor to the left
-                if ptr.left is not None:
-                    # If Housing is to the right of the current rotor...
-                    if ptr.right.name == 'Housing':
-                    # ..pass the Housing/input index to the first rotor pins, to get the associated contact/output index
-                        ptr.rotor_encode_left(ptr.input_index)
-                    else:
-                        # Else if it is a rotor to the right, grab that rotors encoded/output character
-                        ptr.rotor_encode_left(ptr.right.output_index)
-                    # Set pointer to the next part to the left and repeat
-                    ptr = ptr.left
-                else:
-                    # No more rotors, now run signal through the reflector
-                    ptr.rotor_encode_left(ptr.right.output_index)
-                    break
+    def encode_stream(self, source, non_alpha:str = 'error', chunk_size:int = STREAM_CHUNK_SIZE):
+        """
+        As encode, but for a message too large to hold in memory: encodes an iterable of strings or a file-like object
+        one chunk at a time, carrying the rotor positions from one chunk to the next (see CompiledEnigma.encode_stream)
 
-            # Pass signal from reflector back through to the plugboard
-            ptr = ptr.right
-            while True:
-                if ptr.right:
-                    # If there is another machine element to the right position, encode as normal
-                    ptr.rotor_encode_right(ptr.left.output_index)
-                    ptr = ptr.right
-                else:
-                    # If there are no more parts to pass the signal through, encode, run through the plugboard if it
-                    # exists, then append the output to the output phrase list
-                    ptr.rotor_encode_right(ptr.left.output_index)
-                    if self.board:
-                        ptr.output_char = self.board.encode(ptr.output_char)
-                    encoded_phrase.append(ptr.output_char)
-                    break
-            # Increase i by one to then loop back and start again for the next character
-            i+=1
+        :param source: Iterable of strings, or a file-like object with a read method
+        :param non_alpha: 'error', 'pass' or 'strip' - what to do with characters other than letters
+        :param chunk_size: Characters read from a file-like source at a time
+        :return: Generator of encoded chunks
+        """
+        try:
+            yield from self.engine.encode_stream(source, non_alpha, chunk_size)
+        finally:
+            self.sync_rotors()
 
-        print(f"Input Phrase: {message}")
-        print(f"Encoded Phrase: {''.join(encoded_phrase)}")
+    def encode_bytes(self, data, non_alpha:str = 'error') -> bytes:
+        """
+        As encode, but for a bytes-like object (bytes, bytearray, memoryview or a NumPy uint8 array) of ASCII text,
+        without converting it to a string (see CompiledEnigma.encode_into)
 
-        if len(self.settings['rotors'].split(' ')) == 3:
-            print(
-                f'Final Rotor Positions:{self.root.left.left.left.position}'
-                f'{self.root.left.left.position}'
-                f'{self.root.left.position}')
-        else:
-            print(f'Final Rotor Positions:{self.root.left.left.left.left.position}'
-                  f'{self.root.left.left.left.position}'
-                  f'{self.root.left.left.position}'
-                  f'{self.root.left.position}')
+        :param data: The message to be decoded/encoded
+        :param non_alpha: 'error', 'pass' or 'strip' - what to do with bytes other than letters
+        :return: decoded/encoded message bytes
+        """
+        encoded = self.engine.encode_bytes(data, non_alpha)
+        self.sync_rotors()
+        return encoded
 
-        return ''.join(encoded_phrase)
+    def encode_mapped_file(self, input_path:str, output_path:str, non_alpha:str = 'error',
+                           chunk_size:int = MMAP_CHUNK_SIZE) -> int:
+        """
+        Encodes a file into another through memory maps of both (see CompiledEnigma.encode_mapped_file)
+
+        :param input_path: The file to be decoded/encoded
+        :param output_path: The file to write the encoded message to
+        :param non_alpha: 'error', 'pass' or 'strip' - what to do with bytes other than letters
+        :param chunk_size: Bytes encoded at a time
+        :return: Number of bytes written to the output file
+        """
+        try:
+            return self.engine.encode_mapped_file(input_path, output_path, non_alpha, chunk_size)
+        finally:
+            self.sync_rotors()
+
+    @property
+    def rotor_positions(self) -> tuple:
+        """ Current rotor positions as integers (0-25), leftmost rotor first (see CompiledEnigma.rotor_positions) """
+        return self.engine.rotor_positions
+
+    @property
+    def position_letters(self) -> str:
+        """ Current rotor positions as letters, leftmost rotor first """
+        return self.engine.position_letters
+
+    def sync_rotors(self):
+        """
+        Turns each Rotor in the linked list to the position held by the compiled machine, so that the rotors always
+        reflect the state of the machine after encoding.
+        """
+        ptr = self.root.left
+        for position in self.engine.positions:
+            steps = (position - string.ascii_uppercase.index(ptr.pins[0])) % 26
+            if steps:
+                ptr.pins = ptr.reorder(ptr.pins, steps)
+                ptr.contacts = ptr.reorder(ptr.contacts, steps)
+                ptr.position = ptr.pins[0]
+                ptr.previous_position = ptr.pins[-1]
+            ptr = ptr.left
 
 
 class Rotor(Enigma):
@@ -0,0 +1,172 @@
+from engine import CompiledEnigma
+from catalogue import ALPHABET
+from plugboard import Plugboard
+from scoring import get_scorer
+import random
+import time
+
+# Every pair of letter indices, as the moves tried by the hill climb
+LETTER_PAIRS = [(first, second) for first in range(26) for second in range(first + 1, 26)]
+
+
+class PlugboardClimber:
+    """
+    Recovers an unknown plugboard by hill climbing, for a machine whose rotors, ring settings, reflector and start
+    positions are known (or are among the best candidates of a scored search). The rotors and reflector are run once
+    into scrambler tables (see CompiledEnigma.scrambler_tables), so each trial plugboard costs two lookups per character
+    and a score. Each restart:
+    1. Starts from a random plugboard (plus any known leads, which are never changed)
+    2. Tries connecting every pair of letters in turn, moving or removing leads as needed, and keeps each change which
+    improves the score, until a full pass makes no improvement. The climb is run first on the index of coincidence,
+    which finds most leads from a poor start, and then on the chosen scorer.
+    The best plugboard over all restarts is kept.
+    """
+    def __init__(self, settings:dict, code:str, scorer:str = 'quadgram', max_leads:int = 10, seed = None):
+        """
+        :param settings: The machine settings. Fully known leads in settings['plugboard_pairs'] are kept; leads with
+        '?' plugs are ignored.
+        :param code: The encoded message (upper case letters A-Z only)
+        :param scorer: Scoring method for the final climb (see scoring.Scorer)
+        :param max_leads: The most leads the plugboard may have, including the known leads
+        :param seed: Seed for the random starting plugboards, so that a search can be repeated
+        """
+        if max_leads > Plugboard().unusedplugleads:
+            raise ValueError("Lead creation exceeds max number of leads")
+        known_pairs = ' '.join(pair for pair in settings['plugboard_pairs'].split(' ') if pair and '?' not in pair)
+        self.settings = dict(settings, plugboard_pairs=known_pairs)
+        self.code = code
+        self.code_indices = [ALPHABET.index(character) for character in code]
+        self.scorer = get_scorer(scorer)
+        self.ioc_scorer = get_scorer('ioc')
+        self.max_leads = max_leads
+        self.random = random.Random(seed)
+
+        # The known leads are checked by the Plugboard, then kept out of the climb
+        self.known = Plugboard(pairs=known_pairs).table
+        if len(known_pairs.split()) > max_leads:
+            raise ValueError("Lead creation exceeds max number of leads")
+        self.free_letters = [letter for letter in range(26) if self.known[letter] == letter]
+        self.moves = [(first, second) for first, second in LETTER_PAIRS
+                      if first in self.free_letters and second in self.free_letters]
+
+        machine = CompiledEnigma(dict(settings, plugboard_pairs=''))
+        self.scramblers = machine.scrambler_tables(len(code))
+        self.restarts = 0
+
+    def decode(self, plug:list) -> list:
+        """ Decodes the code through the plugboard plug (a table of 26 letter indices), as letter indices """
+        return [plug[scrambler[plug[letter]]] for scrambler, letter in zip(self.scramblers, self.code_indices)]
+
+    def random_plugboard(self) -> tuple:
+        """ Returns a plugboard table with the known leads and a random number of random leads, and its lead count """
+        plug = list(self.known)
+        leads = len(self.settings['plugboard_pairs'].split())
+        letters = list(self.free_letters)
+        self.random.shuffle(letters)
+        for i in range(self.random.randint(0, min(self.max_leads - leads, len(letters) // 2))):
+            first, second = letters[2 * i], letters[2 * i + 1]
+            plug[first], plug[second] = second, first
+            leads += 1
+        return plug, leads
+
+    def climb(self, plug:list, leads:int, scorer:object) -> tuple:
+        """
+        Improves the plugboard plug in place until no single change of lead improves the score
+
+        :param plug: Plugboard table of 26 letter indices
+        :param leads: Number of leads in plug
+        :param scorer: The Scorer to climb on
+        :return: (score, leads)
+        """
+        decode = self.decode
+        score_indices = scorer.score_indices
+        best = score_indices(decode(plug))
+        moves = self.moves
+        improved = True
+        while improved:
+            improved = False
+            self.random.shuffle(moves)
+            for first, second in moves:
+                first_plug, second_plug = plug[first], plug[second]
+                new_leads = leads
+                if first_plug == second:
+                    # Remove the lead between them
+                    plug[first], plug[second] = first, second
+                    new_leads -= 1
+                elif first_plug == first and second_plug == second:
+                    # Connect two unplugged letters, if there is a lead to spare
+                    if leads >= self.max_leads:
+                        continue
+                    plug[first], plug[second] = second, first
+                    new_leads += 1
+                elif second_plug == second:
+                    # Move the lead from first's partner to second
+                    plug[first_plug] = first_plug
+                    plug[first], plug[second] = second, first
+                elif first_plug == first:
+                    # Move the lead from second's partner to first
+                    plug[second_plug] = second_plug
+                    plug[first], plug[second] = second, first
+                else:
+                    # Swap partners, connecting first to second and their old partners to each other
+                    plug[first], plug[second] = second, first
+                    plug[first_plug], plug[second_plug] = second_plug, first_plug
+
+                score = score_indices(decode(plug))
+                if score > best:
+                    best = score
+                    leads = new_leads
+                    improved = True
+                    continue
+                # Undo the change
+                plug[first_plug], plug[second_plug] = first, second
+                plug[first], plug[second] = first_plug, second_plug
+        return best, leads
+
+    def search(self, restarts:int = 100, seconds:float = None) -> tuple:
+        """
+        Runs restarts hill climbs (or as many as fit in seconds, if given) and returns the best plugboard found
+
+        :param restarts: The most climbs to run
+        :param seconds: Time budget for the search, if any
+        :return: (score, settings, decoded message) for the best plugboard, with the plugboard in
+        settings['plugboard_pairs']
+        """
+        start = time.perf_counter()
+        best = None
+        for restart in range(max(restarts, 1)):
+            # At least one climb is always run
+            if restart and seconds is not None and time.perf_counter() - start > seconds:
+                break
+            plug, leads = self.random_plugboard()
+            _, leads = self.climb(plug, leads, self.ioc_scorer)
+            score, _ = self.climb(plug, leads, self.scorer)
+            self.restarts += 1
+            if best is None or score > best[0]:
+                best = (score, list(plug))
+
+        score, plug = best
+        pairs = ' '.join(ALPHABET[first] + ALPHABET[plug[first]] for first in range(26) if plug[first] > first)
+        # Build the final plugboard, which checks the leads against the Plugboard rules
+        Plugboard(pairs=pairs)
+        decoded = ''.join(ALPHABET[letter] for letter in self.decode(plug))
+        return score, dict(self.settings, plugboard_pairs=pairs), decoded
+
+
+def climb_plugboards(code:str, scorer:str, restarts:int, seconds:float, seed, configs:list) -> list:
+    """
+    Runs a PlugboardClimber search for each candidate settings dictionary. Kept at module level so that it can be sent
+    to worker processes.
+
+    :return: List of (score, settings, decoded message), one per candidate
+    """
+    results = []
+    for settings in configs:
+        # Each candidate gets its own seed, so results do not depend on how candidates are shared between workers
+        candidate_seed = None
+        if seed is not None:
+            candidate_seed = ' '.join([str(seed)] + [settings[key] for key in ('rotors', 'reflector', 'ring_settings',
+                                                                                'initial_positions')])
+        climber = PlugboardClimber(settings, code, scorer, seed=candidate_seed)
+        results.append(climber.search(restarts, seconds))
+    return results
@@ -0,0 +1,169 @@
+from engine import CompiledEnigma, NON_ALPHA_MODES
+from parallel import chunked, run_parallel
+from collections import OrderedDict
+import csv
+import functools
+import io
+import json
+import os
+import time
+
+# Settings columns of a key sheet; reflector_contacts is optional (see CodeBreaker.codebreak5_rewiring)
+SETTINGS_FIELDS = ('rotors', 'reflector', 'ring_settings', 'initial_positions', 'plugboard_pairs', 'reflector_contacts')
+# Columns of the output, in order
+OUTPUT_FIELDS = ('line', 'id', 'text', 'positions', 'error')
+# Messages handed to a worker at a time, and put in buckets by settings together (see encode_records)
+KEY_SHEET_CHUNK_SIZE = 4096
+# Compiled machines kept by each process, by settings (see sheet_machine)
+MACHINE_CACHE_SIZE = 256
+MACHINES = OrderedDict()
+
+
+def sheet_format(path:str) -> str:
+    """ Returns 'csv' for a .csv file and 'jsonl' for anything else """
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def read_key_sheet(path:str):
+    """
+    Reads a key sheet one message at a time: a JSONL file with one object per line, or a CSV file with a header row,
+    each record holding the settings (see SETTINGS_FIELDS) and the message, and optionally an id which is copied to
+    the output. Blank lines are skipped.
+
+    :param path: The key sheet file (.csv for CSV, JSONL otherwise)
+    :return: Generator of (line number, record)
+    """
+    with open(path, newline='') as f:
+        if sheet_format(path) == 'csv':
+            # Line 1 is the header
+            for line, record in enumerate(csv.DictReader(f), 2):
+                yield line, record
+        else:
+            for line, text in enumerate(f, 1):
+                if text.strip():
+                    try:
+                        yield line, json.loads(text)
+                    except ValueError:
+                        # Passed on as it is, to be written out as an error for its line
+                        yield line, text
+
+
+def settings_key(record:dict) -> tuple:
+    """ Returns the settings a compiled machine is built from; records with the same key share a machine """
+    return tuple(str(record.get(field) or '') for field in SETTINGS_FIELDS if field != 'initial_positions')
+
+
+def sheet_machine(key:tuple, record:dict) -> CompiledEnigma:
+    """
+    Returns the compiled machine for the settings key, compiling it from the record's settings if it is not one of
+    the machines this process has kept from earlier chunks
+    """
+    machine = MACHINES.get(key)
+    if machine is None:
+        settings = {field: record.get(field) or '' for field in SETTINGS_FIELDS}
+        machine = MACHINES[key] = CompiledEnigma(settings)
+        if len(MACHINES) > MACHINE_CACHE_SIZE:
+            MACHINES.popitem(last=False)
+    else:
+        MACHINES.move_to_end(key)
+    return machine
+
+
+def encode_records(records:list, non_alpha:str = 'error') -> list:
+    """
+    Encodes a chunk of key sheet records. The records are put in buckets by settings, and each bucket is encoded with
+    one machine, turned to each record's initial positions, however the settings are interleaved in the key sheet. A
+    record which cannot be encoded (i.e. invalid settings, or characters other than letters with non_alpha 'error')
+    gets an error rather than stopping the run. Kept at module level so that it can be sent to worker processes.
+
+    :param records: List of (line number, record)
+    :param non_alpha: 'error', 'pass' or 'strip' - what to do with characters other than letters
+    :return: An output row (see OUTPUT_FIELDS) for each record, in the order of the records
+    """
+    rows = [{'line': line, 'id': record.get('id') if isinstance(record, dict) else None, 'text': None,
+             'positions': None, 'error': None} for line, record in records]
+    buckets = OrderedDict()
+    for i, (_, record) in enumerate(records):
+        if not isinstance(record, dict):
+            rows[i]['error'] = "Record is not a JSON object"
+            continue
+        try:
+            buckets.setdefault(settings_key(record), []).append(i)
+        except Exception as error:
+            rows[i]['error'] = f"{type(error).__name__}: {error}"
+    for key, bucket in buckets.items():
+        try:
+            machine = sheet_machine(key, records[bucket[0]][1])
+        except Exception as error:
+            for i in bucket:
+                rows[i]['error'] = f"{type(error).__name__}: {error}"
+            continue
+        for i in bucket:
+            record = records[i][1]
+            try:
+                machine.set_positions(record['initial_positions'])
+                rows[i]['text'] = ''.join(machine.encode_stream([record['message']], non_alpha))
+                rows[i]['positions'] = machine.position_letters
+            except Exception as error:
+                rows[i]['error'] = f"{type(error).__name__}: {error}"
+    return rows
+
+
+def format_row(row:dict, output_format:str) -> str:
+    """ Formats an output row as a JSON line or a CSV row """
+    if output_format == 'csv':
+        line = io.StringIO()
+        csv.writer(line, lineterminator='\n').writerow(['' if row[field] is None else row[field]
+                                                        for field in OUTPUT_FIELDS])
+        return line.getvalue()
+    return json.dumps(row) + '\n'
+
+
+def encode_key_sheet(path:str, output_path:str, workers:int = 1, non_alpha:str = 'error',
+                     chunk_size:int = KEY_SHEET_CHUNK_SIZE) -> dict:
+    """
+    Encodes every message of a key sheet under its own settings, and writes the results to the output file in the
+    same order as the key sheet. The key sheet is read, and the results written, a chunk at a time, so it can be any
+    size. With more than one worker the chunks are shared across a process pool.
+
+    :param path: The key sheet (see read_key_sheet)
+    :param output_path: The file to write the results to (.csv for CSV, JSONL otherwise), one row per message (see
+    OUTPUT_FIELDS)
+    :param workers: Number of processes to share the messages between
+    :param non_alpha: 'error', 'pass' or 'strip' - what to do with characters other than letters
+    :param chunk_size: Messages handed to a worker at a time
+    :return: The messages encoded, the messages with errors, the characters encoded, the seconds taken and the
+    messages per second
+    """
+    if non_alpha not in NON_ALPHA_MODES:
+        raise ValueError(f"Unknown non_alpha mode: {non_alpha}, choose from {', '.join(NON_ALPHA_MODES)}")
+    start = time.perf_counter()
+    chunks = chunked(read_key_sheet(path), chunk_size)
+    encode = functools.partial(encode_records, non_alpha=non_alpha)
+    if workers > 1:
+        results = run_parallel(encode, chunks, workers)
+    else:
+        results = (encode(records) for records in chunks)
+
+    output_format = sheet_format(output_path)
+    stats = {'messages': 0, 'errors': 0, 'characters': 0}
+    # Written beside the output first, so an interrupted run never leaves a partial output in its place
+    try:
+        with open(output_path + '.tmp', 'w', newline='') as f:
+            if output_format == 'csv':
+                f.write(format_row({field: field for field in OUTPUT_FIELDS}, 'csv'))
+            for rows in results:
+                f.write(''.join(format_row(row, output_format) for row in rows))
+                for row in rows:
+                    stats['messages'] += 1
+                    if row['error'] is not None:
+                        stats['errors'] += 1
+                    else:
+                        stats['characters'] += len(row['text'])
+        os.replace(output_path + '.tmp', output_path)
+    finally:
+        if os.path.exists(output_path + '.tmp'):
+            os.remove(output_path + '.tmp')
+    stats['seconds'] = time.perf_counter() - start
+    stats['messages_per_second'] = stats['messages'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
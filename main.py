@@ -1,6 +1,9 @@
 from enigma import Enigma
-import demonstrations, codebreaker_tasks
+from engine import EncodeResult, NON_ALPHA_MODES, STREAM_CHUNK_SIZE, load_scrambler_store
+from telemetry import Telemetry
+import demonstrations, codebreaker_tasks, keysheet, service
 import argparse
+import sys
 
 
 def get_args():
@@ -15,6 +18,16 @@ def get_args():
                         help='Run machine demonstration tasks')
     parser.add_argument('--codebreaker', default=None, action='store_true',
                         help='Run all codebreaker tasks')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes to share each codebreaker search between')
+    parser.add_argument('--backend', type=str, default='compiled', choices=['compiled', 'batch'],
+                        help='Codebreaker search backend: compiled (one machine per candidate) or batch (NumPy)')
+    parser.add_argument('--results_format', type=str, default='text', choices=['text', 'jsonl', 'csv'],
+                        help='Codebreaker results file: text (codebreak.txt), jsonl or csv')
+    parser.add_argument('--resume', default=None, action='store_true',
+                        help='Resume the codebreaker tasks from codebreak_checkpoint.json')
+    parser.add_argument('--checkpoint_interval', type=float, default=30.0,
+                        help='Seconds between codebreaker checkpoints')
     parser.add_argument('--rotors', type=str, default='',
                         help='Choose 3 or 4 rotors i.e. "III II I" (space-delimited)')
     parser.add_argument('--reflector', type=str, default='', choices=['A', 'B', 'C'],
@@ -27,6 +40,33 @@ def get_args():
                         help='Choose up to 10 pairs of letters A-Z i.e. "AF BT LO PZ"')
     parser.add_argument('--code', type=str, default='',
                         help='Code to be run through Enigma')
+    parser.add_argument('--input', type=str, default='',
+                        help='File to be run through Enigma instead of --code, read in chunks so it can be any size')
+    parser.add_argument('--output', type=str, default='',
+                        help='File to write the --input file encoded to (defaults to the screen)')
+    parser.add_argument('--non_alpha', type=str, default='error', choices=NON_ALPHA_MODES,
+                        help='Characters other than letters: error, pass (copy them unchanged) or strip (leave them out)')
+    parser.add_argument('--chunk_size', type=int, default=STREAM_CHUNK_SIZE,
+                        help='Characters of the --input file encoded at a time')
+    parser.add_argument('--mmap', default=None, action='store_true',
+                        help='Encode the --input file as bytes through memory maps, for large files of ASCII text')
+    parser.add_argument('--key_sheet', type=str, default='',
+                        help='JSONL or CSV key sheet of settings and messages to encode in bulk, written to --output')
+    parser.add_argument('--serve', default=None, action='store_true',
+                        help='Run the encode/decode and search service over HTTP (see service.py)')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='Host the --serve service listens on')
+    parser.add_argument('--port', type=int, default=8765,
+                        help='Port the --serve service listens on')
+    parser.add_argument('--socket', type=str, default='',
+                        help='Unix socket path the --serve service listens on, instead of --host and --port')
+    parser.add_argument('--scrambler_store', type=str, default='',
+                        help='Read scramblers from this store of precomputed tables (see scrambler_store.py)')
+    parser.add_argument('--profile', type=str, nargs='?', const='profile.json', default=None,
+                        help='Time each stage of the run and write a report to this file (default profile.json, '
+                             'or Prometheus text format for a .prom file)')
+    parser.add_argument('--profile_interval', type=float, default=10.0,
+                        help='Seconds between --profile snapshots during the run (0 for only at the end)')
 
     args = parser.parse_args()
 
@@ -38,33 +78,55 @@ def get_args():
                 or args.plugboard_pairs)) \
         , 'Cannot call --rotor_demo or --machine_demo with other args'
 
-    if not ((args.rotor_demo or args.machine_demo) or args.codebreaker):
+    if not ((args.rotor_demo or args.machine_demo) or args.codebreaker or args.serve or args.key_sheet):
         assert len(args.rotors.split()) == len(args.ring_settings.split()) == len(args.initial_positions.split()), \
             'Ensure rotors, ring settings and initial positions all have the same counts.'
         assert len(args.rotors.split(' ')) <= 4, 'Too many rotors added, choose 3 or 4'
         assert len(args.rotors.split(' ')) >= 3, 'Too few rotors added, choose 3 or 4'
-        assert args.code, 'Manual mode: please use --code (str).'
+        assert args.code or args.input, 'Manual mode: please use --code (str) or --input (file).'
+        assert not (args.code and args.input), 'Manual mode: use either --code or --input, not both.'
+
+    assert args.workers >= 1, '--workers must be at least 1'
 
     if args.plugboard_pairs:
         assert len(args.plugboard_pairs) <= 30, 'Too many plugboard pairs used, maximum is 10.'
 
-    if args.code:
-        assert not (' ' in args.code), '--code contains a space. Enigma is not compatible with spaces, please correct.'
+    if args.code and args.non_alpha == 'error':
+        assert not (' ' in args.code), \
+            '--code contains a space. Enigma is not compatible with spaces, please correct or use --non_alpha.'
+
+    assert not args.output or args.input or args.key_sheet, '--output needs an --input file or a --key_sheet'
+    assert not args.key_sheet or args.output, '--key_sheet needs an --output file'
+    assert not args.mmap or args.output, '--mmap needs --input and --output files'
+    assert args.chunk_size >= 1, '--chunk_size must be at least 1'
+    assert args.profile_interval >= 0, '--profile_interval cannot be negative'
 
     return args
 
 
-if __name__ == "__main__":
+def run(args):
+    """
+    Runs the demonstrations, service, codebreaker or manual encoding chosen by the arguments
 
-    args = get_args()
+    :param args: parsed arguments (see get_args)
+    """
     if args.rotor_demo:
         demonstrations.rotor_demonstrations()
 
     elif args.machine_demo:
         demonstrations.machine_demonstrations()
 
+    elif args.serve:
+        service.serve(args.host, args.port, args.socket or None, workers=args.workers)
+
+    elif args.key_sheet:
+        stats = keysheet.encode_key_sheet(args.key_sheet, args.output, workers=args.workers, non_alpha=args.non_alpha)
+        print(f"Encoded {stats['messages']} messages ({stats['characters']} characters, {stats['errors']} errors) "
+              f"to {args.output} in {stats['seconds']:.2f}s ({stats['messages_per_second']:.0f} messages/s)")
+
     elif args.codebreaker:
-        codebreaker_tasks.tasks()
+        codebreaker_tasks.tasks(workers=args.workers, backend=args.backend, results_format=args.results_format,
+                                resume=bool(args.resume), checkpoint_interval=args.checkpoint_interval)
 
     else:
         settings = {'rotors': args.rotors,
@@ -74,4 +136,41 @@ if __name__ == "__main__":
                     'plugboard_pairs': args.plugboard_pairs}
         e = Enigma(settings)
         e.create_machinery()
-        e.encode(args.code)
\ No newline at end of file
+        if args.mmap:
+            e.encode_mapped_file(args.input, args.output, args.non_alpha)
+            print(f"Encoded {args.input} to {args.output}")
+            print(f"Final Rotor Positions:{e.position_letters}")
+        elif args.input:
+            # Stream the file through the machine, so that it is never held in memory all at once
+            with open(args.input, newline='') as source:
+                destination = open(args.output, 'w', newline='') if args.output else sys.stdout
+                try:
+                    for chunk in e.encode_stream(source, args.non_alpha, args.chunk_size):
+                        destination.write(chunk)
+                finally:
+                    if args.output:
+                        destination.close()
+            if args.output:
+                print(f"Encoded {args.input} to {args.output}")
+                print(f"Final Rotor Positions:{e.position_letters}")
+        else:
+            if args.non_alpha == 'error':
+                result = e.encode_result(args.code)
+            else:
+                result = EncodeResult(''.join(e.encode_stream([args.code], args.non_alpha)), e.rotor_positions)
+            demonstrations.print_encoding(args.code, result)
+
+
+if __name__ == "__main__":
+
+    args = get_args()
+    if args.scrambler_store:
+        load_scrambler_store(args.scrambler_store)
+    if args.profile:
+        # Time each stage of the run, and write the report once it is over (see telemetry.py)
+        with Telemetry(args.profile, args.profile_interval) as telemetry:
+            run(args)
+        print(telemetry.report())
+        print(f"Profile saved to {args.profile}")
+    else:
+        run(args)
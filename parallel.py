@@ -0,0 +1,37 @@
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import itertools
+
+
+def chunked(iterable, size:int):
+    """ Splits an iterable into lists of up to size items, without reading further ahead than the current chunk """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def run_parallel(function, chunks, workers:int, keep_input:bool = False):
+    """
+    Calls function on each chunk in a pool of worker processes and yields the results in the same order as the chunks.
+    Only a few chunks per worker are submitted ahead of the results being consumed, so chunks can be generated lazily
+    from a very large search space without holding it all in memory.
+
+    :param function: A picklable function (module level, or functools.partial of one) taking a single chunk
+    :param chunks: Iterable of chunks of work
+    :param workers: Number of worker processes
+    :param keep_input: If True, yield (chunk, result) pairs rather than just the results
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, pool.submit(function, chunk)))
+            # Two chunks in flight per worker keeps every worker busy while the results are collected
+            if len(pending) >= workers * 2:
+                chunk, future = pending.popleft()
+                yield (chunk, future.result()) if keep_input else future.result()
+        while pending:
+            chunk, future = pending.popleft()
+            yield (chunk, future.result()) if keep_input else future.result()
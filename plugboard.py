@@ -1,3 +1,6 @@
+from catalogue import ALPHABET
+
+
 class Plugboard:
     """
     The main class for the plugboard system. Is automatically constructed if 'plugboard_pairs' contains any entries.
@@ -5,10 +8,16 @@ class Plugboard:
     other.
     Finally, creates an object which is bolted onto the front of the enigma system, which will map the 'typed' character
     to it's respective plugboard character, before passing the signal through to the housing and then rotors.
+    The leads are compiled as they are added into a mapping of plugged characters, so encoding is a single lookup
+    however many leads are fitted, and into table, a 26-entry list mapping each letter index A-Z to its plugged index.
     """
     def __init__(self, settings:dict = None, pairs:str = None):
         self.unusedplugleads = 10
         self.plugleads = []
+        self.mapping = {}
+        self.table = list(range(26))
+        # Bit mask of the characters already plugged, one bit per character code
+        self.used = 0
         self.pairs = pairs
         if settings:
             self.pairs = settings['plugboard_pairs']
@@ -32,34 +41,28 @@ class Plugboard:
         4. Reduces unusedplugleads by 1
         """
         if self.unusedplugleads > 0:
-            if any(letter in pluglead.mapping for usedlead in self.plugleads for letter in usedlead.mapping):
+            first, second = pluglead.mapping
+            lead_mask = (1 << ord(first)) | (1 << ord(second))
+            if self.used & lead_mask:
                 raise ValueError("Letter already used in another lead")
 
             self.plugleads.append(pluglead)
             self.unusedplugleads-=1
+            self.used |= lead_mask
+            self.mapping[first] = second
+            self.mapping[second] = first
+            if first in ALPHABET and second in ALPHABET:
+                self.table[ALPHABET.index(first)] = ALPHABET.index(second)
+                self.table[ALPHABET.index(second)] = ALPHABET.index(first)
         else:
             raise ValueError("Lead creation exceeds max number of leads")
 
     def encode(self, character:str) -> str:
         """
-        For the input character, loop through all instances of plugleads and find which one contains that character
-        Return encoded character
+        Look up the input character in the mapping of plugged characters.
+        Return encoded character (the original character if it is not plugged)
         """
-
-        # If no plugleads used, return original character
-        if len(self.plugleads) == 0:
-            return character
-        else:
-            encoded_char = character
-            for lead in self.plugleads:
-                # If the character exists in the mapping
-                if character in lead.mapping:
-                    # Encode the character
-                    encoded_char = lead.encode(character)
-                # Otherwise check the next pluglead
-                else:
-                    next
-            return encoded_char
+        return self.mapping.get(character, character)
 
 class PlugLead:
     def __init__(self, mapping:str):
@@ -0,0 +1,193 @@
+import csv
+import io
+import json
+import os
+import threading
+
+
+class SearchResult:
+    """
+    One codebreaker hit: the settings which decoded the code to a message containing a crib, and where the crib was
+    found
+    """
+    def __init__(self, name:str, attempt:int, settings:dict, code:str, crib, matched_crib:str, decoded:str,
+                 score:float = None):
+        """
+        :param name: The codebreak task which found the hit
+        :param attempt: The number of the hit within the task (counting from 1)
+        :param settings: The candidate settings dictionary
+        :param code: The encoded message
+        :param crib: The crib (or list of cribs) searched for
+        :param matched_crib: The crib found in the decoded message (None if a scored search found none)
+        :param decoded: The decoded message
+        :param score: How plaintext-like the decoded message is, if the search scored it
+        """
+        self.name = name
+        self.attempt = attempt
+        self.settings = settings
+        self.code = code
+        self.crib = crib
+        self.matched_crib = matched_crib
+        self.decoded = decoded
+        self.crib_offset = None if matched_crib is None else decoded.find(matched_crib)
+        self.score = score
+
+    def as_dict(self) -> dict:
+        """ Returns the result as a dictionary of plain values, with only the settings which define a machine """
+        settings = {key: self.settings[key] for key in ('rotors', 'reflector', 'ring_settings', 'initial_positions',
+                                                        'plugboard_pairs')}
+        if self.settings.get('reflector_contacts'):
+            settings['reflector_contacts'] = self.settings['reflector_contacts']
+        return {'task': self.name,
+                'attempt': self.attempt,
+                'settings': settings,
+                'code': self.code,
+                'crib': self.matched_crib,
+                'crib_offset': self.crib_offset,
+                'score': self.score,
+                'decoded': self.decoded}
+
+
+class ResultSink:
+    """
+    Buffered writer for codebreaker results. Results are formatted as they arrive and held in memory, then appended to
+    the file buffer_size results at a time (and on flush/close), rather than opening the file for every hit.
+    Each flush is a single append of whole records, so several processes can share one output file without their
+    records interleaving, and a lock lets threads share one sink.
+    Subclasses choose the format by overriding format (and header, for a line written before the first record).
+    """
+    def __init__(self, path:str, buffer_size:int = 256):
+        """
+        :param path: The file to append results to
+        :param buffer_size: Number of results held before they are written out
+        """
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.lock = threading.Lock()
+
+    def write(self, result:SearchResult):
+        """ Adds a result to the buffer, writing the buffer out once it holds buffer_size results """
+        with self.lock:
+            self.buffer.append(self.format(result))
+            if len(self.buffer) >= self.buffer_size:
+                self._flush()
+
+    def flush(self):
+        """ Writes out any buffered results """
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        records = ''.join(self.buffer)
+        self.buffer = []
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            # The header is only written to a new (or empty) file
+            if os.fstat(fd).st_size == 0:
+                records = self.header() + records
+            os.write(fd, records.encode('utf-8'))
+        finally:
+            os.close(fd)
+
+    def size(self) -> int:
+        """ Returns the size the file will be once the buffered results are written out """
+        with self.lock:
+            size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            records = ''.join(self.buffer)
+            if records and size == 0:
+                records = self.header() + records
+            return size + len(records.encode('utf-8'))
+
+    def close(self):
+        """ Writes out any buffered results; the sink can still be written to afterwards """
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def header(self) -> str:
+        """ Text written at the start of a new file """
+        return ''
+
+    def format(self, result:SearchResult) -> str:
+        """ Formats one result as it is to be written to the file """
+        raise NotImplementedError
+
+
+class TextSink(ResultSink):
+    """ Human readable report, as written to codebreak.txt """
+    def format(self, result:SearchResult) -> str:
+        lines = []
+        if result.attempt == 1:
+            lines.append(f"#################################\n")
+            lines.append(f"Codebreak task: {result.name}\n")
+            lines.append(f"#################################\n\n")
+
+        lines.append(f"Attempt : {result.attempt}\n")
+        lines.append(f"SETTINGS: \n")
+        lines.append(f"Rotors : {str(result.settings['rotors'])}\n")
+        lines.append(f"Initial Positions : {str(result.settings['initial_positions'])}\n")
+        lines.append(f"Ring Settings : {str(result.settings['ring_settings'])}\n")
+        lines.append(f"Reflector : {str(result.settings['reflector'])}\n")
+        lines.append(f"Plugboard Pairs : {str(result.settings['plugboard_pairs'])}\n\n")
+        lines.append(f"Input code : {result.code}\n")
+        lines.append(f"Crib: {result.crib}\n")
+        lines.append(f"Output code : {result.decoded}\n")
+        if result.score is not None:
+            lines.append(f"Score : {result.score:.2f}\n")
+        lines.append(f"\n\n\n")
+        return ''.join(lines)
+
+
+class JsonLinesSink(ResultSink):
+    """ One JSON object per line (see SearchResult.as_dict) """
+    def format(self, result:SearchResult) -> str:
+        return json.dumps(result.as_dict()) + '\n'
+
+
+class CsvSink(ResultSink):
+    """ Compact CSV with one row per result and the settings flattened into columns """
+    COLUMNS = ['task', 'attempt', 'rotors', 'reflector', 'reflector_contacts', 'ring_settings', 'initial_positions',
+               'plugboard_pairs', 'crib', 'crib_offset', 'score', 'decoded']
+
+    def header(self) -> str:
+        return self.row(self.COLUMNS)
+
+    def format(self, result:SearchResult) -> str:
+        record = result.as_dict()
+        settings = record.pop('settings')
+        record.update(settings)
+        return self.row(['' if record.get(column) is None else record[column] for column in self.COLUMNS])
+
+    @staticmethod
+    def row(values:list) -> str:
+        """ Formats one CSV row, quoting values where needed """
+        line = io.StringIO()
+        csv.writer(line, lineterminator='\n').writerow(values)
+        return line.getvalue()
+
+
+# Result formats by name, with the default file each is written to
+SINKS = {'text': (TextSink, 'codebreak.txt'),
+         'jsonl': (JsonLinesSink, 'codebreak.jsonl'),
+         'csv': (CsvSink, 'codebreak.csv')}
+
+
+def open_sink(results_format:str = 'text', path:str = None, buffer_size:int = 256) -> ResultSink:
+    """
+    Creates a results sink by format name
+
+    :param results_format: 'text', 'jsonl' or 'csv'
+    :param path: The file to write to (defaults to codebreak.txt, codebreak.jsonl or codebreak.csv)
+    :param buffer_size: Number of results held before they are written out
+    """
+    if results_format not in SINKS:
+        raise ValueError(f"Unknown results format: {results_format}, choose from {', '.join(SINKS)}")
+    sink, default_path = SINKS[results_format]
+    return sink(path or default_path, buffer_size)
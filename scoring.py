@@ -0,0 +1,153 @@
+from catalogue import ALPHABET
+import collections
+import functools
+import math
+import os
+import re
+
+# Bigram, trigram and quadgram counts of English text, one 'NGRAM COUNT' pair per line (see build_ngram_table)
+NGRAM_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'english_ngrams.txt')
+# Scoring methods by name, with the n-gram length each one uses (None for the index of coincidence)
+METHODS = {'ioc': None, 'bigram': 2, 'trigram': 3, 'quadgram': 4}
+
+
+def index_of_coincidence(text) -> float:
+    """
+    Returns the chance that two letters picked at random from the text are the same. English text scores about 0.066,
+    while random letters (such as a wrong decryption) score about 0.038.
+
+    :param text: The letters, as a string or as a list of letter indices (0-25)
+    """
+    length = len(text)
+    if length < 2:
+        return 0.0
+    counts = collections.Counter(text)
+    return sum(count * (count - 1) for count in counts.values()) / (length * (length - 1))
+
+
+def build_ngram_table(text:str, path:str = NGRAM_TABLE, min_count:int = 2):
+    """
+    Counts the bigrams, trigrams and quadgrams of the letters in an English text and writes them to the n-gram table.
+    The bundled table was built from the Project Gutenberg text of Newton's Opticks (public domain).
+
+    :param text: English text; anything other than the letters A-Z (in either case) is ignored
+    :param path: The file to write the table to
+    :param min_count: N-grams seen fewer times than this are left out, and score as unseen
+    """
+    letters = re.sub('[^A-Z]', '', text.upper())
+    with open(path, 'w') as f:
+        for n in (2, 3, 4):
+            counts = collections.Counter(letters[i:i + n] for i in range(len(letters) - n + 1))
+            for ngram, count in sorted(counts.items()):
+                if count >= min_count:
+                    f.write(f"{ngram} {count}\n")
+
+
+@functools.lru_cache(maxsize=None)
+def ngram_log_probabilities(n:int, path:str = NGRAM_TABLE) -> tuple:
+    """
+    Loads the log10 probability of every n-gram from the n-gram table into a dense table, indexed by the n-gram read as
+    a base 26 number (AA..A = 0). N-grams missing from the table get a floor of a hundredth of a single sighting.
+    Cached, so the table is read once per process.
+
+    :param n: The n-gram length (2, 3 or 4)
+    :return: Tuple of 26**n log probabilities
+    """
+    counts = {}
+    with open(path) as f:
+        for line in f:
+            ngram, count = line.split()
+            if len(ngram) == n:
+                counts[ngram] = int(count)
+    total = sum(counts.values())
+    floor = math.log10(0.01 / total)
+    table = [floor] * 26 ** n
+    for ngram, count in counts.items():
+        index = 0
+        for letter in ngram:
+            index = index * 26 + ALPHABET.index(letter)
+        table[index] = math.log10(count / total)
+    return tuple(table)
+
+
+class Scorer:
+    """
+    Rates how much a decryption looks like English, so that candidates can be ranked without a crib. Higher scores are
+    better for every method:
+    1. 'ioc' - index of coincidence of the letters
+    2. 'bigram', 'trigram', 'quadgram' - log-likelihood of the text under the English n-gram frequencies
+    Texts can be scored one at a time (score), or as rows of letter indices all at once with NumPy (score_batch).
+    """
+    def __init__(self, method:str = 'quadgram'):
+        """
+        :param method: 'ioc', 'bigram', 'trigram' or 'quadgram'
+        """
+        if method not in METHODS:
+            raise ValueError(f"Unknown scoring method: {method}, choose from {', '.join(METHODS)}")
+        self.method = method
+        self.n = METHODS[method]
+        self.table = ngram_log_probabilities(self.n) if self.n else None
+        self.array = None
+
+    def score(self, text:str) -> float:
+        """
+        Scores a text of upper case letters A-Z
+
+        :param text: The decoded message
+        :return: The score (higher is more like English)
+        """
+        return self.score_indices([ord(char) - 65 for char in text])
+
+    def score_indices(self, letters:list) -> float:
+        """
+        Scores a text given as a list of letter indices (0-25), as used by the plugboard hill climb
+
+        :param letters: The decoded message as letter indices
+        :return: The score (higher is more like English)
+        """
+        if self.n is None:
+            return index_of_coincidence(letters)
+        table = self.table
+        size = 26 ** self.n
+        score = 0.0
+        index = 0
+        # Roll the n-gram index along the text, one letter in and one letter out
+        for i, letter in enumerate(letters):
+            index = (index * 26 + letter) % size
+            if i >= self.n - 1:
+                score += table[index]
+        return score
+
+    def score_batch(self, encoded) -> 'numpy.ndarray':
+        """
+        Scores every row of an array of letter indices (0-25), as returned by BatchEnigma.encode
+
+        :param encoded: Array of shape (batch size, message length)
+        :return: Array of one score per row
+        """
+        import numpy as np
+
+        letters = encoded.astype(np.int64)
+        rows, length = letters.shape
+        if self.n is None:
+            if length < 2:
+                return np.zeros(rows)
+            # Letter counts for every row at once, by giving each row its own block of 26 bins
+            counts = np.bincount((letters + 26 * np.arange(rows)[:, None]).ravel(), minlength=26 * rows)
+            counts = counts.reshape(rows, 26)
+            return (counts * (counts - 1)).sum(axis=1) / (length * (length - 1))
+        if self.array is None:
+            self.array = np.array(self.table)
+        if length < self.n:
+            return np.zeros(rows)
+        windows = length - self.n + 1
+        index = np.zeros((rows, windows), dtype=np.int64)
+        for k in range(self.n):
+            index = index * 26 + letters[:, k:k + windows]
+        return self.array[index].sum(axis=1)
+
+
+@functools.lru_cache(maxsize=None)
+def get_scorer(method:str) -> Scorer:
+    """ Returns a shared Scorer for the method, so each process loads the n-gram table once """
+    return Scorer(method)
@@ -0,0 +1,178 @@
+from catalogue import REFLECTORS, ROTOR_CATALOGUE
+import argparse
+import itertools
+import json
+import mmap
+import os
+import struct
+
+# File layout: a header page holding the magic, version and where the JSON index is, then the tables from the second
+# page on, then the index
+STORE_MAGIC = b'ENIGSCRM'
+STORE_VERSION = 1
+HEADER = struct.Struct('<8sIQI')
+PAGE_SIZE = mmap.PAGESIZE
+# Every rotor position of three rotors, and the bytes of one table: 26 bytes (one permutation) per position
+STATES = 26 ** 3
+TABLE_SIZE = STATES * 26
+# Environment variable naming the store to load, so that worker processes started by spawn load it too
+STORE_ENVIRONMENT = 'ENIGMA_SCRAMBLER_STORE'
+
+
+def store_key(contacts:tuple, reflector:str) -> str:
+    """
+    Returns the index key of a table
+
+    :param contacts: The wirings of the three rotors which can turn, rightmost first
+    :param reflector: The reflector wiring, with any fourth rotor folded in (see CompiledEnigma.effective_reflector)
+    """
+    return ' '.join(contacts + (reflector,))
+
+
+def state_offset(positions:tuple) -> int:
+    """
+    Returns the offset into a table of the permutation at the (rightmost, middle, leftmost) core positions: each rotor's
+    position less its ring setting, as the tables are worked out with every ring setting at 1
+    """
+    return ((positions[2] * 26 + positions[1]) * 26 + positions[0]) * 26
+
+
+def build_table(contacts:tuple, reflector:str) -> bytes:
+    """
+    Works out the scrambler permutation (rotors and reflector) at every position of three rotors, with ring settings
+    of 1, as one bytes object of 26 bytes per position (see state_offset)
+
+    :param contacts: The wirings of the three rotors which can turn, rightmost first
+    :param reflector: The reflector wiring
+    """
+    # Imported here, as engine loads stores through this module
+    from engine import ScramblerCycles
+
+    cycles = ScramblerCycles(tuple((wiring, 1, None) for wiring in contacts), reflector)
+    return b''.join(cycles.scrambler((position_0, position_1, position_2))
+                    for position_2, position_1, position_0 in itertools.product(range(26), repeat=3))
+
+
+def machine_tables(rotors:list, reflectors:list) -> list:
+    """
+    Lists the tables for every order of three different rotors out of the named rotors, with each named reflector
+
+    :param rotors: Rotor names (see catalogue.ROTOR_CATALOGUE)
+    :param reflectors: Reflector names
+    :return: List of (rotor names as in settings['rotors'], reflector name, contacts rightmost first, reflector
+    contacts)
+    """
+    tables = []
+    for order in itertools.permutations(rotors, 3):
+        for reflector in reflectors:
+            contacts = tuple(ROTOR_CATALOGUE[name]['contacts'] for name in reversed(order))
+            tables.append((' '.join(order), reflector, contacts, ROTOR_CATALOGUE[reflector]['contacts']))
+    return tables
+
+
+def build_store(path:str, tables:list) -> int:
+    """
+    Writes a store of scrambler tables. The file is written beside the path first and then moved into place, so a
+    store being read by another process is never seen half written.
+
+    :param path: The store file
+    :param tables: List of (rotor names, reflector name, contacts rightmost first, reflector contacts) (see
+    machine_tables)
+    :return: The size of the store in bytes
+    """
+    index = {}
+    names = {}
+    with open(path + '.tmp', 'wb') as f:
+        f.seek(PAGE_SIZE)
+        for rotor_names, reflector_name, contacts, reflector in tables:
+            key = store_key(contacts, reflector)
+            if key in index:
+                continue
+            index[key] = f.tell()
+            names[key] = f"{rotor_names} {reflector_name}"
+            f.write(build_table(contacts, reflector))
+        index_offset = f.tell()
+        f.write(json.dumps({'tables': index, 'names': names}).encode())
+        size = f.tell()
+        f.seek(0)
+        f.write(HEADER.pack(STORE_MAGIC, STORE_VERSION, index_offset, size - index_offset))
+    os.replace(path + '.tmp', path)
+    return size
+
+
+class ScramblerStore:
+    """
+    A store of scrambler tables (see build_store), memory-mapped read only. Opening it only reads the index, and the
+    tables are paged in by the operating system as they are used, so every process using the same store file shares
+    one copy of its pages through the page cache rather than each working the tables out.
+    """
+    def __init__(self, path:str):
+        """
+        :param path: The store file
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < PAGE_SIZE:
+            raise ValueError(f"{path} is not a scrambler store")
+        magic, version, index_offset, index_size = HEADER.unpack_from(self.map)
+        if magic != STORE_MAGIC:
+            raise ValueError(f"{path} is not a scrambler store")
+        if version != STORE_VERSION:
+            raise ValueError(f"{path} is scrambler store version {version}, expected {STORE_VERSION}; rebuild it")
+        if index_offset + index_size > len(self.map):
+            raise ValueError(f"{path} is truncated; rebuild it")
+        index = json.loads(self.map[index_offset:index_offset + index_size])
+        self.tables = index['tables']
+        self.names = index['names']
+        if any(offset + TABLE_SIZE > len(self.map) for offset in self.tables.values()):
+            raise ValueError(f"{path} is truncated; rebuild it")
+        self.view = memoryview(self.map)
+
+    def table(self, contacts:tuple, reflector:str) -> memoryview:
+        """
+        Returns the table for the rotors and reflector (see state_offset), or None if the store does not hold it
+
+        :param contacts: The wirings of the three rotors which can turn, rightmost first
+        :param reflector: The reflector wiring, with any fourth rotor folded in
+        """
+        offset = self.tables.get(store_key(contacts, reflector))
+        if offset is None:
+            return None
+        return self.view[offset:offset + TABLE_SIZE]
+
+    def close(self):
+        """ Unmaps the store. Tables returned by table must no longer be in use. """
+        self.view.release()
+        self.map.close()
+
+
+def get_args():
+    """
+    Obtain arguments as specified by the user input and parse them
+    return args: parsed arguments
+    """
+    rotors = [name for name in ROTOR_CATALOGUE if name not in REFLECTORS and name != 'Housing']
+    parser = argparse.ArgumentParser(description='Build a store of precomputed scrambler tables')
+    parser.add_argument('--output', type=str, default='scramblers.bin',
+                        help='The store file to write')
+    parser.add_argument('--rotors', type=str, nargs='*', default=rotors,
+                        help=f'Rotors to store every order of three of (default {" ".join(rotors)})')
+    parser.add_argument('--reflectors', type=str, nargs='*', default=list(REFLECTORS),
+                        help='Reflectors to store each rotor order with')
+    args = parser.parse_args()
+    for name in args.rotors:
+        assert name in ROTOR_CATALOGUE and name not in REFLECTORS and name != 'Housing', f'Unknown rotor: {name}'
+    for name in args.reflectors:
+        assert name in REFLECTORS, f'Unknown reflector: {name}, choose from {" ".join(REFLECTORS)}'
+    assert len(args.rotors) >= 3, 'At least 3 rotors are needed'
+    return args
+
+
+if __name__ == "__main__":
+
+    args = get_args()
+    tables = machine_tables(args.rotors, args.reflectors)
+    print(f"Building {len(tables)} tables ({len(tables) * TABLE_SIZE / 1e6:.0f} MB)")
+    size = build_store(args.output, tables)
+    print(f"Scrambler store saved to {args.output} ({size} bytes)")
@@ -0,0 +1,168 @@
+from catalogue import ALPHABET, REFLECTORS, ROTOR_CATALOGUE, THIN_ROTORS
+from plugboard import Plugboard
+import itertools
+
+
+class SearchSpace:
+    """
+    Declarative description of a set of machine settings to search, compiled into a candidate generator. Each setting
+    is given as the values allowed in each rotor slot (leftmost rotor first), and the candidates are every
+    combination of them, less those which could not be set up on a real machine or which repeat another candidate:
+    1. Rotors - a rotor can only be fitted once (unless distinct_rotors is False). A 4 rotor machine (the M4) takes a
+    thin rotor (Beta or Gamma) in its leftmost slot and only there.
+    2. Plugboards - each must satisfy the Plugboard rules (at most 10 leads, no letter used twice), and the same leads
+    in a different order are only tried once
+    The exact number of candidates is known before any are generated, and any single candidate can be generated from
+    its index, so a search can be split evenly or resumed part way through.
+    """
+    def __init__(self, rotors:list, reflectors:list = REFLECTORS, ring_settings:list = None, positions:list = None,
+                 plugboards:list = None, distinct_rotors:bool = True, distinct_ring_settings:bool = False,
+                 thin_rotor_rule:bool = True, rotor_box:dict = ROTOR_CATALOGUE):
+        """
+        :param rotors: For each slot, leftmost first, the list of rotor names allowed in it
+        :param reflectors: The reflectors allowed
+        :param ring_settings: For each slot, the ring settings (1-26) allowed in it. Defaults to all of them.
+        :param positions: For each slot, the start positions allowed in it, as a string of letters. Defaults to A-Z.
+        :param plugboards: The plugboard_pairs strings allowed (which may be 'UNKNOWN', for the bombe). Defaults to
+        no leads.
+        :param distinct_rotors: Each rotor can only be fitted once
+        :param distinct_ring_settings: Only allow combinations of ring settings with no setting repeated
+        :param thin_rotor_rule: Only allow 4 rotor machines with a thin rotor in the leftmost slot, and only there
+        :param rotor_box: Rotor and reflector wirings (see Enigma.rotor_box)
+        """
+        slots = len(rotors)
+        if slots not in (3, 4):
+            raise ValueError("Choose 3 or 4 rotor slots")
+        for name in itertools.chain(*rotors, reflectors):
+            if name not in rotor_box:
+                raise ValueError(f"Unknown rotor or reflector: {name}")
+        ring_settings = ring_settings or [range(1, 27)] * slots
+        positions = positions or [ALPHABET] * slots
+        if len(ring_settings) != slots or len(positions) != slots:
+            raise ValueError("Ensure rotors, ring settings and initial positions all have the same counts.")
+        for ring_setting in itertools.chain(*ring_settings):
+            if not 1 <= int(ring_setting) <= 26:
+                raise ValueError(f"Ring settings must be from 1-26, got {ring_setting}")
+        for letter in itertools.chain(*positions):
+            if letter not in ALPHABET:
+                raise ValueError(f"Initial positions must be letters A-Z, got {letter}")
+
+        self.rotor_orders = [order for order in itertools.product(*rotors)
+                             if self.valid_rotor_order(order, distinct_rotors, thin_rotor_rule)]
+        self.reflectors = list(dict.fromkeys(reflectors))
+        # Ring settings and positions are held for each slot, and only combined as candidates are generated
+        # Ring settings are told apart by their value, so '04' and '4' are one setting, written as first given
+        self.ring_slots = [self.distinct_ring_settings(slot) for slot in ring_settings]
+        self.ring_combinations = None
+        if distinct_ring_settings:
+            self.ring_combinations = [combination for combination in itertools.product(*self.ring_slots)
+                                      if len(set(map(int, combination))) == len(combination)]
+        self.position_slots = [list(dict.fromkeys(slot)) for slot in positions]
+        self.plugboards = self.distinct_plugboards(plugboards or [''])
+
+        # The values of each part of a candidate, from the slowest changing to the fastest
+        self.parts = ([self.rotor_orders, self.reflectors] +
+                      ([self.ring_combinations] if distinct_ring_settings else self.ring_slots) +
+                      self.position_slots + [self.plugboards])
+        self.radices = [len(part) for part in self.parts]
+        self.size = 1
+        for radix in self.radices:
+            self.size *= radix
+
+    @staticmethod
+    def valid_rotor_order(order:tuple, distinct_rotors:bool = True, thin_rotor_rule:bool = True) -> bool:
+        """ True if the rotors (leftmost first) could be fitted to a machine together """
+        if distinct_rotors and len(set(order)) != len(order):
+            return False
+        if thin_rotor_rule and len(order) == 4:
+            return order[0] in THIN_ROTORS and not THIN_ROTORS.intersection(order[1:])
+        return True
+
+    @staticmethod
+    def distinct_ring_settings(ring_settings:list) -> list:
+        """ Returns the ring settings as strings, without repeated values (i.e. '04' and '4') """
+        distinct = {}
+        for ring_setting in ring_settings:
+            distinct.setdefault(int(ring_setting), str(ring_setting))
+        return list(distinct.values())
+
+    @staticmethod
+    def distinct_plugboards(plugboards:list) -> list:
+        """ Returns the plugboard_pairs strings which satisfy the Plugboard rules, without repeated sets of leads """
+        distinct = {}
+        for pairs in plugboards:
+            if pairs == 'UNKNOWN':
+                distinct.setdefault(pairs, pairs)
+                continue
+            try:
+                Plugboard(pairs=pairs)
+            except ValueError:
+                continue
+            leads = frozenset(frozenset(pair) for pair in pairs.split(' ') if pair)
+            distinct.setdefault(leads, pairs)
+        return list(distinct.values())
+
+    def __len__(self) -> int:
+        return self.size
+
+    def digits(self, index:int) -> list:
+        """ Returns the index into each part of the candidate at index (see candidate) """
+        if not 0 <= index < self.size:
+            raise IndexError(f"Candidate index out of range: {index}")
+        digits = []
+        for radix in reversed(self.radices):
+            index, digit = divmod(index, radix)
+            digits.append(digit)
+        digits.reverse()
+        return digits
+
+    def candidate(self, index:int, settings:dict) -> dict:
+        """
+        Returns the candidate at index (0 to size - 1). Candidates are ordered by rotors, reflector, ring settings,
+        positions and plugboard, with the plugboard changing fastest.
+
+        :param settings: Settings dictionary to copy the other settings (code, crib) from
+        """
+        return self.settings_for(self.digits(index), settings)
+
+    def settings_for(self, digits:list, settings:dict) -> dict:
+        """ Returns the candidate settings dictionary for an index into each part """
+        values = [part[digit] for part, digit in zip(self.parts, digits)]
+        if self.ring_combinations is not None:
+            ring_settings, positions = values[2], values[3:-1]
+        else:
+            slots = len(self.ring_slots)
+            ring_settings, positions = values[2:2 + slots], values[2 + slots:-1]
+        return dict(settings,
+                    rotors=' '.join(values[0]),
+                    reflector=values[1],
+                    ring_settings=' '.join(ring_settings),
+                    initial_positions=' '.join(positions),
+                    plugboard_pairs=values[-1])
+
+    def candidates(self, settings:dict, start:int = 0, stop:int = None):
+        """
+        Yields the candidates from index start up to (not including) stop
+
+        :param settings: Settings dictionary to copy the other settings (code, crib) from
+        """
+        stop = self.size if stop is None else min(stop, self.size)
+        if start >= stop:
+            return
+        digits = self.digits(start)
+        radices = self.radices
+        last = len(digits) - 1
+        for _ in range(stop - start):
+            yield self.settings_for(digits, settings)
+            # Step on to the next candidate like an odometer, rather than working out each index from scratch
+            i = last
+            digits[i] += 1
+            while digits[i] == radices[i] and i > 0:
+                digits[i] = 0
+                i -= 1
+                digits[i] += 1
+
+    def split(self, parts:int) -> list:
+        """ Splits the candidates into parts (start, stop) index ranges, as even in size as possible """
+        bounds = [self.size * part // parts for part in range(parts + 1)]
+        return list(zip(bounds, bounds[1:]))
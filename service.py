@@ -0,0 +1,351 @@
+from engine import CompiledEnigma, NON_ALPHA_MODES
+from codebreak import CodeBreaker
+from results import open_sink
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import json
+import os
+import tempfile
+
+# CodeBreaker searches which can be run as jobs, and the CodeBreaker options a job may set
+SEARCHES = ('codebreak1_reflector', 'codebreak2_positions', 'codebreak3_multi', 'codebreak4_plugleads',
+            'codebreak5_rewiring', 'codebreak_plugboard_climb', 'codebreak_bombe')
+SEARCH_OPTIONS = ('backend', 'batch_size', 'chunk_size', 'early_abort', 'crib_offsets', 'scorer', 'top_k')
+# Compiled machines kept for reuse by the encoder, by settings (see machine_key)
+MACHINE_CACHE_SIZE = 256
+# Largest request body accepted, in bytes
+MAX_BODY = 1 << 24
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+           500: 'Internal Server Error'}
+
+
+def machine_key(settings:dict) -> tuple:
+    """ Returns the settings which a compiled machine is built from; requests with the same key share a machine """
+    return (settings['rotors'], settings['ring_settings'], settings['reflector'], settings.get('reflector_contacts'),
+            settings.get('plugboard_pairs'))
+
+
+def request_error(error:Exception, reason:str) -> Exception:
+    """
+    Returns the error to fail a request with: errors from bad settings or messages (including the assertions made by
+    the plugboard) become a ValueError, which is replied to as a bad request, and anything else is kept as it is
+    """
+    if isinstance(error, (ValueError, KeyError, TypeError, IndexError, AssertionError)):
+        return ValueError(f"{reason}: {error!r}")
+    return error
+
+
+def run_search_job(job:dict) -> dict:
+    """
+    Runs a codebreaker search job and returns its results. Kept at module level so that it can be sent to worker
+    processes.
+
+    :param job: {'search': CodeBreaker function name (see SEARCHES), 'settings': the task settings, and optionally
+    'options': CodeBreaker options (see SEARCH_OPTIONS), 'arguments': arguments for the search function}
+    :return: {'summary': one line report, 'candidates': candidates searched, 'results': list of result dictionaries
+    (see SearchResult.as_dict)}
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        sink = open_sink('jsonl', os.path.join(directory, 'results.jsonl'))
+        e = CodeBreaker(job['settings'], sink=sink, **job.get('options', {}))
+        getattr(e, job['search'])(**job.get('arguments', {}))
+        sink.close()
+        results = []
+        if os.path.exists(sink.path):
+            with open(sink.path) as f:
+                results = [json.loads(line) for line in f]
+    return {'summary': e.summary(), 'candidates': e.candidates_searched, 'results': results}
+
+
+class EnigmaService:
+    """
+    Asynchronous encode/decode and codebreaker search service, for running the machine behind an API:
+    1. Encoding - concurrent requests are gathered for batch_window seconds (or until max_batch arrive) and encoded
+    together on a separate thread. Requests with the same rotors, ring settings, reflector and plugboard share one
+    compiled machine, which is turned to each request's start positions rather than rebuilt, and machines are kept
+    for later batches. Each request starts from its own initial_positions, so requests never affect each other.
+    Decoding is the same as encoding.
+    2. Searches - run in a pool of worker processes, so that a long search never blocks the event loop
+    The service can be called directly (encode, decode, search) or served over HTTP on a TCP port or a Unix socket
+    (see start and EnigmaClient). Nothing is printed.
+    """
+    def __init__(self, workers:int = 1, batch_window:float = 0.002, max_batch:int = 256):
+        """
+        :param workers: Number of processes for search jobs
+        :param batch_window: Seconds to wait for more encode requests to batch with the first
+        :param max_batch: Most encode requests in one batch
+        """
+        self.workers = workers
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.machines = OrderedDict()
+        # Encode requests waiting for the next batch, as (settings, message, non_alpha, future)
+        self.pending = []
+        self.flush_handle = None
+        # One encoder thread, so the machines are only ever used by one batch at a time
+        self.encoder = ThreadPoolExecutor(max_workers=1)
+        self.searchers = None
+        self.stats = {'requests': 0, 'batches': 0, 'largest_batch': 0, 'searches': 0}
+
+    async def encode(self, settings:dict, message:str, non_alpha:str = 'error') -> dict:
+        """
+        Encodes a message from the settings' initial positions
+
+        :param settings: Settings dictionary as used by Enigma
+        :param message: The message to be decoded/encoded
+        :param non_alpha: 'error', 'pass' or 'strip' - what to do with characters other than letters
+        :return: {'text': the encoded message, 'positions': the final rotor positions as letters}
+        """
+        if non_alpha not in NON_ALPHA_MODES:
+            raise ValueError(f"Unknown non_alpha mode: {non_alpha}, choose from {', '.join(NON_ALPHA_MODES)}")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((settings, message, non_alpha, future))
+        self.stats['requests'] += 1
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.batch_window, self.flush)
+        return await future
+
+    async def decode(self, settings:dict, message:str, non_alpha:str = 'error') -> dict:
+        """ Decodes a message; the machine is its own inverse, so this is encode """
+        return await self.encode(settings, message, non_alpha)
+
+    def flush(self):
+        """ Sends the pending encode requests to the encoder thread as one batch """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, []
+        if batch:
+            self.stats['batches'] += 1
+            self.stats['largest_batch'] = max(self.stats['largest_batch'], len(batch))
+            asyncio.ensure_future(self.run_batch(batch))
+
+    async def run_batch(self, batch:list):
+        """ Encodes a batch on the encoder thread and hands each request its result (or error) """
+        try:
+            outcomes = await asyncio.get_running_loop().run_in_executor(self.encoder, self.encode_batch, batch)
+            for (_, _, _, future), (result, error) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+        except Exception as error:
+            # No request is ever left waiting, whatever went wrong
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+
+    def encode_batch(self, batch:list) -> list:
+        """
+        Encodes each request of a batch, grouped by machine so each machine is compiled (or fetched) once. An error
+        only fails the requests it belongs to: a machine which cannot be built fails the requests sharing its
+        settings, and a message which cannot be encoded fails its own request.
+
+        :return: (result, error) for each request, in batch order
+        """
+        outcomes = [None] * len(batch)
+        groups = OrderedDict()
+        for i, (settings, message, non_alpha, _) in enumerate(batch):
+            try:
+                groups.setdefault(machine_key(settings), []).append(i)
+            except Exception as error:
+                outcomes[i] = (None, request_error(error, "Invalid settings"))
+        for key, requests in groups.items():
+            try:
+                machine = self.machine(key, batch[requests[0]][0])
+            except Exception as error:
+                for i in requests:
+                    outcomes[i] = (None, request_error(error, "Invalid settings"))
+                continue
+            for i in requests:
+                settings, message, non_alpha, _ = batch[i]
+                try:
+                    machine.set_positions(settings['initial_positions'])
+                    text = ''.join(machine.encode_stream([message], non_alpha))
+                    outcomes[i] = ({'text': text, 'positions': machine.position_letters}, None)
+                except Exception as error:
+                    outcomes[i] = (None, request_error(error, "Cannot encode"))
+        return outcomes
+
+    def machine(self, key:tuple, settings:dict) -> CompiledEnigma:
+        """ Returns the compiled machine for the key, compiling it if it is not in the cache """
+        machine = self.machines.get(key)
+        if machine is None:
+            machine = self.machines[key] = CompiledEnigma(settings)
+            if len(self.machines) > MACHINE_CACHE_SIZE:
+                self.machines.popitem(last=False)
+        else:
+            self.machines.move_to_end(key)
+        return machine
+
+    async def search(self, search:str, settings:dict, options:dict = None, arguments:dict = None) -> dict:
+        """
+        Runs a codebreaker search in the worker pool (see run_search_job)
+
+        :param search: CodeBreaker function name (see SEARCHES)
+        :param settings: The task settings, as for CodeBreaker
+        :param options: CodeBreaker options (see SEARCH_OPTIONS)
+        :param arguments: Arguments for the search function, i.e. {'restarts': 10} for codebreak_plugboard_climb
+        """
+        if search not in SEARCHES:
+            raise ValueError(f"Unknown search: {search}, choose from {', '.join(SEARCHES)}")
+        options = options or {}
+        for option in options:
+            if option not in SEARCH_OPTIONS:
+                raise ValueError(f"Unknown search option: {option}, choose from {', '.join(SEARCH_OPTIONS)}")
+        if self.searchers is None:
+            self.searchers = ProcessPoolExecutor(max_workers=self.workers)
+        self.stats['searches'] += 1
+        job = {'search': search, 'settings': settings, 'options': options, 'arguments': arguments or {}}
+        return await asyncio.get_running_loop().run_in_executor(self.searchers, run_search_job, job)
+
+    async def start(self, host:str = '127.0.0.1', port:int = 8765, path:str = None) -> asyncio.AbstractServer:
+        """
+        Starts serving HTTP requests (see handle) on a TCP port, or on a Unix socket if path is given
+
+        :param port: TCP port (0 picks a free port, see the server's sockets)
+        :param path: Unix socket path
+        """
+        if path:
+            return await asyncio.start_unix_server(self.handle, path=path)
+        return await asyncio.start_server(self.handle, host, port)
+
+    def close(self):
+        """ Shuts down the encoder thread and search workers """
+        self.encoder.shutdown(wait=False)
+        if self.searchers is not None:
+            self.searchers.shutdown()
+
+    async def handle(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        """
+        Serves one HTTP/1.1 request with a JSON body and a JSON reply, then closes the connection:
+        GET /health, POST /encode and /decode ({'settings', 'message', 'non_alpha'}) and POST /search ({'search',
+        'settings', 'options', 'arguments'}). Errors are replied to as {'error': message}.
+        """
+        try:
+            status, reply = await self.respond(reader)
+        except (ValueError, asyncio.IncompleteReadError) as error:
+            status, reply = 400, {'error': f"Bad request: {error}"}
+        body = json.dumps(reply).encode()
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def respond(self, reader:asyncio.StreamReader) -> tuple:
+        """ Reads a request and returns the (status, reply) for it """
+        method, route, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length > MAX_BODY:
+            return 413, {'error': f"Request body over {MAX_BODY} bytes"}
+        request = json.loads(await reader.readexactly(length)) if length else {}
+
+        routes = {'/health': 'GET', '/encode': 'POST', '/decode': 'POST', '/search': 'POST'}
+        if route not in routes:
+            return 404, {'error': f"Unknown route: {route}"}
+        if method != routes[route]:
+            return 405, {'error': f"Use {routes[route]} for {route}"}
+        try:
+            if route == '/health':
+                return 200, {'status': 'ok', 'stats': self.stats}
+            if route == '/search':
+                return 200, await self.search(request['search'], request['settings'], request.get('options'),
+                                              request.get('arguments'))
+            action = self.encode if route == '/encode' else self.decode
+            return 200, await action(request['settings'], request['message'], request.get('non_alpha', 'error'))
+        except (ValueError, KeyError, TypeError) as error:
+            return 400, {'error': str(error)}
+        except Exception as error:
+            return 500, {'error': f"{type(error).__name__}: {error}"}
+
+
+class EnigmaClient:
+    """
+    Client for an EnigmaService served over HTTP, i.e. from a test or another process on the same host. Errors
+    replied by the service are raised as ValueError (bad requests) or RuntimeError (anything else).
+    """
+    def __init__(self, host:str = '127.0.0.1', port:int = 8765, path:str = None):
+        """
+        :param host: Service host
+        :param port: Service TCP port
+        :param path: Service Unix socket path, in place of host and port
+        """
+        self.host = host
+        self.port = port
+        self.path = path
+
+    async def request(self, method:str, route:str, payload:dict = None) -> dict:
+        """ Sends one request and returns the decoded JSON reply """
+        if self.path:
+            reader, writer = await asyncio.open_unix_connection(self.path)
+        else:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode() if payload is not None else b''
+        writer.write(f"{method} {route} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+        try:
+            status = int((await reader.readline()).split()[1])
+            length = None
+            while True:
+                line = (await reader.readline()).decode('latin-1')
+                if line in ('\r\n', '\n', ''):
+                    break
+                name, value = line.split(':', 1)
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            reply = json.loads(await reader.readexactly(length) if length is not None else await reader.read())
+        finally:
+            writer.close()
+        if status >= 500:
+            raise RuntimeError(reply.get('error'))
+        if status >= 400:
+            raise ValueError(reply.get('error'))
+        return reply
+
+    async def encode(self, settings:dict, message:str, non_alpha:str = 'error') -> dict:
+        """ Encodes a message (see EnigmaService.encode) """
+        return await self.request('POST', '/encode', {'settings': settings, 'message': message,
+                                                      'non_alpha': non_alpha})
+
+    async def decode(self, settings:dict, message:str, non_alpha:str = 'error') -> dict:
+        """ Decodes a message (see EnigmaService.decode) """
+        return await self.request('POST', '/decode', {'settings': settings, 'message': message,
+                                                      'non_alpha': non_alpha})
+
+    async def search(self, search:str, settings:dict, options:dict = None, arguments:dict = None) -> dict:
+        """ Runs a codebreaker search (see EnigmaService.search) """
+        return await self.request('POST', '/search', {'search': search, 'settings': settings, 'options': options,
+                                                      'arguments': arguments})
+
+    async def health(self) -> dict:
+        """ Returns the service status and request counters """
+        return await self.request('GET', '/health')
+
+
+def serve(host:str = '127.0.0.1', port:int = 8765, path:str = None, workers:int = 1):
+    """ Runs an EnigmaService until interrupted """
+    async def run():
+        service = EnigmaService(workers=workers)
+        server = await service.start(host, port, path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            service.close()
+    asyncio.run(run())
@@ -0,0 +1,222 @@
+import functools
+import importlib
+import json
+import os
+import threading
+import time
+
+# The methods timed for each stage, as (module, class, method). Nothing is changed until Telemetry.install, so the
+# stages cost nothing unless telemetry is turned on.
+STAGES = {'construction': [('enigma', 'Enigma', 'create_machinery'), ('engine', 'CompiledEnigma', '__init__')],
+          'stepping': [('enigma', 'Rotor', 'key_press'), ('engine', 'CompiledEnigma', 'key_press'),
+                       ('engine', 'CompiledEnigma', 'set_positions')],
+          'rotor_passes': [('enigma', 'Rotor', 'rotor_encode_left'), ('enigma', 'Rotor', 'rotor_encode_right'),
+                           ('engine', 'ScramblerCycles', '__init__'), ('engine', 'CompiledEnigma', 'scrambler_tables'),
+                           ('engine', 'CompiledEnigma', 'reflector_passes')],
+          'plugboard': [('plugboard', 'Plugboard', 'encode'), ('engine', 'CompiledEnigma', 'compile_plugboard')],
+          'encode': [('enigma', 'Enigma', 'encode'), ('engine', 'CompiledEnigma', 'encode'),
+                     ('engine', 'CompiledEnigma', 'encode_cached'), ('engine', 'CompiledEnigma', 'encode_with_scrambler'),
+                     ('engine', 'CompiledEnigma', 'encode_into'), ('batch', 'BatchEnigma', 'encode'),
+                     ('engine', 'ReflectorPasses', 'decode')],
+          'crib_check': [('cribs', 'CribMatcher', 'contains'), ('cribs', 'CribMatcher', 'found'),
+                         ('engine', 'CompiledEnigma', 'find_crib'), ('batch', 'BatchEnigma', 'contains')],
+          'result_writes': [('results', 'ResultSink', 'write'), ('results', 'ResultSink', 'flush')]}
+
+
+class Telemetry:
+    """
+    Optional instrumentation of the machine and the codebreaker searches: calls and seconds spent in each stage (see
+    STAGES), and the candidates, hits and candidates/s of each search. Installing it wraps the timed methods, and
+    uninstalling puts the originals back, so there is no cost at all when it is not installed. Snapshots are saved as
+    JSON or in the Prometheus text format, every interval seconds while installed and on uninstalling.
+
+    Stages nest (i.e. a search's encoding includes its stepping), so their seconds overlap rather than add up. Only work
+    in this process is timed: with workers, the stages of the candidates decoded in worker processes are not counted,
+    though the search totals are.
+    """
+    def __init__(self, path:str = None, interval:float = 10.0, stages:dict = STAGES):
+        """
+        :param path: File to save snapshots to - Prometheus text format if it ends in .prom or .txt, JSON otherwise
+        :param interval: Seconds between snapshots while installed (0 to save only on uninstalling)
+        :param stages: The methods to time, by stage name
+        """
+        self.path = path
+        self.interval = interval
+        self.stages = stages
+        # [calls, seconds] for each stage, and the number of calls of each stage currently running, so that a call
+        # within a call of the same stage is only timed once
+        self.timings = {stage: [0, 0.0] for stage in stages}
+        self.depth = {stage: 0 for stage in stages}
+        self.searches = {}
+        self.originals = []
+        self.lock = threading.Lock()
+        # Held while saving and while the periodic snapshots are scheduled or cancelled, so that a snapshot being saved
+        # by the timer never races the final one
+        self.save_lock = threading.RLock()
+        self.timer = None
+        self.started = None
+
+    def install(self) -> 'Telemetry':
+        """ Wraps the timed methods and starts the periodic snapshots """
+        if self.originals:
+            return self
+        for stage, methods in self.stages.items():
+            for module_name, class_name, method_name in methods:
+                try:
+                    cls = getattr(importlib.import_module(module_name), class_name)
+                except ImportError:
+                    # The batch backend needs NumPy, which is optional
+                    continue
+                original = cls.__dict__[method_name]
+                self.originals.append((cls, method_name, original))
+                if isinstance(original, staticmethod):
+                    setattr(cls, method_name, staticmethod(self.timed(stage, original.__func__)))
+                else:
+                    setattr(cls, method_name, self.timed(stage, original))
+        from codebreak import CodeBreaker
+        original = CodeBreaker.__dict__['run_search']
+        self.originals.append((CodeBreaker, 'run_search', original))
+        setattr(CodeBreaker, 'run_search', self.timed_search(original))
+        self.started = time.perf_counter()
+        self.schedule()
+        return self
+
+    def uninstall(self):
+        """ Puts the original methods back and saves a final snapshot """
+        with self.save_lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        for cls, method_name, original in reversed(self.originals):
+            setattr(cls, method_name, original)
+        self.originals = []
+        if self.path:
+            self.save()
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc_info):
+        self.uninstall()
+
+    def timed(self, stage:str, method):
+        """ Returns the method wrapped to add its calls and seconds to the stage """
+        timing = self.timings[stage]
+        depth = self.depth
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            timing[0] += 1
+            if depth[stage]:
+                return method(*args, **kwargs)
+            depth[stage] = 1
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                timing[1] += time.perf_counter() - start
+                depth[stage] = 0
+        return wrapper
+
+    def timed_search(self, run_search):
+        """
+        Returns CodeBreaker.run_search wrapped to add each search's candidates, hits and seconds to the searches. A
+        search resumed from a checkpoint only adds the candidates searched and results written since resuming.
+        """
+        @functools.wraps(run_search)
+        def wrapper(breaker, *args, **kwargs):
+            candidates, attempt = breaker.candidates_searched, breaker.attempt
+            progress = breaker.checkpoint.task(breaker.name) if breaker.checkpoint is not None else None
+            if progress is not None:
+                # run_search carries on the counts from the checkpoint, which were added by the run that saved it
+                candidates += progress['cursor']
+                attempt = progress['attempt']
+            start = time.perf_counter()
+            try:
+                return run_search(breaker, *args, **kwargs)
+            finally:
+                self.add_search(getattr(breaker, 'name', 'search'), breaker.candidates_searched - candidates,
+                                breaker.attempt - attempt, time.perf_counter() - start)
+        return wrapper
+
+    def add_search(self, name:str, candidates:int, hits:int, seconds:float):
+        """ Adds a run of a search to its totals """
+        with self.lock:
+            search = self.searches.setdefault(name, {'runs': 0, 'candidates': 0, 'hits': 0, 'seconds': 0.0})
+            search['runs'] += 1
+            search['candidates'] += candidates
+            search['hits'] += hits
+            search['seconds'] += seconds
+
+    def snapshot(self) -> dict:
+        """ Returns the stage timings and search totals so far, with each search's candidates/s and hit rate """
+        with self.lock:
+            searches = {name: dict(search) for name, search in self.searches.items()}
+        for search in searches.values():
+            search['candidates_per_second'] = search['candidates'] / search['seconds'] if search['seconds'] else 0.0
+            search['hit_rate'] = search['hits'] / search['candidates'] if search['candidates'] else 0.0
+        return {'timestamp': time.time(),
+                'seconds': time.perf_counter() - self.started if self.started is not None else 0.0,
+                'stages': {stage: {'calls': calls, 'seconds': seconds}
+                           for stage, (calls, seconds) in self.timings.items()},
+                'searches': searches}
+
+    def prometheus(self) -> str:
+        """ Returns a snapshot in the Prometheus text exposition format """
+        snapshot = self.snapshot()
+        lines = ['# HELP enigma_stage_calls_total Calls of the timed methods of each stage',
+                 '# TYPE enigma_stage_calls_total counter']
+        lines += [f'enigma_stage_calls_total{{stage="{stage}"}} {timing["calls"]}'
+                  for stage, timing in snapshot['stages'].items()]
+        lines += ['# HELP enigma_stage_seconds_total Seconds spent in the timed methods of each stage',
+                  '# TYPE enigma_stage_seconds_total counter']
+        lines += [f'enigma_stage_seconds_total{{stage="{stage}"}} {timing["seconds"]:.6f}'
+                  for stage, timing in snapshot['stages'].items()]
+        metrics = [('candidates', 'enigma_search_candidates_total', 'counter', 'Candidates searched'),
+                   ('hits', 'enigma_search_hits_total', 'counter', 'Results written'),
+                   ('seconds', 'enigma_search_seconds_total', 'counter', 'Seconds spent searching'),
+                   ('candidates_per_second', 'enigma_search_candidates_per_second', 'gauge', 'Search throughput'),
+                   ('hit_rate', 'enigma_search_hit_rate', 'gauge', 'Results written per candidate searched')]
+        for key, metric, kind, description in metrics:
+            lines += [f'# HELP {metric} {description}', f'# TYPE {metric} {kind}']
+            lines += [f'{metric}{{search="{name}"}} {search[key]}' for name, search in snapshot['searches'].items()]
+        return '\n'.join(lines) + '\n'
+
+    def save(self, path:str = None):
+        """ Writes a snapshot to the path (defaults to the path given when created) """
+        path = path or self.path
+        if path.endswith(('.prom', '.txt')):
+            text = self.prometheus()
+        else:
+            text = json.dumps(self.snapshot(), indent=2)
+        # Write to a temporary file first, so that a reader never sees a partly written snapshot
+        with self.save_lock:
+            with open(path + '.tmp', 'w') as f:
+                f.write(text)
+            os.replace(path + '.tmp', path)
+
+    def schedule(self):
+        """ Saves a snapshot every interval seconds, on a background thread, until uninstalled """
+        if not (self.path and self.interval):
+            return
+
+        def tick():
+            with self.save_lock:
+                # Uninstalled while this snapshot was waiting for the lock
+                if self.timer is not timer:
+                    return
+                self.save()
+                self.schedule()
+        timer = self.timer = threading.Timer(self.interval, tick)
+        timer.daemon = True
+        timer.start()
+
+    def report(self) -> str:
+        """ Returns a report of the stage timings and search totals, one line each """
+        snapshot = self.snapshot()
+        lines = [f"{stage}: {timing['calls']} calls, {timing['seconds']:.3f}s"
+                 for stage, timing in snapshot['stages'].items() if timing['calls']]
+        lines += [f"{name}: {search['candidates']} candidates, {search['candidates_per_second']:.0f} candidates/s, "
+                  f"{search['hits']} hits ({search['hit_rate']:.2%})"
+                  for name, search in snapshot['searches'].items()]
+        return '\n'.join(lines)
@@ -0,0 +1,518 @@
+import os
+import pytest
+from codebreak import CodeBreaker
+
+
+def reflector_task():
+    return {'code': 'DMEXBMKYCVPNQBEDHXVPZGKMTFFBJRPJTLHLCHOTKOYXGGHZ',
+            'crib': 'SECRETS',
+            'rotors': 'Beta Gamma V',
+            'reflector': 'UNKNOWN',
+            'ring_settings': '04 02 14',
+            'initial_positions': 'M J M',
+            'plugboard_pairs': 'KI XN FL'}
+
+
+def test_codebreak1_reflector(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    CodeBreaker(reflector_task()).codebreak1_reflector()
+
+    output = (tmp_path / 'codebreak.txt').read_text()
+    assert 'Reflector : C\n' in output
+    assert 'Output code : NICEWORKYOUVEMANAGEDTODECODETHEFIRSTSECRETSTRING\n' in output
+
+
+def test_parallel_search_matches_serial(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    CodeBreaker(reflector_task()).codebreak1_reflector()
+    serial = (tmp_path / 'codebreak.txt').read_text()
+    (tmp_path / 'codebreak.txt').unlink()
+
+    CodeBreaker(reflector_task(), workers=2, chunk_size=1).codebreak1_reflector()
+    assert (tmp_path / 'codebreak.txt').read_text() == serial
+
+
+def test_possible_offsets():
+    from cribs import possible_offsets
+
+    # At offsets 0 and 2 one of the crib letters would have been encoded to itself
+    assert possible_offsets('XBAY', 'AB') == [1]
+
+
+def test_early_abort_decodes_less(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    full = CodeBreaker(reflector_task())
+    full.codebreak1_reflector()
+    expected = (tmp_path / 'codebreak.txt').read_text()
+    (tmp_path / 'codebreak.txt').unlink()
+
+    early = CodeBreaker(reflector_task(), early_abort=True, crib_offsets=[36])
+    early.codebreak1_reflector()
+    assert (tmp_path / 'codebreak.txt').read_text() == expected
+    assert early.characters_decoded < full.characters_decoded
+
+    # The plugboard and reflector searches already decode each candidate through tables shared across candidates, in
+    # a lookup or two per character, so they refuse early_abort rather than ignore it
+    for task, search in ((pluglead_task('WP RJ A? VF I? HN CG BS'), 'codebreak4_plugleads'),
+                         (rewiring_task(), 'codebreak5_rewiring')):
+        with pytest.raises(ValueError):
+            getattr(CodeBreaker(task, early_abort=True), search)()
+
+
+def pluglead_task(plugboard_pairs):
+    return {'code': 'SDNTVTPHRBNWTLMZTQKZGADDQYPFNHBPNHCQGBGMZPZLUAVGDQVYRBFYYEIXQWVTHXGNW',
+            'crib': 'TUTOR',
+            'rotors': 'V III IV',
+            'reflector': 'A',
+            'ring_settings': '24 12 10',
+            'initial_positions': 'S W U',
+            'plugboard_pairs': plugboard_pairs}
+
+
+def rewiring_task():
+    return {'code': 'HWREISXLGTTBYVXRCWWJAKZDTVZWKBDJPVQYNEQIOTIFX',
+            'crib': ['FACEBOOK', 'INSTAGRAM', 'TWITTER', 'SNAPCHAT', 'YOUTUBE', 'REDDIT', 'LINKEDIN'],
+            'rotors': 'V II IV',
+            'reflector': 'A',
+            'ring_settings': '6 18 7',
+            'initial_positions': 'A J L',
+            'plugboard_pairs': 'UG IE PO NX WT'}
+
+
+def test_pluglead_candidates_any_number_of_unknown_plugs():
+    candidates = list(CodeBreaker(pluglead_task('WP RJ ?? VF I? HN CG BS')).pluglead_candidates())
+
+    # 13 free letters for 3 unknown plugs, with each '??' lead only tried one way round
+    assert len(candidates) == 13 * 12 * 11 // 2
+    assert all(pairs[6] < pairs[7] for pairs in (c['plugboard_pairs'] for c in candidates))
+
+
+def test_codebreak4_plugleads(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    CodeBreaker(pluglead_task('WP RJ A? VF I? HN CG BS')).codebreak4_plugleads()
+
+    output = (tmp_path / 'codebreak.txt').read_text()
+    assert 'Plugboard Pairs : WP RJ AT VF IK HN CG BS\n' in output
+    assert 'Output code : NOTUTORSWEREHARMEDNORIMPLICATEDOFCRIMESDURINGTHEMAKINGOFTHESEEXAMPLES\n' in output
+
+
+def test_reflector_rewirings_are_distinct():
+    from catalogue import ROTOR_CATALOGUE
+    from codebreak import reflector_rewirings
+
+    standard = ROTOR_CATALOGUE['A']['contacts']
+    rewirings = list(reflector_rewirings(standard))
+
+    # 13C2 * 11C2 / 2 unordered pairs of duos, each duo cross-connected one of 2 ways
+    assert len(rewirings) == len(set(rewirings)) == 8580
+    for contacts in rewirings[:50]:
+        assert sum(a != b for a, b in zip(contacts, standard)) == 8
+
+
+def test_reflector_passes_match_machine():
+    from engine import CompiledEnigma
+    from codebreak import reflector_rewirings
+
+    settings = {'rotors': 'V II IV', 'reflector': 'A', 'ring_settings': '6 18 7',
+                'initial_positions': 'A J L', 'plugboard_pairs': 'UG IE PO NX WT'}
+    code = 'HWREISXLGTTBYVXRCWWJAKZDTVZWKBDJPVQYNEQIOTIFX'
+    passes = CompiledEnigma(settings).reflector_passes(code)
+    for contacts in list(reflector_rewirings('EJMZALYXVBWFCRQUONTSPIKHGD'))[::997]:
+        machine = CompiledEnigma(dict(settings, reflector_contacts=contacts))
+        assert passes.decode(contacts) == machine.encode(code)
+
+
+def test_results_sinks(tmp_path, monkeypatch):
+    import csv
+    import json
+    from results import open_sink
+
+    monkeypatch.chdir(tmp_path)
+    CodeBreaker(reflector_task(), sink=open_sink('jsonl', buffer_size=1)).codebreak1_reflector()
+    CodeBreaker(reflector_task(), sink=open_sink('csv')).codebreak1_reflector()
+
+    [record] = [json.loads(line) for line in (tmp_path / 'codebreak.jsonl').read_text().splitlines()]
+    assert record['settings']['reflector'] == 'C'
+    assert record['crib'] == 'SECRETS'
+    assert record['crib_offset'] == 36
+    assert record['decoded'] == 'NICEWORKYOUVEMANAGEDTODECODETHEFIRSTSECRETSTRING'
+
+    with open(tmp_path / 'codebreak.csv', newline='') as f:
+        [row] = list(csv.DictReader(f))
+    assert row['reflector'] == 'C'
+    assert row['crib_offset'] == '36'
+    assert not (tmp_path / 'codebreak.txt').exists()
+
+
+def test_scored_search_without_crib(tmp_path, monkeypatch):
+    import json
+    from results import open_sink
+
+    monkeypatch.chdir(tmp_path)
+    settings = {'code': 'CMFSUPKNCBMUYEQVVDYKLRQZTPUFHSWWAKTUGXMPAMYAFITXIJKMH',
+                'rotors': 'Beta I III',
+                'reflector': 'B',
+                'ring_settings': '23 02 10',
+                'initial_positions': 'UNKNOWN',
+                'plugboard_pairs': 'VH PT ZG BJ EY FS'}
+    e = CodeBreaker(settings, scorer='quadgram', top_k=3, sink=open_sink('jsonl'))
+    e.codebreak2_positions()
+
+    records = [json.loads(line) for line in (tmp_path / 'codebreak.jsonl').read_text().splitlines()]
+    assert len(records) == 3
+    assert records[0]['settings']['initial_positions'] == 'I M G'
+    assert records[0]['decoded'] == 'IHOPEYOUAREENJOYINGTHEUNIVERSITYOFBATHEXPERIENCESOFAR'
+    assert records[0]['score'] > records[1]['score'] > records[2]['score']
+
+
+def test_index_of_coincidence():
+    from scoring import Scorer, index_of_coincidence
+
+    assert index_of_coincidence('AABB') == pytest.approx(1 / 3)
+    assert index_of_coincidence([0, 0, 1, 1]) == pytest.approx(1 / 3)
+    assert index_of_coincidence('A') == 0.0
+    assert Scorer('ioc').score('NICEWORKYOUVEMANAGED') == index_of_coincidence('NICEWORKYOUVEMANAGED')
+
+
+def test_batch_scores_match_scalar_scores():
+    np = pytest.importorskip('numpy')
+    from batch import BatchEnigma
+    from scoring import METHODS, Scorer
+
+    texts = ['NICEWORKYOUVEMANAGEDTODECODE', 'DMEXBMKYCVPNQBEDHXVPZGKMTFFB']
+    encoded = np.stack([BatchEnigma.message_indices(text) for text in texts])
+    for method in METHODS:
+        scorer = Scorer(method)
+        scores = [scorer.score(text) for text in texts]
+        assert scores[0] > scores[1]
+        assert np.allclose(scorer.score_batch(encoded), scores)
+
+
+def test_plugboard_climb_recovers_unknown_plugboard(tmp_path, monkeypatch):
+    from engine import CompiledEnigma
+    from results import open_sink
+
+    monkeypatch.chdir(tmp_path)
+    plugboard_pairs = 'AV BS CG DL FU HZ IN KM OW RX'
+    settings = {'rotors': 'II IV V',
+                'reflector': 'B',
+                'ring_settings': '2 21 12',
+                'initial_positions': 'A B L',
+                'plugboard_pairs': plugboard_pairs}
+    message = ('THEREISNOTHINGTHATCANBESAIDBYMATHEMATICALSYMBOLSANDRELATIONSWHICHCANNOTALSOBESAIDBYWORDSTHECONVERSE'
+               'HOWEVERISFALSEMUCHTHATCANBEANDISSAIDBYWORDSCANNOTSUCCESSFULLYBEPUTINTOEQUATIONSBECAUSEITISNONSENSE')
+    code = CompiledEnigma(settings).encode(message)
+
+    e = CodeBreaker(dict(settings, code=code, plugboard_pairs=''), scorer='quadgram', top_k=1,
+                    sink=open_sink('jsonl'))
+    e.codebreak_plugboard_climb(restarts=3, seed=1)
+    [(_, recovered, decoded)] = e.ranked
+    assert recovered['plugboard_pairs'] == plugboard_pairs
+    assert decoded == message
+
+
+def test_bombe_finds_start_positions():
+    from bombe import Menu, find_stops
+
+    code = 'CMFSUPKNCBMUYEQVVDYKLRQZTPUFHSWWAKTUGXMPAMYAFITXIJKMH'
+    settings = {'rotors': 'Beta I III',
+                'reflector': 'B',
+                'ring_settings': '23 02 10',
+                'plugboard_pairs': 'VH PT ZG BJ EY FS'}
+    menu = Menu(code, 'UNIVERSITY', 22)
+    # U is joined to Q by the first letter of the crib, and to E through the U in the code
+    assert menu.links[ord('U') - 65] == [(ord('Q') - 65, 0), (ord('E') - 65, 4)]
+    assert sorted(menu.components[0][1]) == [7, 8, 18, 19, 22, 24]
+    assert menu.loops() == 0
+
+    candidates = [dict(settings, initial_positions=f'I {middle} {right}') for middle in 'LMN' for right in 'FGH']
+    stops, tests = find_stops(code, 'UNIVERSITY', candidates, [22])
+    assert tests == 9
+    [(row, stop, decoded)] = stops
+    assert stop['initial_positions'] == 'I M G'
+    assert decoded == 'IHOPEYOUAREENJOYINGTHEUNIVERSITYOFBATHEXPERIENCESOFAR'
+
+
+def test_bombe_recovers_positions_and_plugboard(tmp_path, monkeypatch):
+    from engine import CompiledEnigma
+    from results import open_sink
+
+    monkeypatch.chdir(tmp_path)
+    settings = {'rotors': 'II IV V',
+                'reflector': 'B',
+                'ring_settings': '2 21 12',
+                'initial_positions': 'A B L',
+                'plugboard_pairs': 'AV BS CG DL FU HZ IN KM OW RX'}
+    message = 'THEREISNOTHINGTHATCANBESAIDBYMATHEMATICALSYMBOLSANDRELATIONS'
+    code = CompiledEnigma(settings).encode(message)
+
+    e = CodeBreaker(dict(settings, code=code, crib='SAIDBYMATHEMATICALSYMBOLS', initial_positions='UNKNOWN',
+                         plugboard_pairs='UNKNOWN'), crib_offsets=[23], sink=open_sink('jsonl'))
+    candidates = (candidate for candidate in e.start_position_candidates() if candidate['initial_positions'] < 'B')
+    e.codebreak_bombe(candidates)
+    assert e.candidates_searched == 26 * 26
+    [(_, stop, decoded)] = e.ranked
+    assert stop['initial_positions'] == 'A B L'
+    assert stop['plugboard_pairs'] == settings['plugboard_pairs']
+    assert decoded == message
+
+
+def test_search_space_size_and_order():
+    from searchspace import SearchSpace
+
+    e = CodeBreaker({'code': 'ABSKJAKKMRITTNYURBJFWQGRSGNNYJSDRYLAPQWIAGKJYEPCTAGDCTHLCDRZRFZHKNRSDLNPFPEBVESHPY',
+                     'crib': 'THOUSANDS',
+                     'rotors': 'UNKNOWN',
+                     'reflector': 'UNKNOWN',
+                     'ring_settings': 'UNKNOWN',
+                     'initial_positions': 'E M Y',
+                     'plugboard_pairs': 'FH TS BE UQ KD AL'})
+    space = e.multi_space()
+    candidates = list(space.candidates(e.settings))
+    assert space.size == len(candidates) == 24 * 3 * 7 * 6 * 5
+    assert candidates[0]['rotors'] == 'Beta Gamma II'
+    assert candidates[0]['ring_settings'] == '2 4 6'
+    assert space.candidate(4321, e.settings) == candidates[4321]
+    assert list(space.candidates(e.settings, 4321, 4325)) == candidates[4321:4325]
+    assert space.split(4) == [(0, 3780), (3780, 7560), (7560, 11340), (11340, 15120)]
+
+
+def test_search_space_removes_invalid_candidates():
+    from searchspace import SearchSpace
+
+    # An M4 takes Beta or Gamma on the left, and only there
+    space = SearchSpace([['Beta', 'I'], ['Gamma', 'I', 'II'], ['I', 'II'], ['I', 'III']], ['B'], positions=['A'] * 4,
+                        ring_settings=[[1]] * 4, plugboards=['AB CD', 'DC BA', 'AB AC', 'AB'])
+    assert space.rotor_orders == [('Beta', 'I', 'II', 'III'), ('Beta', 'II', 'I', 'III')]
+    assert space.plugboards == ['AB CD', 'AB']
+    assert space.size == 4
+
+    # The same ring setting written two ways is only tried once
+    space = SearchSpace([['I'], ['II'], ['III']], ['B'], positions=['A'] * 3,
+                        ring_settings=[['04', '4', 4, '5'], ['1'], ['01', '1']])
+    assert space.ring_slots == [['04', '5'], ['1'], ['01']]
+    assert space.size == 2
+    space = SearchSpace([['I'], ['II'], ['III']], ['B'], positions=['A'] * 3,
+                        ring_settings=[['04'], ['4', '5'], ['1']], distinct_ring_settings=True)
+    assert space.ring_combinations == [('04', '5', '1')]
+
+
+def test_interrupted_search_resumes_from_checkpoint(tmp_path, monkeypatch):
+    from checkpoint import Checkpoint
+
+    monkeypatch.chdir(tmp_path)
+    settings = {'code': 'CMFSUPKNCBMUYEQVVDYKLRQZTPUFHSWWAKTUGXMPAMYAFITXIJKMH',
+                'crib': 'UNIVERSITY',
+                'rotors': 'Beta I III',
+                'reflector': 'B',
+                'ring_settings': '23 02 10',
+                'initial_positions': 'UNKNOWN',
+                'plugboard_pairs': 'VH PT ZG BJ EY FS'}
+    CodeBreaker(settings).codebreak2_positions()
+    expected = (tmp_path / 'codebreak.txt').read_text()
+    (tmp_path / 'codebreak.txt').unlink()
+
+    def interrupted(candidates, stop):
+        for i, candidate in enumerate(candidates):
+            if i == stop:
+                raise KeyboardInterrupt
+            yield candidate
+
+    # Interrupt the search after the solution (I M G, candidate 5000 or so) has been found
+    e = CodeBreaker(settings, checkpoint=Checkpoint(interval=0))
+    e.name = 'codebreak2_positions'
+    e.attempt = 1
+    with pytest.raises(KeyboardInterrupt):
+        e.run_search(interrupted(e.position_candidates(), 6000))
+    assert Checkpoint().load().task('codebreak2_positions')['cursor'] == 5888
+
+    checkpoint = Checkpoint(interval=0).load()
+    checkpoint.truncate_results('codebreak.txt')
+    resumed = CodeBreaker(settings, checkpoint=checkpoint)
+    resumed.codebreak2_positions()
+    assert (tmp_path / 'codebreak.txt').read_text() == expected
+    # Counted once for each candidate over both runs, so the resumed run skipped the candidates already searched
+    assert resumed.characters_decoded == 15600 * len(settings['code'])
+    assert checkpoint.task('codebreak2_positions')['complete']
+
+
+def test_search_interrupted_between_hits_resumes_from_chunk(tmp_path, monkeypatch):
+    from checkpoint import Checkpoint
+
+    monkeypatch.chdir(tmp_path)
+    # Every reflector decodes to something with an E in it, so the single chunk has three hits
+    settings = dict(reflector_task(), crib='E')
+    CodeBreaker(settings).codebreak1_reflector()
+    expected = (tmp_path / 'codebreak.txt').read_text()
+    assert expected.count('Output code') == 3
+    (tmp_path / 'codebreak.txt').unlink()
+
+    e = CodeBreaker(settings, checkpoint=Checkpoint(interval=60))
+    write_output = e.write_output
+
+    def interrupted(score=None):
+        if e.attempt == 2:
+            raise KeyboardInterrupt
+        write_output(score)
+    e.write_output = interrupted
+    with pytest.raises(KeyboardInterrupt):
+        e.codebreak1_reflector()
+    progress = Checkpoint().load().task('codebreak1_reflector')
+    assert (progress['cursor'], progress['attempt']) == (0, 1)
+
+    checkpoint = Checkpoint(interval=60).load()
+    checkpoint.truncate_results('codebreak.txt')
+    CodeBreaker(settings, checkpoint=checkpoint).codebreak1_reflector()
+    assert (tmp_path / 'codebreak.txt').read_text() == expected
+
+
+def test_benchmarks_report_rates():
+    from benchmark import WORKER_COUNTS, compare, run_benchmarks, scaling
+
+    results = run_benchmarks(['encode_compiled_short_4_rotors', 'codebreak1_reflector_compiled'], quick=True, repeat=2)
+    reflector = results['benchmarks']['codebreak1_reflector_compiled']
+    assert reflector['unit'] == 'candidates'
+    assert reflector['items'] == 3
+    assert len(reflector['seconds']) == 2
+    assert results['benchmarks']['encode_compiled_short_4_rotors']['best_rate'] > 0
+    assert compare(results, results)[0].endswith('(1.00x)')
+
+    workers = WORKER_COUNTS[-1]
+    scaled = {'benchmarks': {'codebreak3_multi_workers_1': {'median_rate': 100.0},
+                             f'codebreak3_multi_workers_{workers}': {'median_rate': 150.0}}}
+    assert scaling(scaled) == [f"codebreak3_multi: {workers} workers 1.50x one worker "
+                               f"({1.5 / workers:.2f} efficiency, {os.cpu_count()} CPUs)"]
+
+
+def test_service_batches_encodes_and_runs_searches():
+    import asyncio
+    from enigma import Enigma
+    from service import EnigmaClient, EnigmaService
+
+    settings = {'rotors': 'I II III', 'reflector': 'B', 'ring_settings': '01 01 01', 'plugboard_pairs': 'AB CD'}
+    messages = [('A A Z', 'HELLOWORLD'), ('Q E V', 'ENIGMA'), ('A A Z', 'HELLO WORLD')]
+
+    async def run():
+        service = EnigmaService(batch_window=0.05)
+        server = await service.start(port=0)
+        client = EnigmaClient(port=server.sockets[0].getsockname()[1])
+        try:
+            encoded = await asyncio.gather(*[client.encode(dict(settings, initial_positions=positions), message,
+                                                           non_alpha='pass') for positions, message in messages])
+            decoded = await client.decode(dict(settings, initial_positions='A A Z'), encoded[0]['text'])
+            with pytest.raises(ValueError):
+                await client.encode(dict(settings, initial_positions='A A Z'), 'HELLO WORLD')
+            search = await client.search('codebreak1_reflector', reflector_task())
+            health = await client.health()
+        finally:
+            server.close()
+            await server.wait_closed()
+            service.close()
+        return encoded, decoded, search, health
+
+    encoded, decoded, search, health = asyncio.run(run())
+    for (positions, message), result in zip(messages, encoded):
+        machine = Enigma(dict(settings, initial_positions=positions))
+        machine.create_machinery()
+        assert result['text'] == ''.join(machine.encode_stream([message], 'pass'))
+        assert result['positions'] == machine.engine.position_letters
+    assert decoded['text'] == 'HELLOWORLD'
+    assert health['stats']['largest_batch'] == 3
+    assert [result['settings']['reflector'] for result in search['results']] == ['C']
+    assert search['candidates'] == 3
+
+
+def test_service_bad_request_only_fails_itself():
+    import asyncio
+    from enigma import Enigma
+    from service import EnigmaClient, EnigmaService
+
+    settings = {'rotors': 'I II III', 'reflector': 'B', 'ring_settings': '01 01 01', 'initial_positions': 'A A Z',
+                'plugboard_pairs': 'AB'}
+
+    async def run():
+        service = EnigmaService(batch_window=0.05)
+        server = await service.start(port=0)
+        client = EnigmaClient(port=server.sockets[0].getsockname()[1])
+        try:
+            # The malformed plugboard fails while the machine is compiled, in the same batch as the valid request
+            return await asyncio.wait_for(asyncio.gather(
+                client.encode(dict(settings, plugboard_pairs='ABC'), 'HELLOWORLD'),
+                client.encode(settings, 'HELLOWORLD'), return_exceptions=True), timeout=10)
+        finally:
+            server.close()
+            await server.wait_closed()
+            service.close()
+
+    bad, good = asyncio.run(run())
+    assert isinstance(bad, ValueError)
+    machine = Enigma(settings)
+    machine.create_machinery()
+    assert good['text'] == machine.encode('HELLOWORLD')
+
+
+def test_crib_matcher_finds_every_crib_in_one_pass():
+    from cribs import CribMatcher
+
+    matcher = CribMatcher(['HE', 'SHE', 'HIS', 'HERS', 'SHE'])
+    assert matcher.matches('USHERS') == [('HE', 2), ('SHE', 1), ('HERS', 2)]
+    assert matcher.found('USHERS') == ['HE', 'SHE', 'HERS', 'SHE']
+    assert matcher.contains('AHISB') and not matcher.contains('HSIEH')
+    # Fed a piece at a time, cribs spanning two pieces are still found at their offsets in the whole message
+    scanner = matcher.scanner()
+    assert scanner.feed('US') == []
+    assert scanner.feed('HERS') == [('HE', 2), ('SHE', 1), ('HERS', 2)]
+    with pytest.raises(ValueError):
+        CribMatcher(['HE', ''])
+
+
+def test_telemetry_times_stages_and_searches(tmp_path, monkeypatch):
+    import json
+    from engine import CompiledEnigma
+    from telemetry import Telemetry
+
+    monkeypatch.chdir(tmp_path)
+    encode = CompiledEnigma.__dict__['encode']
+    with Telemetry(str(tmp_path / 'profile.json')) as telemetry:
+        assert CompiledEnigma.__dict__['encode'] is not encode
+        CodeBreaker(reflector_task()).codebreak1_reflector()
+    # Uninstalling puts the original methods back, so disabled telemetry costs nothing
+    assert CompiledEnigma.__dict__['encode'] is encode
+
+    snapshot = json.loads((tmp_path / 'profile.json').read_text())
+    assert snapshot['stages']['construction']['calls'] >= 1
+    assert snapshot['stages']['result_writes']['calls'] >= 1
+    assert snapshot['searches']['codebreak1_reflector']['candidates'] == 3
+    assert snapshot['searches']['codebreak1_reflector']['hits'] == 1
+    assert 'enigma_search_hits_total{search="codebreak1_reflector"} 1' in telemetry.prometheus()
+
+    # A search interrupted and resumed from its checkpoint counts each candidate and result once over both runs
+    from checkpoint import Checkpoint
+
+    def interrupted(candidates):
+        for i, candidate in enumerate(candidates):
+            if i == 2:
+                raise KeyboardInterrupt
+            yield candidate
+
+    with Telemetry() as telemetry:
+        e = CodeBreaker(reflector_task(), chunk_size=1, checkpoint=Checkpoint(interval=0))
+        e.name = 'codebreak1_reflector'
+        e.attempt = 1
+        with pytest.raises(KeyboardInterrupt):
+            e.run_search(interrupted(e.reflector_candidates()))
+        checkpoint = Checkpoint(interval=0).load()
+        checkpoint.truncate_results('codebreak.txt')
+        CodeBreaker(reflector_task(), chunk_size=1, checkpoint=checkpoint).codebreak1_reflector()
+    search = telemetry.snapshot()['searches']['codebreak1_reflector']
+    assert search['runs'] == 2
+    assert search['candidates'] == 3
+    assert search['hits'] == 1
+
+    # Snapshots saved by the timer stop once uninstalled, and never leave a partly written file behind
+    import time
+    with Telemetry(str(tmp_path / 'ticks.json'), interval=0.001) as telemetry:
+        time.sleep(0.05)
+    assert telemetry.timer is None
+    assert json.loads((tmp_path / 'ticks.json').read_text())['stages']
+    assert not (tmp_path / 'ticks.json.tmp').exists()
@@ -1,6 +1,7 @@
 import pytest
 from enigma import *
 from plugboard import *
+from engine import CompiledEnigma
 
 
 def test_raises_duplicatedplugs():
@@ -113,3 +114,327 @@ def test_machinedemo2():
 
     output=e.encode('BUPXWJCDPFASXBDHLBBIBSRNWCSZXQOLBNXYAXVHOGCUUIBCVMPUZYUUKHI')
     assert output == 'CONGRATULATIONSONPRODUCINGYOURWORKINGENIGMAMACHINESIMULATOR'
+
+
+def test_compiled_machine_matches_enigma():
+    settings = {'rotors': "IV V Beta I",
+                'reflector': 'A',
+                'ring_settings': '18 24 3 5',
+                'initial_positions': 'E Z G P',
+                'plugboard_pairs': 'PC XZ FM QA ST NB HY OR EV IU'}
+    e = Enigma(settings)
+    e.create_machinery()
+    machine = CompiledEnigma(settings, e.rotor_box, Plugboard(settings))
+
+    output = machine.encode('BUPXWJCDPFASXBDHLBBIBSRNWCSZXQOLBNXYAXVHOGCUUIBCVMPUZYUUKHI')
+    assert output == 'CONGRATULATIONSONPRODUCINGYOURWORKINGENIGMAMACHINESIMULATOR'
+    assert machine.position_letters == 'EZJW'
+
+
+def test_encode_continues_from_rotor_positions():
+    settings = {'rotors': "I II III",
+                'reflector': 'B',
+                'ring_settings': '1 1 1',
+                'initial_positions': 'A A Z',
+                'plugboard_pairs': 'HL MO AJ CX BZ SR NI YW DG PK'}
+    e = Enigma(settings)
+    e.create_machinery()
+
+    output = e.encode('HELLO') + e.encode('WORLD')
+    assert output == 'RFKTMBXVVW'
+    assert e.root.left.position == 'J'
+
+
+def test_encode_result_is_quiet(capsys):
+    settings = {'rotors': "I II III",
+                'reflector': 'B',
+                'ring_settings': '1 1 1',
+                'initial_positions': 'A A Z',
+                'plugboard_pairs': None}
+    e = Enigma(settings)
+    e.create_machinery()
+
+    result = e.encode_result('A')
+    assert result.text == 'U'
+    assert result.positions == (0, 0, 0)
+    assert result.position_letters == 'AAA'
+    assert capsys.readouterr().out == ''
+    # The machine reports the same final positions, leftmost rotor first
+    assert e.rotor_positions == result.positions
+    assert e.position_letters == result.position_letters
+    ''.join(e.encode_stream(['B C'], 'pass'))
+    assert e.rotor_positions == (0, 0, 2)
+
+
+def test_batch_matches_enigma():
+    pytest.importorskip('numpy')
+    from batch import BatchEnigma
+
+    configs = [{'rotors': "I II III", 'reflector': 'B', 'ring_settings': '1 1 1',
+                'initial_positions': 'A A Z', 'plugboard_pairs': 'HL MO AJ CX BZ SR NI YW DG PK'},
+               {'rotors': "IV V Beta I", 'reflector': 'A', 'ring_settings': '18 24 3 5',
+                'initial_positions': 'E Z G P', 'plugboard_pairs': 'PC XZ FM QA ST NB HY OR EV IU'},
+               {'rotors': "II IV III", 'reflector': 'C', 'ring_settings': '2 5 26',
+                'initial_positions': 'K D U', 'plugboard_pairs': None}]
+    message = 'BUPXWJCDPFASXBDHLBBIBSRNWCSZXQOLBNXYAXVHOGCUUIBCVMPUZYUUKHI' * 10
+    expected = []
+    for settings in configs:
+        e = Enigma(settings)
+        e.create_machinery()
+        expected.append(e.encode(message))
+
+    encoded = BatchEnigma(configs, Enigma(configs[0]).rotor_box).encode(message)
+    assert BatchEnigma.texts(encoded) == expected
+    assert list(BatchEnigma.contains(encoded, 'CONGRATULATIONS')) == [False, True, False]
+
+
+def test_compiled_machine_set_positions_and_clone():
+    settings = {'rotors': "I II III",
+                'reflector': 'B',
+                'ring_settings': '1 1 1',
+                'initial_positions': 'Q E V',
+                'plugboard_pairs': None}
+    machine = CompiledEnigma(settings, Enigma(settings).rotor_box)
+    machine.set_positions('A A Z')
+    copy = machine.clone()
+
+    assert machine.encode('A') == 'U'
+    assert copy.position_letters == 'AAZ'
+    copy.set_positions([16, 4, 21])
+    assert copy.encode('A') == 'L'
+
+
+def test_rotor_tables_are_shared():
+    from catalogue import ROTOR_CATALOGUE, cache_stats, clear_caches
+
+    clear_caches()
+    settings = {'rotors': "I II I",
+                'reflector': 'B',
+                'ring_settings': '1 1 1',
+                'initial_positions': 'A A A',
+                'plugboard_pairs': None}
+    first = CompiledEnigma(settings, ROTOR_CATALOGUE)
+    second = CompiledEnigma(settings, ROTOR_CATALOGUE)
+
+    assert first.forward[0] is second.forward[0]
+    stats = cache_stats()['rotor_tables']
+    assert (stats['hits'], stats['misses']) == (4, 2)
+    with pytest.raises(TypeError):
+        ROTOR_CATALOGUE['I']['contacts'] = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def test_plugboard_table():
+    plugboard = Plugboard(pairs='AB CZ')
+
+    assert plugboard.encode('A') == 'B'
+    assert plugboard.encode('Z') == 'C'
+    assert plugboard.encode('D') == 'D'
+    assert plugboard.table[:4] == [1, 0, 25, 3]
+    with pytest.raises(ValueError):
+        plugboard.add(PlugLead('DC'))
+
+
+def test_encode_stream_matches_encode():
+    import io
+
+    settings = {'rotors': "I II III",
+                'reflector': 'B',
+                'ring_settings': '1 1 1',
+                'initial_positions': 'A A Z',
+                'plugboard_pairs': 'HL MO AJ CX BZ SR NI YW DG PK'}
+    e = Enigma(settings)
+    e.create_machinery()
+    expected = e.encode('HELLOWORLD')
+
+    e = Enigma(settings)
+    e.create_machinery()
+    # Chunks split mid-word, from a file-like object read 3 characters at a time
+    assert ''.join(e.encode_stream(io.StringIO('HELLOWORLD'), chunk_size=3)) == expected
+    assert e.root.left.position == 'J'
+
+    e = Enigma(settings)
+    e.create_machinery()
+    passed = ''.join(e.encode_stream(['HEL', 'LO, WO', 'RLD!\n'], non_alpha='pass'))
+    assert passed == expected[:5] + ', ' + expected[5:] + '!\n'
+
+    e = Enigma(settings)
+    e.create_machinery()
+    assert ''.join(e.encode_stream(['HELLO, ', 'WORLD!'], non_alpha='strip')) == expected
+
+    e = Enigma(settings)
+    e.create_machinery()
+    with pytest.raises(ValueError):
+        list(e.encode_stream(['HELLO WORLD']))
+
+
+def test_encode_bytes_matches_encode(tmp_path):
+    settings = {'rotors': "I II III",
+                'reflector': 'B',
+                'ring_settings': '1 1 1',
+                'initial_positions': 'A A Z',
+                'plugboard_pairs': 'HL MO AJ CX BZ SR NI YW DG PK'}
+    text = 'HELLO, WORLD!\n' * 30000
+    machine = CompiledEnigma(settings)
+    expected = ''.join(machine.encode_stream([text], non_alpha='pass')).encode()
+
+    # Long enough to be encoded by the cycle of rotor positions
+    bytes_machine = CompiledEnigma(settings)
+    assert bytes_machine.encode_bytes(text.encode(), non_alpha='pass') == expected
+    assert bytes_machine.positions == machine.positions
+
+    # In place, one byte at a time
+    buffer = bytearray(b'HELLOWORLD')
+    assert CompiledEnigma(settings).encode_into(buffer, buffer) == 10
+    assert buffer == b'RFKTMBXVVW'
+
+    (tmp_path / 'input.txt').write_bytes(text.encode())
+    e = Enigma(settings)
+    e.create_machinery()
+    written = e.encode_mapped_file(str(tmp_path / 'input.txt'), str(tmp_path / 'output.txt'), non_alpha='strip',
+                                   chunk_size=100000)
+    assert written == 300000
+    assert (tmp_path / 'output.txt').read_bytes() == expected.replace(b', ', b'').replace(b'!\n', b'')
+
+    # A byte other than a letter in a later chunk leaves the output and the rotors as they were
+    (tmp_path / 'input.txt').write_bytes(b'HELLOWORLD' * 10000 + b'!')
+    positions = list(e.engine.positions)
+    with pytest.raises(ValueError):
+        e.encode_mapped_file(str(tmp_path / 'input.txt'), str(tmp_path / 'output.txt'), chunk_size=1000)
+    assert e.engine.positions == positions
+    assert (tmp_path / 'output.txt').read_bytes() == expected.replace(b', ', b'').replace(b'!\n', b'')
+    assert not (tmp_path / 'output.txt.tmp').exists()
+
+    with pytest.raises(ValueError):
+        CompiledEnigma(settings).encode_bytes(b'HELLO WORLD')
+
+
+def test_scrambler_sequence_is_shared_and_cycles():
+    import numpy as np
+
+    settings = {'rotors': "I II III",
+                'reflector': 'B',
+                'ring_settings': '1 1 1',
+                'initial_positions': 'A D U',
+                'plugboard_pairs': 'HL MO AJ'}
+    machine = CompiledEnigma(settings)
+    sequence = machine.scrambler_sequence(20000)
+    assert sequence.shape == (20000, 26)
+    # The positions run round a cycle of 16900 key presses (after the double step), so the permutations do too
+    states, start = machine.position_cycle()
+    assert len(states) - start == 16900
+    array = np.asarray(sequence)
+    assert (array[1:3] == np.array(machine.scrambler_tables(3)[1:])).all()
+    assert (array[start + 16900] == array[start]).all()
+    assert CompiledEnigma(settings).scrambler_cycles() is machine.scrambler_cycles()
+
+    message = 'CONGRATULATIONSONPRODUCINGYOURWORKINGENIGMAMACHINESIMULATOR'
+    for positions in ('A D U', 'Q E V', 'Z Z Z'):
+        expected = CompiledEnigma(dict(settings, initial_positions=positions))
+        cached = CompiledEnigma(dict(settings, initial_positions=positions))
+        assert cached.encode_cached(message, repeated=True) == expected.encode(message)
+        assert cached.positions == expected.positions
+        assert cached.encode_cached(message) == expected.encode(message)
+
+
+def test_scrambler_store_matches_computed_scramblers(tmp_path, monkeypatch):
+    import engine
+    from scrambler_store import ScramblerStore, build_store, machine_tables
+
+    path = str(tmp_path / 'scramblers.bin')
+    build_store(path, machine_tables(['I', 'II', 'III'], ['B'])[:1])
+    settings = {'rotors': 'I II III', 'reflector': 'B', 'ring_settings': '5 17 24', 'initial_positions': 'Q D V',
+                'plugboard_pairs': 'AB CD'}
+    message = 'HELLOWORLD' * 2000
+    expected = CompiledEnigma(settings).encode(message)
+
+    monkeypatch.setattr(engine, 'SCRAMBLER_STORE', None)
+    monkeypatch.setenv('ENIGMA_SCRAMBLER_STORE', '')
+    engine.load_scrambler_store(path)
+    try:
+        machine = CompiledEnigma(settings)
+        assert machine.scrambler_cycles().table is not None
+        assert machine.encode_cached(message) == expected
+        # Machines the store does not hold work out their own scramblers
+        other = dict(settings, reflector='C')
+        assert CompiledEnigma(other).scrambler_cycles().table is None
+        assert CompiledEnigma(other).encode_cached(message) == CompiledEnigma(other).encode(message)
+    finally:
+        engine.scrambler_cycles.cache_clear()
+
+    with open(path, 'r+b') as f:
+        f.seek(8)
+        f.write(b'\x02')
+    with pytest.raises(ValueError):
+        ScramblerStore(path)
+
+
+def test_key_sheet_encodes_in_order(tmp_path):
+    import csv
+    import json
+    from keysheet import encode_key_sheet
+
+    base = {'rotors': 'I II III', 'reflector': 'B', 'ring_settings': '1 1 1', 'plugboard_pairs': 'AB CD'}
+    records = [dict(base, id='a', initial_positions='A A Z', message='HELLOWORLD'),
+               dict(base, id='b', initial_positions='Q E V', message='ENIGMA'),
+               dict(base, id='c', initial_positions='A A Z', message='NOT LETTERS'),
+               dict(base, id='d', rotors='IV V II', initial_positions='B C D', message='HELLOWORLD')]
+    (tmp_path / 'sheet.jsonl').write_text(''.join(json.dumps(record) + '\n' for record in records))
+
+    with open(tmp_path / 'sheet.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(records[0]))
+        writer.writeheader()
+        writer.writerows(records)
+
+    expected = []
+    for record in records[:2] + records[3:]:
+        machine = Enigma(record)
+        machine.create_machinery()
+        expected.append(machine.encode(record['message']))
+
+    # Malformed records between valid ones only fail themselves, and no temporary output is left behind
+    malformed = [records[0], dict(base, id='x', plugboard_pairs='ABC', initial_positions='A A Z', message='HELLO'),
+                 records[1], dict(base, id='y', plugboard_pairs='AA', initial_positions='A A Z', message='HELLO')]
+    (tmp_path / 'malformed.jsonl').write_text(''.join(json.dumps(record) + '\n' for record in malformed) +
+                                              '{not json\n' + json.dumps(records[3]) + '\n')
+    stats = encode_key_sheet(str(tmp_path / 'malformed.jsonl'), str(tmp_path / 'malformed_out.jsonl'))
+    rows = [json.loads(line) for line in (tmp_path / 'malformed_out.jsonl').read_text().splitlines()]
+    assert [row['text'] for row in rows] == [expected[0], None, expected[1], None, None, expected[2]]
+    assert all(rows[i]['error'] for i in (1, 3, 4))
+    assert stats['errors'] == 3
+    assert not (tmp_path / 'malformed_out.jsonl.tmp').exists()
+
+    stats = encode_key_sheet(str(tmp_path / 'sheet.jsonl'), str(tmp_path / 'out.jsonl'), chunk_size=2)
+    rows = [json.loads(line) for line in (tmp_path / 'out.jsonl').read_text().splitlines()]
+    assert [row['id'] for row in rows] == ['a', 'b', 'c', 'd']
+    assert [row['text'] for row in rows[:2] + rows[3:]] == expected
+    assert rows[2]['error'] and rows[2]['text'] is None
+    assert stats['messages'] == 4 and stats['errors'] == 1 and stats['messages_per_second'] > 0
+
+    encode_key_sheet(str(tmp_path / 'sheet.csv'), str(tmp_path / 'out.csv'), workers=2, chunk_size=1)
+    with open(tmp_path / 'out.csv', newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['line'] for row in rows] == ['2', '3', '4', '5']
+    assert [row['text'] for row in rows[:2] + rows[3:]] == expected
+
+
+def test_key_sheet_groups_interleaved_settings(monkeypatch):
+    import keysheet
+
+    built = []
+
+    class CountedEnigma(CompiledEnigma):
+        def __init__(self, settings, *args):
+            built.append(settings['rotors'])
+            super().__init__(settings, *args)
+
+    monkeypatch.setattr(keysheet, 'CompiledEnigma', CountedEnigma)
+    monkeypatch.setattr(keysheet, 'MACHINES', keysheet.OrderedDict())
+    # Even with no machines kept between chunks, each bucket of settings in a chunk is compiled once
+    monkeypatch.setattr(keysheet, 'MACHINE_CACHE_SIZE', 0)
+    base = {'reflector': 'B', 'ring_settings': '1 1 1', 'plugboard_pairs': '', 'initial_positions': 'A A Z',
+            'message': 'HELLOWORLD'}
+    records = [(i, dict(base, rotors=('I II III', 'IV V II')[i % 2])) for i in range(10)]
+    rows = keysheet.encode_records(records)
+    assert sorted(built) == ['I II III', 'IV V II']
+    assert [row['line'] for row in rows] == list(range(10))
+    assert all(row['text'] for row in rows)